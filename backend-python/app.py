@@ -3,25 +3,60 @@ IPGrok Backend API - Python Flask Version
 Main application file
 """
 
-from flask import Flask, jsonify, request
+from flask import Flask, jsonify, request, g
 from flask_cors import CORS
-from flask_limiter import Limiter
-from flask_limiter.util import get_remote_address
 from dotenv import load_dotenv
+import logging
 import os
+import time
 from datetime import datetime
 
 from routes.test_results import test_results_bp
 from routes.analytics import analytics_bp
 from routes.auth import auth_bp
-from config.dynamodb import init_dynamodb
+from routes.speed_test import speed_test_bp
+from config.dynamodb import init_dynamodb, StorageUnavailableError
+from extensions import limiter
+from utils import metrics
+from utils.structured_logging import configure_logging, correlation_id, request_id_from, REQUEST_ID_HEADER
 
 # Load environment variables
 load_dotenv()
 
+# Structured JSON logs, written by a background thread
+configure_logging()
+logger = logging.getLogger(__name__)
+access_logger = logging.getLogger('access')
+ACCESS_LOG = os.getenv('LOG_ACCESS', 'true').lower() == 'true'
+
 # Initialize Flask app
 app = Flask(__name__)
 
+# Correlation ID for every log record written while handling the request
+# (registered first so it also covers requests the rate limiter rejects)
+@app.before_request
+def start_request():
+    g.request_started = time.perf_counter()
+    g.correlation_token = correlation_id.set(request_id_from(request.headers.get(REQUEST_ID_HEADER)))
+
+@app.after_request
+def finish_request(response):
+    response.headers[REQUEST_ID_HEADER] = correlation_id.get()
+    if ACCESS_LOG:
+        access_logger.info('%s %s %s', request.method, request.path, response.status_code, extra={
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'durationMs': round((time.perf_counter() - g.request_started) * 1000, 2)
+        })
+    return response
+
+@app.teardown_request
+def end_request(error=None):
+    token = g.pop('correlation_token', None)
+    if token is not None:
+        correlation_id.reset(token)
+
 # CORS configuration
 allowed_origins = [
     os.getenv('FRONTEND_URL', 'http://localhost:5173'),
@@ -34,18 +69,16 @@ CORS(app, resources={
     r"/*": {
         "origins": allowed_origins,
         "methods": ["GET", "POST", "DELETE", "OPTIONS", "PUT"],
-        "allow_headers": ["Content-Type", "Authorization"],
+        "allow_headers": ["Content-Type", "Authorization", "Idempotency-Key", REQUEST_ID_HEADER],
+        "expose_headers": ["Idempotent-Replayed", REQUEST_ID_HEADER],
         "supports_credentials": True
     }
 })
 
-# Rate limiting
-limiter = Limiter(
-    get_remote_address,
-    app=app,
-    default_limits=["100 per 15 minutes"],
-    storage_uri="memory://"
-)
+# Rate limiting (counters shared across worker processes via shared memory;
+# point RATELIMIT_STORAGE_URI at redis:// to share them across hosts)
+app.config['RATELIMIT_STORAGE_URI'] = os.getenv('RATELIMIT_STORAGE_URI', 'shm://')
+limiter.init_app(app)
 
 # Configuration
 app.config['MAX_CONTENT_LENGTH'] = 10 * 1024 * 1024  # 10MB max request size
@@ -58,6 +91,7 @@ init_dynamodb()
 app.register_blueprint(test_results_bp, url_prefix='/api/test-results')
 app.register_blueprint(analytics_bp, url_prefix='/api/analytics')
 app.register_blueprint(auth_bp, url_prefix='/api/auth')
+app.register_blueprint(speed_test_bp, url_prefix='/api/speed-test')
 
 # Health check endpoint
 @app.route('/health', methods=['GET'])
@@ -69,6 +103,16 @@ def health_check():
         'service': 'IPGrok Backend API (Python)'
     }), 200
 
+# Metrics endpoint
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """In-process counters and cache statistics for this worker"""
+    return jsonify({
+        'pid': os.getpid(),
+        'timestamp': datetime.utcnow().isoformat() + 'Z',
+        'metrics': metrics.snapshot()
+    }), 200
+
 # Root endpoint
 @app.route('/', methods=['GET'])
 def root():
@@ -78,8 +122,10 @@ def root():
         'version': '1.0.0',
         'endpoints': {
             'health': '/health',
+            'metrics': '/metrics',
             'test_results': '/api/test-results',
-            'analytics': '/api/analytics'
+            'analytics': '/api/analytics',
+            'speed_test': '/api/speed-test'
         }
     }), 200
 
@@ -92,11 +138,30 @@ def not_found(error):
         'message': f'The requested endpoint does not exist'
     }), 404
 
+# 429 handler (rate limit exceeded)
+@app.errorhandler(429)
+def rate_limited(error):
+    """Handle rate limit errors"""
+    return jsonify({
+        'error': 'Too many requests',
+        'message': f'Rate limit exceeded: {error.description}'
+    }), 429
+
+# 503 handler (DynamoDB throttling or circuit open, no cached response)
+@app.errorhandler(StorageUnavailableError)
+def storage_unavailable(error):
+    """Handle storage capacity errors"""
+    retry_after = max(1, int(round(error.retry_after)))
+    return jsonify({
+        'error': 'Service temporarily unavailable',
+        'message': 'Storage is at capacity, please retry shortly'
+    }), 503, {'Retry-After': str(retry_after)}
+
 # Global error handler
 @app.errorhandler(Exception)
 def handle_error(error):
     """Global error handler"""
-    app.logger.error(f'Unhandled error: {str(error)}')
+    logger.error('Unhandled error: %s', error, exc_info=error)
     
     if app.config['ENV'] == 'development':
         return jsonify({
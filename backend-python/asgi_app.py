@@ -0,0 +1,329 @@
+"""
+IPGrok Backend API - ASGI entry point
+
+Serves the same routes and response shapes as app.py, but the DynamoDB read
+paths run on an event loop with the aiobotocore client. A worker is not held
+for the length of each round trip, and fan-out reads (type index shards,
+scan segments, dashboard panels) go out together via asyncio.gather.
+
+Routes without an async version (writes, auth, speed test, history,
+health/metrics) are passed to the Flask app through a WSGI adapter. Rate
+limits use the same storage and keys as Flask-Limiter, so both modes share
+the same per-client budgets.
+
+Usage:
+    uvicorn asgi_app:app --host 0.0.0.0 --port 3001 --workers 4
+"""
+
+import asyncio
+import contextlib
+import logging
+import os
+import time
+
+from a2wsgi import WSGIMiddleware
+from limits import parse
+from marshmallow import ValidationError
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import Response
+from starlette.routing import Mount, Route
+
+from app import app as flask_app, allowed_origins, ACCESS_LOG
+from config.async_dynamodb import open_client, close_client, get_async_table
+from config.dynamodb import TABLES, StorageUnavailableError
+from extensions import limiter, _read_limit
+from models.async_test_result import AsyncTestResult
+from models.test_result import sharded_type_reads
+from routes.analytics import DASHBOARD_MAX_LIMIT
+from routes.auth import verify_token
+from routes.test_results import filter_schema
+from services.analytics import (
+    run_analytics_async, compute_performance, compute_trends, compute_comparison, compute_summary,
+    compute_dashboard, dashboard_panels, GROUP_BY_DIMENSIONS
+)
+from services.materializer import SUMMARY_KEY, summary_from_item
+from services.percentiles import percentile_table
+from utils.compression import COMPRESS_MIN_BYTES, gzip_bytes
+from utils.structured_logging import correlation_id, request_id_from, REQUEST_ID_HEADER
+
+WSGI_THREADS = int(os.getenv('ASGI_WSGI_THREADS', 10))
+
+logger = logging.getLogger(__name__)
+access_logger = logging.getLogger('access')
+_REQUEST_ID_KEY = REQUEST_ID_HEADER.lower().encode()
+
+class RequestIdMiddleware:
+    """Correlation ID per request, shared with routes passed to Flask
+
+    The ID is written back into the request headers so Flask's hooks reuse
+    it. Flask adds the response header and access log line for its own
+    routes; this adds them for the async routes.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        headers = [(k, v) for k, v in scope['headers'] if k != _REQUEST_ID_KEY]
+        incoming = next((v.decode('latin-1') for k, v in scope['headers'] if k == _REQUEST_ID_KEY), None)
+        request_id = request_id_from(incoming)
+        scope = dict(scope, headers=headers + [(_REQUEST_ID_KEY, request_id.encode())])
+        started = time.perf_counter()
+        token = correlation_id.set(request_id)
+
+        async def send_with_id(message):
+            if message['type'] == 'http.response.start' and not any(
+                    k.lower() == _REQUEST_ID_KEY for k, _ in message.get('headers', [])):
+                message = dict(message, headers=list(message.get('headers', [])) + [(_REQUEST_ID_KEY, request_id.encode())])
+                if ACCESS_LOG:
+                    status = message['status']
+                    access_logger.info('%s %s %s', scope['method'], scope['path'], status, extra={
+                        'method': scope['method'],
+                        'path': scope['path'],
+                        'status': status,
+                        'durationMs': round((time.perf_counter() - started) * 1000, 2)
+                    })
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            correlation_id.reset(token)
+
+def json_response(payload, status=200, headers=None):
+    """Serialized exactly like Flask's jsonify()"""
+    return Response(flask_app.json.dumps(payload) + '\n', status_code=status, headers=headers,
+                    media_type='application/json')
+
+def compressed_json_response(request, payload):
+    body = (flask_app.json.dumps(payload) + '\n').encode()
+    headers = {'Vary': 'Accept-Encoding'}
+    if 'gzip' in request.headers.get('accept-encoding', '') and len(body) >= COMPRESS_MIN_BYTES:
+        body = gzip_bytes(body)
+        headers['Content-Encoding'] = 'gzip'
+    return Response(body, headers=headers, media_type='application/json')
+
+def error_response(error, message, status):
+    return json_response({'error': error, 'message': message}, status)
+
+def read_route():
+    """Async counterpart of @read_limit plus the routes' try/except shape
+
+    Storage errors are re-raised for the app-wide 503 (Retry-After) handler,
+    as the Flask routes do.
+    """
+    def decorator(handler):
+        async def endpoint(request):
+            # Same storage and key as Flask-Limiter's shared 'read' limit
+            item = parse(_read_limit())
+            remote_address = request.client.host if request.client else '127.0.0.1'
+            if not limiter.limiter.hit(item, remote_address, 'read'):
+                return error_response('Too many requests', f'Rate limit exceeded: {item}', 429)
+            try:
+                return await handler(request)
+            except StorageUnavailableError:
+                raise
+            except ValidationError as e:
+                return json_response({'error': 'Validation error', 'details': e.messages}, 400)
+            except Exception as e:
+                return error_response('Internal server error', str(e), 500)
+        return endpoint
+    return decorator
+
+async def cached_analytics(key, compute):
+    """Cache + request coalescing for a coroutine function, all on this loop
+
+    Shares the cache with the Flask routes; concurrent requests for a key
+    await one compute() instead of each holding a pool thread.
+    """
+    return await run_analytics_async(key, compute)
+
+async def read_summary_item():
+    metric_id, date = SUMMARY_KEY
+    response = await get_async_table(TABLES['ANALYTICS']).get_item(Key={'metricId': metric_id, 'date': date})
+    return summary_from_item(response.get('Item'))
+
+# Test results
+
+@read_route()
+async def get_test_results(request):
+    filters = filter_schema.load(request.query_params)
+    limit = int(filters.pop('limit', 50))
+    results = await AsyncTestResult.get_with_filters(filters, limit)
+    return json_response({'success': True, 'count': len(results), 'results': results})
+
+@read_route()
+async def get_recent_test_results(request):
+    limit = int(request.query_params.get('limit', 20))
+    results = await AsyncTestResult.get_recent(limit)
+    return json_response({'success': True, 'count': len(results), 'results': results})
+
+@read_route()
+async def get_test_results_by_user(request):
+    user_id = request.path_params['user_id']
+    limit = int(request.query_params.get('limit', 50))
+    results = await AsyncTestResult.get_by_user_id(user_id, limit)
+    return json_response({'success': True, 'userId': user_id, 'count': len(results), 'results': results})
+
+@read_route()
+async def get_test_results_by_type(request):
+    test_type = request.path_params['test_type']
+    limit = int(request.query_params.get('limit', 50))
+    results = await AsyncTestResult.get_by_test_type(test_type, limit)
+    return json_response({'success': True, 'testType': test_type, 'count': len(results), 'results': results})
+
+@read_route()
+async def get_test_result(request):
+    test_id = request.path_params['test_id']
+    result = await AsyncTestResult.get_by_id(test_id)
+    if not result:
+        return error_response('Test result not found', f'No test result found with ID: {test_id}', 404)
+    return json_response({
+        'success': True,
+        'result': result,
+        'percentileRanks': percentile_table.ranks(result.get('testType'), result)
+    })
+
+@read_route()
+async def get_test_statistics(request):
+    async def load_summary():
+        stats = await read_summary_item()
+        return stats if stats is not None else compute_summary(await AsyncTestResult.get_recent(100))
+
+    stats, stale = await cached_analytics(('summary',), load_summary)
+    return json_response({'success': True, 'stale': stale, 'stats': stats})
+
+# Analytics
+
+@read_route()
+async def get_performance_analytics(request):
+    args = request.query_params
+    start_date, end_date = args.get('startDate'), args.get('endDate')
+    test_type = args.get('testType')
+    limit = int(args.get('limit', 100))
+    group_by = args.get('groupBy')
+    if group_by and group_by not in GROUP_BY_DIMENSIONS:
+        return error_response('Validation error', f"groupBy must be one of: {', '.join(GROUP_BY_DIMENSIONS)}", 400)
+
+    filters = {}
+    if start_date and end_date:
+        filters['startDate'] = start_date
+        filters['endDate'] = end_date
+    if test_type:
+        filters['testType'] = test_type
+
+    async def compute():
+        return compute_performance(await AsyncTestResult.get_with_filters(filters, limit), group_by)
+
+    key = ('performance', filters.get('startDate'), filters.get('endDate'), filters.get('testType'), limit, group_by)
+    data, stale = await cached_analytics(key, compute)
+    return json_response({'success': True, 'stale': stale, 'data': data})
+
+@read_route()
+async def get_trend_analytics(request):
+    limit = int(request.query_params.get('limit', 200))
+
+    async def compute():
+        return compute_trends(await AsyncTestResult.get_recent(limit))
+
+    data, stale = await cached_analytics(('trends', limit), compute)
+    return json_response({'success': True, 'stale': stale, 'data': data})
+
+@read_route()
+async def get_comparison_analytics(request):
+    limit = int(request.query_params.get('limit', 500))
+
+    async def compute():
+        return compute_comparison(await AsyncTestResult.get_recent(limit))
+
+    data, stale = await cached_analytics(('comparison', limit), compute)
+    return json_response({'success': True, 'stale': stale, 'data': data})
+
+@read_route()
+async def get_dashboard(request):
+    # Same checks and messages as @require_auth
+    token = request.headers.get('Authorization', '').replace('Bearer ', '')
+    if not token:
+        return error_response('Authentication required', 'No token provided', 401)
+    if not verify_token(token):
+        return error_response('Authentication failed', 'Invalid or expired token', 401)
+
+    try:
+        panels = dashboard_panels(request.query_params.get('panels'))
+    except ValueError as e:
+        return error_response('Validation error', str(e), 400)
+    limit = int(request.query_params.get('limit', 500))
+    if not 1 <= limit <= DASHBOARD_MAX_LIMIT:
+        return error_response('Validation error', f'limit must be 1-{DASHBOARD_MAX_LIMIT}', 400)
+
+    async def compute():
+        needs_results = any(panel != 'summary' for panel in panels)
+        summary, results = await asyncio.gather(
+            read_summary_item() if 'summary' in panels else asyncio.sleep(0),
+            AsyncTestResult.get_recent(limit) if needs_results else asyncio.sleep(0, [])
+        )
+        if summary is None and not needs_results:
+            results = await AsyncTestResult.get_recent(100)
+        return compute_dashboard(results, panels, summary)
+
+    data, stale = await cached_analytics(('dashboard', panels, limit), compute)
+    return compressed_json_response(request, {'success': True, 'stale': stale, 'panels': list(panels), 'data': data})
+
+async def storage_unavailable(request, error):
+    retry_after = max(1, int(round(error.retry_after)))
+    return json_response({
+        'error': 'Service temporarily unavailable',
+        'message': 'Storage is at capacity, please retry shortly'
+    }, 503, {'Retry-After': str(retry_after)})
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    await open_client()
+    try:
+        # Pick the test type index now rather than on the event loop later
+        await run_in_threadpool(sharded_type_reads)
+    except StorageUnavailableError as e:
+        logger.warning('Test type index not resolved at startup: %s', e)
+    try:
+        yield
+    finally:
+        await close_client()
+
+# GET routes with async handlers; any other method or path matches the Flask
+# mount instead
+routes = [
+    Route('/api/test-results', get_test_results, methods=['GET']),
+    Route('/api/test-results/recent', get_recent_test_results, methods=['GET']),
+    Route('/api/test-results/user/{user_id}', get_test_results_by_user, methods=['GET']),
+    Route('/api/test-results/type/{test_type}', get_test_results_by_type, methods=['GET']),
+    Route('/api/test-results/stats/summary', get_test_statistics, methods=['GET']),
+    Route('/api/test-results/{test_id}', get_test_result, methods=['GET']),
+    Route('/api/analytics/performance', get_performance_analytics, methods=['GET']),
+    Route('/api/analytics/trends', get_trend_analytics, methods=['GET']),
+    Route('/api/analytics/comparison', get_comparison_analytics, methods=['GET']),
+    Route('/api/analytics/dashboard', get_dashboard, methods=['GET']),
+    Mount('/', app=WSGIMiddleware(flask_app, workers=WSGI_THREADS))
+]
+
+app = Starlette(
+    routes=routes,
+    middleware=[
+        Middleware(RequestIdMiddleware),
+        Middleware(
+            CORSMiddleware,
+            allow_origins=allowed_origins,
+            allow_methods=['GET', 'POST', 'DELETE', 'OPTIONS', 'PUT'],
+            allow_headers=['Content-Type', 'Authorization', 'Idempotency-Key', REQUEST_ID_HEADER],
+            expose_headers=['Idempotent-Replayed', REQUEST_ID_HEADER],
+            allow_credentials=True
+        )
+    ],
+    exception_handlers={StorageUnavailableError: storage_unavailable},
+    lifespan=lifespan
+)
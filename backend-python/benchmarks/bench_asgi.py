@@ -0,0 +1,178 @@
+"""
+Benchmark: sync WSGI (gunicorn + app.py) vs async ASGI (uvicorn + asgi_app.py)
+
+Starts each server in turn against the same DynamoDB endpoint, drives the
+same read-heavy mix with a fixed number of concurrent clients, and reports
+requests per second, latency percentiles and the resident memory of the
+server's process tree. Size the two modes to the same memory (e.g. fewer
+threads or more workers) and compare req/s, or compare req/s per 100 MB.
+
+Results only mean something with real round-trip latency: point
+DYNAMODB_ENDPOINT_URL at DynamoDB Local on another host, or leave it unset
+to use the tables in AWS_REGION.
+
+Usage:
+    python benchmarks/bench_asgi.py --seed 500 --concurrency 128 --duration 30 \\
+        --sync-workers 2 --sync-threads 16 --async-workers 2
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import time
+
+import aiohttp
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+sys.path.insert(0, os.path.join(BACKEND_DIR, 'scripts'))
+from load_test import percentile
+
+# Uncached read paths; the type query fans out over every index shard
+DEFAULT_PATHS = [
+    '/api/test-results/recent?limit=20',
+    '/api/test-results/type/quickTest?limit=20',
+    '/api/test-results/{test_id}',
+]
+
+def server_env():
+    env = dict(os.environ)
+    # The benchmark measures storage-bound throughput, not the rate limiter
+    env.update({
+        'RATE_LIMIT_READ': '100000000 per minute',
+        'RATE_LIMIT_DEFAULT': '100000000 per minute',
+        'RATELIMIT_STORAGE_URI': 'memory://',
+        'NODE_ENV': 'production'
+    })
+    return env
+
+def tree_rss_mb(pid):
+    """Resident memory of a process and its descendants (Linux /proc)"""
+    children = {}
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open(f'/proc/{entry}/stat') as f:
+                    ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+                children.setdefault(ppid, []).append(int(entry))
+            except (OSError, IndexError, ValueError):
+                continue
+    total, stack = 0, [pid]
+    while stack:
+        current = stack.pop()
+        stack.extend(children.get(current, []))
+        try:
+            with open(f'/proc/{current}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1])
+        except OSError:
+            continue
+    return total / 1024
+
+def seed(count):
+    from config.dynamodb import init_dynamodb
+    from models.test_result import TestResult
+    init_dynamodb()
+    test_ids = []
+    for i in range(count):
+        test_ids.append(TestResult({
+            'testType': random.choice(['quickTest', 'quickTest', 'detailedAnalysis', 'manualTest']),
+            'userId': f'bench-{i % 50}',
+            'networkData': {'speedTest': {'download': str(random.randint(5, 900)), 'upload': '20', 'latency': 18}}
+        }).save())
+    return test_ids
+
+async def wait_ready(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            try:
+                async with session.get(url + '/health') as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.25)
+    raise RuntimeError(f'{url} did not become ready')
+
+async def drive(url, paths, test_ids, concurrency, duration):
+    latencies, errors = [], 0
+    deadline = time.monotonic() + duration
+    connector = aiohttp.TCPConnector(limit=concurrency)
+
+    async def client(session):
+        nonlocal errors
+        while time.monotonic() < deadline:
+            path = random.choice(paths).replace('{test_id}', random.choice(test_ids) if test_ids else 'missing')
+            started = time.perf_counter()
+            try:
+                async with session.get(url + path) as response:
+                    await response.read()
+                    if response.status >= 500:
+                        errors += 1
+                        continue
+            except aiohttp.ClientError:
+                errors += 1
+                continue
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    async with aiohttp.ClientSession(connector=connector) as session:
+        await asyncio.gather(*(client(session) for _ in range(concurrency)))
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': len(latencies) / duration,
+        'p50': percentile(latencies, 50),
+        'p99': percentile(latencies, 99)
+    }
+
+def run_mode(name, command, port, args, test_ids):
+    url = f'http://127.0.0.1:{port}'
+    process = subprocess.Popen(command, cwd=BACKEND_DIR, env=server_env(),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        asyncio.run(wait_ready(url))
+        asyncio.run(drive(url, args.paths, test_ids, args.concurrency, min(5, args.duration)))  # warm up
+        result = asyncio.run(drive(url, args.paths, test_ids, args.concurrency, args.duration))
+        result['rssMb'] = tree_rss_mb(process.pid)
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+    result['name'] = name
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare sync WSGI and async ASGI serving')
+    parser.add_argument('--sync-workers', type=int, default=2)
+    parser.add_argument('--sync-threads', type=int, default=16)
+    parser.add_argument('--async-workers', type=int, default=2)
+    parser.add_argument('--concurrency', type=int, default=128)
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--seed', type=int, default=0, help='write this many results first')
+    parser.add_argument('--paths', nargs='+', default=DEFAULT_PATHS)
+    args = parser.parse_args()
+
+    test_ids = seed(args.seed) if args.seed else []
+    modes = [
+        (f'wsgi {args.sync_workers}w x {args.sync_threads}t',
+         ['gunicorn', '-w', str(args.sync_workers), '--threads', str(args.sync_threads),
+          '-b', '127.0.0.1:3101', 'app:app'], 3101),
+        (f'asgi {args.async_workers}w',
+         ['uvicorn', 'asgi_app:app', '--workers', str(args.async_workers), '--port', '3102',
+          '--log-level', 'warning'], 3102),
+    ]
+
+    print(f'{"mode":<22} {"req/s":>9} {"p50 ms":>9} {"p99 ms":>9} {"errors":>7} {"RSS MB":>8} {"req/s/100MB":>12}')
+    for name, command, port in modes:
+        r = run_mode(name, command, port, args, test_ids)
+        print(f"{r['name']:<22} {r['rps']:>9.1f} {r['p50']:>9.1f} {r['p99']:>9.1f} {r['errors']:>7} "
+              f"{r['rssMb']:>8.0f} {r['rps'] / r['rssMb'] * 100:>12.1f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""
+Benchmark: log emission cost on the request thread
+
+Compares what a request thread pays per log call for print(), a synchronous
+JSON StreamHandler and the queued pipeline in utils/structured_logging.py,
+plus records dropped by sampling or level. Then measures the added cost per
+request (GET /health through the Flask test client) of the access log line.
+
+Output goes to a sink that sleeps ``--write-latency-us`` per write, standing
+in for a blocked stdout pipe; 0 writes to /dev/null.
+
+Usage:
+    python benchmarks/bench_logging.py --write-latency-us 50
+"""
+
+import argparse
+import logging
+import os
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault('RATE_LIMIT_DEFAULT', '100000000 per minute')
+os.environ.setdefault('RATELIMIT_STORAGE_URI', 'memory://')
+os.environ.setdefault('LOG_ACCESS', 'true')
+
+from utils import structured_logging
+from utils.structured_logging import ContextFilter, JsonFormatter, correlation_id
+
+class SlowSink:
+    """File-like object whose writes take a fixed time"""
+
+    def __init__(self, latency_us):
+        self.latency = latency_us / 1e6
+        self.devnull = open(os.devnull, 'w')
+
+    def write(self, data):
+        if self.latency:
+            time.sleep(self.latency)
+        return self.devnull.write(data)
+
+    def flush(self):
+        self.devnull.flush()
+
+def sync_handler(sink):
+    handler = logging.StreamHandler(sink)
+    handler.setFormatter(JsonFormatter())
+    handler.addFilter(ContextFilter())
+    return handler
+
+def per_call(label, fn, number):
+    seconds = min(timeit.repeat(fn, number=number, repeat=3))
+    print(f'{label:<40} {seconds / number * 1e6:>10.2f} us/call')
+
+def main():
+    parser = argparse.ArgumentParser(description='Log emission overhead')
+    parser.add_argument('--write-latency-us', type=float, default=0)
+    parser.add_argument('--calls', type=int, default=20000)
+    parser.add_argument('--requests', type=int, default=2000)
+    args = parser.parse_args()
+
+    sink = SlowSink(args.write_latency_us)
+    queued = structured_logging.configure_logging(sink)
+    root = logging.getLogger()
+    logger = logging.getLogger('bench')
+    correlation_id.set('01HBENCHMARKREQUEST0000000')
+    # Fewer calls when every write sleeps, so the blocking cases finish
+    blocking_calls = args.calls if not args.write_latency_us else max(200, int(args.calls / 20))
+
+    print(f'Per log call (write latency {args.write_latency_us:g} us)')
+    print('-' * 64)
+
+    stdout = sys.stdout
+    def print_call():
+        sys.stdout = sink
+        try:
+            print(f'Error getting test result: {"boom"}')
+        finally:
+            sys.stdout = stdout
+    per_call('print()', print_call, blocking_calls)
+
+    root.handlers[:] = [sync_handler(sink)]
+    per_call('JSON StreamHandler (blocking)', lambda: logger.error('Error getting test result: %s', 'boom'),
+             blocking_calls)
+
+    root.handlers[:] = [queued]
+    per_call('JSON QueueHandler (caller side)', lambda: logger.error('Error getting test result: %s', 'boom'),
+             args.calls)
+    structured_logging.shutdown_logging()  # let the backlog drain before the next case
+    structured_logging._start_listener(sink)
+
+    rates = dict(structured_logging.SAMPLE_RATES)
+    structured_logging.SAMPLE_RATES[logging.INFO] = 0.0
+    per_call('INFO sampled out', lambda: logger.info('GET %s %s', '/health', 200), args.calls)
+    structured_logging.SAMPLE_RATES.update(rates)
+    per_call('DEBUG below LOG_LEVEL', lambda: logger.debug('GET %s %s', '/health', 200), args.calls)
+
+    import app as app_module
+    client = app_module.app.test_client()
+
+    def request():
+        client.get('/health')
+
+    print()
+    print(f'Per request: GET /health ({args.requests} requests)')
+    print('-' * 64)
+    app_module.ACCESS_LOG = False
+    baseline = min(timeit.repeat(request, number=args.requests, repeat=3)) / args.requests
+    print(f'{"no access log":<40} {baseline * 1e6:>10.1f} us/req')
+
+    app_module.ACCESS_LOG = True
+    for label, handler, number in (
+        ('access log, queued', queued, args.requests),
+        ('access log, blocking', sync_handler(sink), max(200, blocking_calls // 10)),
+    ):
+        root.handlers[:] = [handler]
+        seconds = min(timeit.repeat(request, number=number, repeat=3)) / number
+        print(f'{label:<40} {seconds * 1e6:>10.1f} us/req  (+{(seconds - baseline) * 1e6:.1f})')
+        structured_logging.shutdown_logging()
+        structured_logging._start_listener(sink)
+
+    root.handlers[:] = [queued]
+    structured_logging.shutdown_logging()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Benchmark: POST /api/test-results payload validation
+
+Compares the FastLoader fast path against a plain marshmallow load across
+payload sizes, and checks both paths return identical data and errors.
+
+Usage:
+    python benchmarks/bench_validation.py
+"""
+
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from marshmallow import ValidationError
+
+from routes.test_results import TestResultSchema, test_result_loader
+
+def make_payload(entries):
+    """QuickTest-shaped payload with `entries` extra samples in networkData"""
+    return {
+        'testType': 'quickTest',
+        'userId': 'bench-user',
+        'networkData': {
+            'speedTest': {'download': 120.5, 'upload': 20.1, 'latency': 18, 'connectionQuality': 'good'},
+            'samples': [{'t': i, 'mbps': 100 + i % 7} for i in range(entries)]
+        },
+        'systemData': {'browser': 'Chrome', 'platform': 'MacIntel', 'cores': 8},
+        'location': {}
+    }
+
+def outcome(load, payload):
+    try:
+        return 'ok', load(payload)
+    except ValidationError as e:
+        return 'error', e.messages
+
+def check_equivalence(schema):
+    deep = {}
+    node = deep
+    for _ in range(20):
+        node['next'] = {}
+        node = node['next']
+    cases = [
+        make_payload(10),
+        {'testType': 'quickTest'},
+        {},
+        {'testType': 'bogus'},
+        {'testType': 5},
+        {'testType': 'quickTest', 'networkData': []},
+        {'testType': 'quickTest', 'userId': None},
+        {'testType': 'quickTest', 'unexpected': 1},
+        {'testType': 'quickTest', 'networkData': deep},
+        {'testType': 'quickTest', 'networkData': {'samples': list(range(50000))}},
+        None,
+        [],
+    ]
+    for payload in cases:
+        fast = outcome(test_result_loader.load, payload)
+        slow = outcome(schema.load, payload)
+        assert fast == slow, f'Mismatch for {payload!r:.80}: {fast!r:.200} != {slow!r:.200}'
+    print(f'✅ Fast path and marshmallow agree on {len(cases)} cases')
+
+def main():
+    schema = TestResultSchema()
+    check_equivalence(schema)
+
+    print(f"\n{'entries':>8} {'bytes':>9} {'marshmallow µs':>16} {'fast path µs':>14} {'speedup':>8}")
+    for entries in (0, 10, 100, 1000, 5000):
+        payload = make_payload(entries)
+        runs = max(20, 20000 // (entries + 10))
+        slow = min(timeit.repeat(lambda: schema.load(payload), number=runs, repeat=3)) / runs * 1e6
+        fast = min(timeit.repeat(lambda: test_result_loader.load(payload), number=runs, repeat=3)) / runs * 1e6
+        size = len(json.dumps(payload))
+        print(f'{entries:>8} {size:>9} {slow:>16.1f} {fast:>14.1f} {slow / fast:>7.1f}x')
+
+if __name__ == '__main__':
+    main()
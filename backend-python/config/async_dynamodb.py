@@ -0,0 +1,110 @@
+"""
+Async DynamoDB client for the ASGI entry point (asgi_app.py)
+
+One aiobotocore client per process, opened and closed with the app's
+lifespan. It uses the same region, credentials, retries and timeouts as the
+sync client, and its calls count toward the same circuit breaker. The
+low-level client speaks the wire format, so items are converted here and
+callers see the same plain dicts that boto3's Table resource returns.
+"""
+
+import contextlib
+import logging
+import os
+
+from aiobotocore.session import get_session
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+from botocore.config import Config
+
+from config.dynamodb import breaker, client_config, is_capacity_error, StorageUnavailableError
+from utils import metrics
+from utils.circuit_breaker import CircuitOpenError
+
+logger = logging.getLogger(__name__)
+
+# One event loop multiplexes every request, so it needs far more connections
+# than a sync worker thread
+ASYNC_MAX_CONNECTIONS = int(os.getenv('ASYNC_DYNAMODB_MAX_CONNECTIONS', 100))
+
+_client = None
+_exit_stack = None
+_serializer = TypeSerializer()
+_deserializer = TypeDeserializer()
+
+async def open_client():
+    """Create the process-wide client (call once from the lifespan handler)"""
+    global _client, _exit_stack
+    if _client is not None:
+        return _client
+    aws_config = client_config()
+    aws_config['config'] = aws_config['config'].merge(Config(max_pool_connections=ASYNC_MAX_CONNECTIONS))
+    _exit_stack = contextlib.AsyncExitStack()
+    _client = await _exit_stack.enter_async_context(get_session().create_client('dynamodb', **aws_config))
+    logger.info('Async DynamoDB client ready in region: %s', aws_config['region_name'])
+    return _client
+
+async def close_client():
+    global _client, _exit_stack
+    if _exit_stack is not None:
+        await _exit_stack.aclose()
+    _client, _exit_stack = None, None
+
+def serialize(item):
+    return {k: _serializer.serialize(v) for k, v in item.items()}
+
+def deserialize(item):
+    return {k: _deserializer.deserialize(v) for k, v in item.items()}
+
+class AsyncTable:
+    """get_item/query/scan/put_item with Table-resource shaped arguments and results"""
+
+    def __init__(self, table_name):
+        self.table_name = table_name
+
+    async def _call(self, operation, **kwargs):
+        if _client is None:
+            raise RuntimeError('Async DynamoDB client is not open')
+        try:
+            return await breaker.call_async(getattr(_client, operation), TableName=self.table_name, **kwargs)
+        except CircuitOpenError as e:
+            raise StorageUnavailableError(str(e), breaker.retry_after()) from e
+        except Exception as e:
+            if is_capacity_error(e):
+                metrics.increment('dynamodb.capacityErrors')
+                raise StorageUnavailableError(f'DynamoDB unavailable: {e}', breaker.retry_after()) from e
+            raise
+
+    @staticmethod
+    def _values(kwargs):
+        if 'ExpressionAttributeValues' in kwargs:
+            kwargs['ExpressionAttributeValues'] = serialize(kwargs['ExpressionAttributeValues'])
+        if 'ExclusiveStartKey' in kwargs:
+            kwargs['ExclusiveStartKey'] = serialize(kwargs['ExclusiveStartKey'])
+        return kwargs
+
+    @staticmethod
+    def _page(response):
+        page = {
+            'Items': [deserialize(item) for item in response.get('Items', [])],
+            'Count': response.get('Count', 0),
+            'ScannedCount': response.get('ScannedCount', 0)
+        }
+        if 'LastEvaluatedKey' in response:
+            page['LastEvaluatedKey'] = deserialize(response['LastEvaluatedKey'])
+        return page
+
+    async def get_item(self, Key, **kwargs):
+        response = await self._call('get_item', Key=serialize(Key), **kwargs)
+        return {'Item': deserialize(response['Item'])} if 'Item' in response else {}
+
+    async def query(self, **kwargs):
+        return self._page(await self._call('query', **self._values(kwargs)))
+
+    async def scan(self, **kwargs):
+        return self._page(await self._call('scan', **self._values(kwargs)))
+
+    async def put_item(self, Item, **kwargs):
+        return await self._call('put_item', Item=serialize(Item), **self._values(kwargs))
+
+def get_async_table(table_name):
+    return AsyncTable(table_name)
@@ -3,9 +3,16 @@ DynamoDB Configuration
 """
 
 import boto3
-from botocore.exceptions import ClientError
+from botocore.config import Config
+from botocore.exceptions import ClientError, ConnectTimeoutError, EndpointConnectionError, ReadTimeoutError
+import logging
 import os
 
+from utils import metrics
+from utils.circuit_breaker import CircuitBreaker, CircuitOpenError
+
+logger = logging.getLogger(__name__)
+
 # DynamoDB client
 dynamodb = None
 dynamodb_resource = None
@@ -16,13 +23,89 @@ TABLES = {
     'ANALYTICS': os.getenv('ANALYTICS_TABLE', 'ipgrok-analytics')
 }
 
-def init_dynamodb():
-    """Initialize DynamoDB client and resource"""
-    global dynamodb, dynamodb_resource
-    
-    # Configure AWS
+# testType has only three values, so the type index is write-sharded on
+# 'testType#N' to spread the quickTest partition across N keys
+TEST_TYPE_SHARDS = int(os.getenv('TEST_TYPE_SHARDS', 8))
+TEST_TYPE_SHARD_INDEX = 'TestTypeShardIndex'
+# Unsharded index on testType; tables created before the sharding have it
+TEST_TYPE_INDEX = 'TestTypeIndex'
+
+# Error codes DynamoDB returns when the table or account is out of capacity
+THROTTLE_ERROR_CODES = {
+    'ProvisionedThroughputExceededException',
+    'ThrottlingException',
+    'RequestLimitExceeded',
+    'InternalServerError',
+    'ServiceUnavailable'
+}
+
+class StorageUnavailableError(Exception):
+    """DynamoDB is throttling, timing out, or the circuit breaker is open"""
+
+    def __init__(self, message, retry_after=0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+def is_capacity_error(error):
+    """True for throttling and timeout errors (the ones that trip the breaker)"""
+    if isinstance(error, (ConnectTimeoutError, ReadTimeoutError, EndpointConnectionError)):
+        return True
+    if isinstance(error, ClientError):
+        return error.response.get('Error', {}).get('Code') in THROTTLE_ERROR_CODES
+    return False
+
+breaker = CircuitBreaker(
+    'dynamodb',
+    failure_threshold=int(os.getenv('DYNAMODB_BREAKER_THRESHOLD', 5)),
+    reset_timeout=float(os.getenv('DYNAMODB_BREAKER_RESET_SECONDS', 10)),
+    is_failure=is_capacity_error
+)
+metrics.register('dynamodbBreaker', breaker.stats)
+
+def call_guarded(fn, *args, **kwargs):
+    """Call a DynamoDB operation through the circuit breaker
+
+    Capacity errors and an open breaker surface as StorageUnavailableError.
+    """
+    try:
+        return breaker.call(fn, *args, **kwargs)
+    except CircuitOpenError as e:
+        raise StorageUnavailableError(str(e), breaker.retry_after()) from e
+    except Exception as e:
+        if is_capacity_error(e):
+            metrics.increment('dynamodb.capacityErrors')
+            raise StorageUnavailableError(f'DynamoDB unavailable: {e}', breaker.retry_after()) from e
+        raise
+
+class GuardedTable:
+    """Table wrapper that routes data-plane calls through the circuit breaker"""
+
+    GUARDED_METHODS = {'get_item', 'put_item', 'update_item', 'delete_item', 'query', 'scan'}
+
+    def __init__(self, table):
+        self._table = table
+
+    def __getattr__(self, name):
+        attr = getattr(self._table, name)
+        if name not in self.GUARDED_METHODS:
+            return attr
+
+        def guarded(*args, **kwargs):
+            return call_guarded(attr, *args, **kwargs)
+        return guarded
+
+def client_config():
+    """Region, credentials, retries and timeouts shared by the sync and async clients"""
+    # Fail fast on throttling/timeouts and let the circuit breaker and caches
+    # handle it, rather than retrying for seconds.
     aws_config = {
-        'region_name': os.getenv('AWS_REGION', 'us-east-2')
+        'region_name': os.getenv('AWS_REGION', 'us-east-2'),
+        'config': Config(
+            retries={'max_attempts': int(os.getenv('DYNAMODB_MAX_ATTEMPTS', 3)), 'mode': 'standard'},
+            connect_timeout=float(os.getenv('DYNAMODB_CONNECT_TIMEOUT', 2)),
+            read_timeout=float(os.getenv('DYNAMODB_READ_TIMEOUT', 5)),
+            max_pool_connections=int(os.getenv('DYNAMODB_MAX_CONNECTIONS', 10))
+        )
     }
     
     # Add credentials if provided
@@ -30,18 +113,34 @@ def init_dynamodb():
         aws_config['aws_access_key_id'] = os.getenv('AWS_ACCESS_KEY_ID')
     if os.getenv('AWS_SECRET_ACCESS_KEY'):
         aws_config['aws_secret_access_key'] = os.getenv('AWS_SECRET_ACCESS_KEY')
+    # DynamoDB Local or another compatible endpoint (development, benchmarks)
+    if os.getenv('DYNAMODB_ENDPOINT_URL'):
+        aws_config['endpoint_url'] = os.getenv('DYNAMODB_ENDPOINT_URL')
+    return aws_config
+
+def init_dynamodb():
+    """Initialize DynamoDB client and resource"""
+    global dynamodb, dynamodb_resource
     
+    aws_config = client_config()
     dynamodb = boto3.client('dynamodb', **aws_config)
     dynamodb_resource = boto3.resource('dynamodb', **aws_config)
     
-    print(f"✅ DynamoDB initialized in region: {aws_config['region_name']}")
+    logger.info('DynamoDB initialized in region: %s', aws_config['region_name'])
     return dynamodb, dynamodb_resource
 
+def table_indexes(table_name):
+    """Names of a table's global secondary indexes"""
+    if dynamodb is None:
+        init_dynamodb()
+    table = call_guarded(dynamodb.describe_table, TableName=table_name)['Table']
+    return {index['IndexName'] for index in table.get('GlobalSecondaryIndexes', [])}
+
 def get_table(table_name):
-    """Get a DynamoDB table resource"""
+    """Get a DynamoDB table resource (guarded by the circuit breaker)"""
     if dynamodb_resource is None:
         init_dynamodb()
-    return dynamodb_resource.Table(table_name)
+    return GuardedTable(dynamodb_resource.Table(table_name))
 
 # Table schemas for creation
 TABLE_SCHEMAS = {
@@ -55,7 +154,7 @@ TABLE_SCHEMAS = {
             {'AttributeName': 'testId', 'AttributeType': 'S'},
             {'AttributeName': 'timestamp', 'AttributeType': 'S'},
             {'AttributeName': 'userId', 'AttributeType': 'S'},
-            {'AttributeName': 'testType', 'AttributeType': 'S'}
+            {'AttributeName': 'testTypeShard', 'AttributeType': 'S'}
         ],
         'GlobalSecondaryIndexes': [
             {
@@ -71,9 +170,9 @@ TABLE_SCHEMAS = {
                 }
             },
             {
-                'IndexName': 'TestTypeIndex',
+                'IndexName': TEST_TYPE_SHARD_INDEX,
                 'KeySchema': [
-                    {'AttributeName': 'testType', 'KeyType': 'HASH'},
+                    {'AttributeName': 'testTypeShard', 'KeyType': 'HASH'},
                     {'AttributeName': 'timestamp', 'KeyType': 'RANGE'}
                 ],
                 'Projection': {'ProjectionType': 'ALL'},
@@ -86,6 +185,11 @@ TABLE_SCHEMAS = {
         'ProvisionedThroughput': {
             'ReadCapacityUnits': 5,
             'WriteCapacityUnits': 5
+        },
+        # Feeds services/materializer.py (deletes need the old image)
+        'StreamSpecification': {
+            'StreamEnabled': True,
+            'StreamViewType': 'NEW_AND_OLD_IMAGES'
         }
     },
     'ANALYTICS': {
@@ -105,6 +209,33 @@ TABLE_SCHEMAS = {
     }
 }
 
+# TTL attribute per table (enabled after creation)
+TABLE_TTL = {
+    'TEST_RESULTS': 'expiresAt',   # set once a result is archived
+    'ANALYTICS': 'expiresAt'
+}
+
+def ensure_ttl(table_name, attribute):
+    """Enable TTL on ``attribute`` unless it already is; returns the TTL status
+
+    Raises RuntimeError if the table's TTL is on another attribute or being
+    disabled, since items would then never be deleted.
+    """
+    if dynamodb is None:
+        init_dynamodb()
+    ttl = dynamodb.describe_time_to_live(TableName=table_name)['TimeToLiveDescription']
+    status = ttl.get('TimeToLiveStatus', 'DISABLED')
+    if status == 'DISABLED':
+        dynamodb.update_time_to_live(
+            TableName=table_name,
+            TimeToLiveSpecification={'Enabled': True, 'AttributeName': attribute}
+        )
+        return 'ENABLING'
+    if status == 'DISABLING' or ttl.get('AttributeName') != attribute:
+        raise RuntimeError(f'TTL on {table_name} is {status} for {ttl.get("AttributeName")!r}, '
+                           f'not enabled for {attribute!r}')
+    return status
+
 def create_tables():
     """Create DynamoDB tables if they don't exist"""
     if dynamodb is None:
@@ -125,6 +256,10 @@ def create_tables():
             else:
                 print(f"❌ Error creating table {schema['TableName']}: {str(e)}")
                 raise
+        
+        # Also for existing tables, which may predate TABLE_TTL
+        if table_name in TABLE_TTL:
+            ensure_ttl(schema['TableName'], TABLE_TTL[table_name])
 
 if __name__ == '__main__':
     """Run this file directly to create tables"""
@@ -0,0 +1,45 @@
+"""
+Shared Flask extensions
+
+Created here (rather than in app.py) so blueprints can import them without a
+circular import; app.py binds them with init_app().
+"""
+
+import os
+
+from flask_limiter import Limiter
+from flask_limiter.util import get_remote_address
+
+import utils.rate_limit_storage  # noqa: F401  (registers the shm:// storage scheme)
+
+def _default_limit():
+    return os.getenv('RATE_LIMIT_DEFAULT', '100 per 15 minutes')
+
+def _read_limit():
+    return os.getenv('RATE_LIMIT_READ', '300 per 15 minutes')
+
+def _write_limit():
+    return os.getenv('RATE_LIMIT_WRITE', '30 per 15 minutes')
+
+def _speed_test_limit():
+    return os.getenv('RATE_LIMIT_SPEED_TEST', '60 per 15 minutes')
+
+def _probe_limit():
+    return os.getenv('RATE_LIMIT_PROBE', '600 per minute')
+
+# Rate limiting. Storage is configured from RATELIMIT_STORAGE_URI in app.py;
+# the default shm:// backend shares counters across all workers on the host.
+limiter = Limiter(
+    get_remote_address,
+    default_limits=[_default_limit],
+    strategy='fixed-window'
+)
+
+# Reads (scans and aggregations) and writes (single put) draw from separate
+# per-client budgets shared by every route in the same scope.
+read_limit = limiter.shared_limit(_read_limit, scope='read')
+write_limit = limiter.shared_limit(_write_limit, scope='write')
+
+# Speed test transfers are bandwidth-heavy; latency probes are tiny but frequent
+speed_test_limit = limiter.shared_limit(_speed_test_limit, scope='speed-test')
+probe_limit = limiter.shared_limit(_probe_limit, scope='probe')
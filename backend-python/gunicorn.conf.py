@@ -0,0 +1,109 @@
+"""
+Gunicorn configuration (read automatically by ``gunicorn app:app``)
+
+- The app is imported once in the master (preload) and forked, so workers
+  share its code pages copy-on-write instead of each importing it.
+- Before binding the port the master checks the tables and times sample
+  requests. The ratio of I/O wait to CPU time sets the threads per worker
+  (1 + wait/compute), and there is one worker per available CPU.
+- Each worker re-creates its boto3 clients after fork (connections must not
+  be shared across processes) and warms its connection pool before it
+  accepts requests.
+- On SIGTERM a worker finishes its in-flight requests, stops its purge jobs
+  at a checkpoint, flushes writes queued while DynamoDB was throttling and
+  then flushes its logs.
+"""
+
+import logging
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger('gunicorn.conf')
+
+def _cpu_count():
+    try:
+        return len(os.sched_getaffinity(0))  # respects container CPU pinning
+    except AttributeError:
+        return os.cpu_count() or 1
+
+bind = f"0.0.0.0:{os.getenv('PORT', 3001)}"
+preload_app = True
+worker_class = 'gthread'
+workers = int(os.getenv('WEB_CONCURRENCY', 0)) or _cpu_count()
+# 'auto' measures I/O wait at startup; a number fixes it
+THREADS = os.getenv('GUNICORN_THREADS', 'auto')
+MAX_THREADS = int(os.getenv('GUNICORN_MAX_THREADS', 32))
+threads = 4 if THREADS == 'auto' else int(THREADS)
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+# 'strict' refuses to start if the check fails, 'warn' logs and starts, 'off' skips it
+SELF_CHECK = os.getenv('GUNICORN_SELF_CHECK', 'strict').lower()
+# Time a stopping worker spends replaying queued writes (within graceful_timeout)
+DRAIN_TIMEOUT = float(os.getenv('GUNICORN_DRAIN_TIMEOUT', 10))
+
+# The app writes its own JSON access log (LOG_ACCESS)
+accesslog = None
+errorlog = '-'
+
+def on_starting(server):
+    """Master, after preload and before binding: self-check and size threads"""
+    if SELF_CHECK == 'off':
+        return
+    from utils.startup import self_check, threads_for
+
+    try:
+        ratio = self_check(server.app.wsgi())
+    except Exception as e:
+        if SELF_CHECK == 'strict':
+            logger.error('Self-check failed, not starting: %s', e, exc_info=e)
+            raise SystemExit(1)
+        logger.warning('Self-check failed, starting anyway: %s', e)
+        return
+    if THREADS == 'auto' and server.cfg.threads == threads:  # not overridden by --threads
+        server.cfg.set('threads', threads_for(ratio, MAX_THREADS))
+
+def when_ready(server):
+    server.log.info('Serving with %d workers x %d threads', server.num_workers, server.cfg.threads)
+
+def post_fork(server, worker):
+    """Worker: replace the boto3 clients inherited from the master"""
+    import config.dynamodb as db
+
+    # One pooled connection per request thread at least
+    pool_size = max(int(os.getenv('DYNAMODB_MAX_CONNECTIONS', 10)), server.cfg.threads)
+    os.environ['DYNAMODB_MAX_CONNECTIONS'] = str(pool_size)
+    db.init_dynamodb()
+
+def post_worker_init(worker):
+    """Worker, app loaded: open connections and load percentile CDFs before accepting requests"""
+    from services.percentiles import percentile_table
+    from utils.startup import warm_connections
+
+    try:
+        warm_connections(worker.cfg.threads)
+        percentile_table.load()
+    except Exception as e:
+        # Storage may be throttling; the circuit breaker handles that per request
+        logger.warning('Connection warm-up failed: %s', e)
+
+def worker_exit(server, worker):
+    """Worker stopping (after in-flight requests): checkpoint purge jobs, flush queued writes and logs"""
+    if worker.pid != os.getpid():
+        return  # master cleaning up a worker that already died
+    from models.test_result import pending_writes
+    from services import purge
+    from utils.structured_logging import shutdown_logging
+
+    # Left 'interrupted'; POST /api/test-results/purge/<jobId>/resume continues them
+    purge.shutdown(DRAIN_TIMEOUT)
+    if len(pending_writes):
+        left = pending_writes.drain(DRAIN_TIMEOUT)
+        if left:
+            logger.error('Exiting with %d queued writes not flushed', left)
+        else:
+            logger.info('Flushed queued writes before exit')
+    shutdown_logging()
@@ -0,0 +1,204 @@
+"""
+Async reads of test results for the ASGI entry point
+
+Same queries and result shapes as the read methods of TestResult, on the
+aiobotocore client. Fan-out reads (TestTypeIndex shards, scan segments) are
+issued together with asyncio.gather instead of one after another.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import os
+
+from config.async_dynamodb import get_async_table
+from config.dynamodb import TABLES, StorageUnavailableError, TEST_TYPE_SHARDS, TEST_TYPE_SHARD_INDEX, TEST_TYPE_INDEX
+from models.test_result import TestResult, recent_results, sharded_type_reads
+
+logger = logging.getLogger(__name__)
+
+# Parallel scan segments for recent/filtered listings
+SCAN_SEGMENTS = int(os.getenv('ASYNC_SCAN_SEGMENTS', 4))
+
+def _results_table():
+    return get_async_table(TABLES['TEST_RESULTS'])
+
+class AsyncTestResult:
+    """Async counterparts of the TestResult read methods"""
+
+    @staticmethod
+    async def get_by_id(test_id, timestamp=None):
+        """Get test result by ID"""
+        table = _results_table()
+        timestamp = timestamp or TestResult.timestamp_for_id(test_id)
+
+        try:
+            if timestamp:
+                response = await table.get_item(Key={'testId': test_id, 'timestamp': timestamp})
+                return TestResult.from_storage(response.get('Item'), True)
+
+            # Legacy UUID ID: query by testId only to find the range key
+            response = await table.query(
+                KeyConditionExpression='testId = :id',
+                ExpressionAttributeValues={':id': test_id},
+                Limit=1
+            )
+            return TestResult.from_storage(response['Items'][0], True) if response.get('Items') else None
+        except StorageUnavailableError:
+            raise
+        except Exception as e:
+            logger.error('Error getting test result: %s', e)
+            raise Exception('Failed to get test result')
+
+    @staticmethod
+    async def get_by_user_id(user_id, limit=50):
+        """Get test results by user ID (shares the per-user cache with the sync path)"""
+        cached = recent_results.get(user_id, limit)
+        if cached is not None:
+            return cached
+
+        try:
+            ticket = recent_results.begin(user_id)
+            response = await _results_table().query(
+                IndexName='UserIdIndex',
+                KeyConditionExpression='userId = :user',
+                ExpressionAttributeValues={':user': user_id},
+                ScanIndexForward=False,  # Most recent first
+                Limit=max(limit, recent_results.per_user)
+            )
+            items = TestResult.from_storage_items(response.get('Items', []))
+            recent_results.fill(user_id, items, 'LastEvaluatedKey' not in response, ticket)
+            return items[:limit]
+        except StorageUnavailableError:
+            raise
+        except Exception as e:
+            logger.error('Error getting test results by user: %s', e)
+            raise Exception('Failed to get test results by user')
+
+    @staticmethod
+    async def get_by_test_type(test_type, limit=50):
+        """Get test results by type (newest first)"""
+        if not sharded_type_reads():
+            return await AsyncTestResult._query_test_type_index(TEST_TYPE_INDEX, 'testType', test_type, limit)
+
+        # Query every shard at once and k-way merge the newest-first pages
+        pages = await asyncio.gather(*(
+            AsyncTestResult._query_test_type_index(
+                TEST_TYPE_SHARD_INDEX, 'testTypeShard', f'{test_type}#{shard}', limit
+            )
+            for shard in range(TEST_TYPE_SHARDS)
+        ))
+        merged = heapq.merge(*pages, key=lambda item: item.get('timestamp', ''), reverse=True)
+        return list(itertools.islice(merged, limit))
+
+    @staticmethod
+    async def _query_test_type_index(index_name, key_name, key_value, limit):
+        try:
+            response = await _results_table().query(
+                IndexName=index_name,
+                KeyConditionExpression='#k = :v',
+                ExpressionAttributeNames={'#k': key_name},
+                ExpressionAttributeValues={':v': key_value},
+                ScanIndexForward=False,  # Most recent first
+                Limit=limit
+            )
+            return TestResult.from_storage_items(response.get('Items', []))
+        except StorageUnavailableError:
+            raise
+        except Exception as e:
+            logger.error('Error getting test results by type: %s', e)
+            raise Exception('Failed to get test results by type')
+
+    @staticmethod
+    async def _scan_segments(limit, more=False, **scan_kwargs):
+        """Up to ``limit`` items from a parallel scan, ~limit/segments per segment
+
+        With ``more``, segments that still have items keep being read until
+        ``limit`` items are found, as one sync Scan page of ``limit`` would.
+        """
+        table = _results_table()
+        segments = max(1, min(SCAN_SEGMENTS, limit))
+        per_segment = math.ceil(limit / segments)
+        start_keys = {segment: None for segment in range(segments)}
+        items = []
+
+        while start_keys and len(items) < limit:
+            async def read(segment, start_key):
+                kwargs = dict(scan_kwargs, Segment=segment, TotalSegments=segments, Limit=per_segment)
+                if start_key:
+                    kwargs['ExclusiveStartKey'] = start_key
+                return segment, await table.scan(**kwargs)
+
+            pages = await asyncio.gather(*(read(s, key) for s, key in start_keys.items()))
+            start_keys = {}
+            for segment, page in pages:
+                items.extend(page.get('Items', []))
+                if 'LastEvaluatedKey' in page:
+                    start_keys[segment] = page['LastEvaluatedKey']
+            if not more:
+                break
+        return items[:limit]
+
+    @staticmethod
+    async def get_recent(limit=20):
+        """Get recent test results"""
+        try:
+            items = TestResult.from_storage_items(await AsyncTestResult._scan_segments(limit, more=True))
+
+            # Sort by timestamp (most recent first)
+            items.sort(key=lambda x: x.get('timestamp', ''), reverse=True)
+            return items[:limit]
+        except StorageUnavailableError:
+            raise
+        except Exception as e:
+            logger.error('Error getting recent test results: %s', e)
+            raise Exception('Failed to get recent test results')
+
+    @staticmethod
+    async def get_with_filters(filters=None, limit=50):
+        """Get test results with filters"""
+        filters = filters or {}
+
+        try:
+            scan_kwargs = {}
+            filter_expressions = []
+            expression_attribute_values = {}
+            expression_attribute_names = {}
+
+            if filters.get('testType'):
+                filter_expressions.append('#testType = :testType')
+                expression_attribute_names['#testType'] = 'testType'
+                expression_attribute_values[':testType'] = filters['testType']
+
+            if filters.get('userId'):
+                filter_expressions.append('#userId = :userId')
+                expression_attribute_names['#userId'] = 'userId'
+                expression_attribute_values[':userId'] = filters['userId']
+
+            if filters.get('startDate') and filters.get('endDate'):
+                filter_expressions.append('#timestamp BETWEEN :startDate AND :endDate')
+                expression_attribute_names['#timestamp'] = 'timestamp'
+                expression_attribute_values[':startDate'] = filters['startDate']
+                expression_attribute_values[':endDate'] = filters['endDate']
+
+            # Time dimensions stored at write time
+            for name in ('dayOfWeek', 'timeSlot', 'hourOfDay'):
+                if filters.get(name) is not None:
+                    filter_expressions.append(f'#{name} = :{name}')
+                    expression_attribute_names[f'#{name}'] = name
+                    expression_attribute_values[f':{name}'] = filters[name]
+
+            if filter_expressions:
+                scan_kwargs['FilterExpression'] = ' AND '.join(filter_expressions)
+                scan_kwargs['ExpressionAttributeValues'] = expression_attribute_values
+                scan_kwargs['ExpressionAttributeNames'] = expression_attribute_names
+
+            # Like the sync Scan(Limit=limit), evaluate ~limit items in total
+            return TestResult.from_storage_items(await AsyncTestResult._scan_segments(limit, **scan_kwargs))
+        except StorageUnavailableError:
+            raise
+        except Exception as e:
+            logger.error('Error getting test results with filters: %s', e)
+            raise Exception('Failed to get test results with filters')
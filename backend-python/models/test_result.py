@@ -3,9 +3,69 @@ TestResult Model for DynamoDB operations
 """
 
 from datetime import datetime
-from uuid import uuid4
+from concurrent.futures import ThreadPoolExecutor
+import heapq
+import itertools
+import threading
+import zlib
+import logging
 from boto3.dynamodb.conditions import Key
-from config.dynamodb import get_table, TABLES
+from config.dynamodb import (get_table, table_indexes, TABLES, StorageUnavailableError, TEST_TYPE_SHARDS,
+                             TEST_TYPE_SHARD_INDEX, TEST_TYPE_INDEX)
+from utils.ulid import new_ulid, is_ulid, ulid_ms, ms_to_iso, iso_to_ms
+from utils.time_dimensions import time_dimensions
+from utils.write_queue import WriteQueue
+from utils.recent_results import RecentResultsCache
+from utils.shm_tables import SharedCounters, shm_path
+from utils import metrics
+from services.sample_metrics import unpack_samples
+import os
+
+logger = logging.getLogger(__name__)
+
+TEST_TYPES = ('quickTest', 'detailedAnalysis', 'manualTest')
+
+# Which type index reads use: 'true' for the sharded TestTypeShardIndex,
+# 'false' for the legacy TestTypeIndex, or 'auto' to pick from the table: the
+# legacy index while it exists (it stays complete during a migration),
+# otherwise the sharded one (tables created by config/dynamodb.py)
+SHARDED_TEST_TYPE_READS = os.getenv('SHARDED_TEST_TYPE_READS', 'auto').lower()
+_sharded_reads = None
+
+def sharded_type_reads():
+    """True if type reads use TestTypeShardIndex (describes the table once per process)"""
+    global _sharded_reads
+    if _sharded_reads is None:
+        if SHARDED_TEST_TYPE_READS == 'auto':
+            _sharded_reads = TEST_TYPE_INDEX not in table_indexes(TABLES['TEST_RESULTS'])
+        else:
+            _sharded_reads = SHARDED_TEST_TYPE_READS == 'true'
+    return _sharded_reads
+
+# Newest results per user for the history view, kept current by save/delete
+# and by write versions shared with every worker on the host
+recent_results = RecentResultsCache(
+    per_user=int(os.getenv('USER_CACHE_RESULTS', 50)),
+    max_bytes=int(os.getenv('USER_CACHE_MAX_BYTES', 32 * 1024 * 1024)),
+    ttl=float(os.getenv('USER_CACHE_TTL_SECONDS', 60)),
+    versions=SharedCounters(os.getenv('USER_CACHE_VERSIONS_FILE')
+                            or shm_path('ipgrok-user-versions', temp_fallback=True))
+)
+metrics.register('recentResultsCache', recent_results.stats)
+
+# Items per query page when fold_time_range() has a capacity budget
+BUDGETED_PAGE_SIZE = 100
+
+_fanout_pool = None
+_fanout_pid = None
+
+def _fanout_executor():
+    """Thread pool for parallel shard queries (re-created after fork)"""
+    global _fanout_pool, _fanout_pid
+    if _fanout_pool is None or _fanout_pid != os.getpid():
+        _fanout_pool = ThreadPoolExecutor(max_workers=min(32, max(4, TEST_TYPE_SHARDS)), thread_name_prefix='shard-query')
+        _fanout_pid = os.getpid()
+    return _fanout_pool
 
 class TestResult:
     """Model for test results"""
@@ -13,8 +73,15 @@ class TestResult:
     def __init__(self, data=None):
         """Initialize test result"""
         data = data or {}
-        self.test_id = data.get('testId', str(uuid4()))
-        self.timestamp = data.get('timestamp', datetime.utcnow().isoformat() + 'Z')
+        if data.get('testId'):
+            self.test_id = data['testId']
+            self.timestamp = data.get('timestamp', datetime.utcnow().isoformat() + 'Z')
+        else:
+            # New IDs are ULIDs whose embedded time is the range key, so the
+            # full primary key can be derived from the ID alone
+            ms = iso_to_ms(data['timestamp']) if data.get('timestamp') else None
+            self.test_id = new_ulid(ms)
+            self.timestamp = ms_to_iso(ulid_ms(self.test_id))
         self.user_id = data.get('userId', 'anonymous')
         self.test_type = data.get('testType')  # 'quickTest', 'detailedAnalysis', 'manualTest'
         self.network_data = data.get('networkData')
@@ -25,11 +92,12 @@ class TestResult:
         self.user_agent = data.get('userAgent')
         self.location = data.get('location')
         self.device_info = data.get('deviceInfo')
+        self.network = data.get('network')  # {'asn', 'isp', 'region'} from IP enrichment
+        self.sample_metrics = data.get('sampleMetrics')
+        self.raw_samples = data.get('rawSamples')  # {name: packed float32 bytes}
     
-    def save(self):
-        """Save test result to DynamoDB"""
-        table = get_table(TABLES['TEST_RESULTS'])
-        
+    def to_item(self):
+        """DynamoDB item for this test result"""
         item = {
             'testId': self.test_id,
             'timestamp': self.timestamp,
@@ -46,70 +114,227 @@ class TestResult:
             'createdAt': datetime.utcnow().isoformat() + 'Z',
             'updatedAt': datetime.utcnow().isoformat() + 'Z'
         }
+        if self.network:
+            item['network'] = self.network
+        if self.sample_metrics:
+            item['sampleMetrics'] = self.sample_metrics
+        if self.raw_samples:
+            item['rawSamples'] = self.raw_samples
+        if self.test_type:
+            # GSI key attributes must be omitted rather than null
+            item['testTypeShard'] = TestResult.shard_key(self.test_type, self.test_id)
+        try:
+            # epochMs, dateKey, hourOfDay, timeSlot, dayOfWeek for analytics and filters
+            item.update(time_dimensions(self.timestamp))
+        except (TypeError, ValueError):
+            pass  # client-supplied timestamp that is not ISO 8601
+        return item
+    
+    def save(self):
+        """Save test result to DynamoDB"""
+        TestResult.save_item(self.to_item())
+        return self.test_id
+    
+    @staticmethod
+    def from_storage(item, include_samples=False):
+        """Make a stored item JSON-ready: decode raw samples, or drop them from listings"""
+        if item and 'rawSamples' in item:
+            raw = item.pop('rawSamples')
+            if include_samples:
+                item['rawSamples'] = unpack_samples(raw)
+        return item
+    
+    @staticmethod
+    def from_storage_items(items):
+        return [TestResult.from_storage(item) for item in items]
+    
+    @staticmethod
+    def shard_key(test_type, test_id, shards=None):
+        """Sharded TestTypeIndex key, e.g. 'quickTest#3' (stable per test ID)"""
+        shards = shards or TEST_TYPE_SHARDS
+        return f'{test_type}#{zlib.crc32(test_id.encode()) % shards}'
+    
+    @staticmethod
+    def save_item(item):
+        """Write a prepared item (also used to replay queued writes)"""
+        table = get_table(TABLES['TEST_RESULTS'])
         
         try:
             table.put_item(Item=item)
-            return self.test_id
+            # Listings never include raw samples
+            recent_results.add({k: v for k, v in item.items() if k != 'rawSamples'})
+            return item['testId']
+        except StorageUnavailableError:
+            raise
         except Exception as e:
-            print(f'Error saving test result: {str(e)}')
+            logger.error('Error saving test result: %s', e)
             raise Exception('Failed to save test result')
     
+    @staticmethod
+    def timestamp_for_id(test_id):
+        """Range key for a ULID test ID (None for legacy UUID IDs)"""
+        return ms_to_iso(ulid_ms(test_id)) if is_ulid(test_id) else None
+    
     @staticmethod
     def get_by_id(test_id, timestamp=None):
         """Get test result by ID"""
         table = get_table(TABLES['TEST_RESULTS'])
+        timestamp = timestamp or TestResult.timestamp_for_id(test_id)
         
         try:
             if timestamp:
                 # If timestamp provided, use both keys
                 response = table.get_item(Key={'testId': test_id, 'timestamp': timestamp})
             else:
-                # Query by testId only (will return all items with this testId)
+                # Legacy UUID ID: query by testId only to find the range key
                 response = table.query(
                     KeyConditionExpression=Key('testId').eq(test_id),
                     Limit=1
                 )
-                return response.get('Items', [{}])[0] if response.get('Items') else None
+                return TestResult.from_storage(response['Items'][0], True) if response.get('Items') else None
             
-            return response.get('Item')
+            return TestResult.from_storage(response.get('Item'), True)
+        except StorageUnavailableError:
+            raise
         except Exception as e:
-            print(f'Error getting test result: {str(e)}')
+            logger.error('Error getting test result: %s', e)
             raise Exception('Failed to get test result')
     
     @staticmethod
     def get_by_user_id(user_id, limit=50):
         """Get test results by user ID"""
+        cached = recent_results.get(user_id, limit)
+        if cached is not None:
+            return cached
+        
         table = get_table(TABLES['TEST_RESULTS'])
         
         try:
+            # Read a full cache buffer so smaller pages are served from it too
+            ticket = recent_results.begin(user_id)
             response = table.query(
                 IndexName='UserIdIndex',
                 KeyConditionExpression=Key('userId').eq(user_id),
                 ScanIndexForward=False,  # Most recent first
-                Limit=limit
+                Limit=max(limit, recent_results.per_user)
             )
-            return response.get('Items', [])
+            items = TestResult.from_storage_items(response.get('Items', []))
+            recent_results.fill(user_id, items, 'LastEvaluatedKey' not in response, ticket)
+            return items[:limit]
+        except StorageUnavailableError:
+            raise
         except Exception as e:
-            print(f'Error getting test results by user: {str(e)}')
+            logger.error('Error getting test results by user: %s', e)
             raise Exception('Failed to get test results by user')
     
     @staticmethod
     def get_by_test_type(test_type, limit=50):
-        """Get test results by type"""
+        """Get test results by type (newest first)"""
+        if not sharded_type_reads():
+            return TestResult._query_test_type_index(TEST_TYPE_INDEX, 'testType', test_type, limit)
+        
+        # Query every shard in parallel and k-way merge the newest-first pages
+        shard_keys = [f'{test_type}#{shard}' for shard in range(TEST_TYPE_SHARDS)]
+        pages = list(_fanout_executor().map(
+            lambda shard_key: TestResult._query_test_type_index(
+                TEST_TYPE_SHARD_INDEX, 'testTypeShard', shard_key, limit
+            ),
+            shard_keys
+        ))
+        merged = heapq.merge(*pages, key=lambda item: item.get('timestamp', ''), reverse=True)
+        return list(itertools.islice(merged, limit))
+    
+    @staticmethod
+    def _query_test_type_index(index_name, key_name, key_value, limit):
         table = get_table(TABLES['TEST_RESULTS'])
         
         try:
             response = table.query(
-                IndexName='TestTypeIndex',
-                KeyConditionExpression=Key('testType').eq(test_type),
+                IndexName=index_name,
+                KeyConditionExpression=Key(key_name).eq(key_value),
                 ScanIndexForward=False,  # Most recent first
                 Limit=limit
             )
-            return response.get('Items', [])
+            return TestResult.from_storage_items(response.get('Items', []))
+        except StorageUnavailableError:
+            raise
         except Exception as e:
-            print(f'Error getting test results by type: {str(e)}')
+            logger.error('Error getting test results by type: %s', e)
             raise Exception('Failed to get test results by type')
     
+    @staticmethod
+    def type_partitions(test_types=TEST_TYPES):
+        """(index name, key name, key value) of every type index partition"""
+        if sharded_type_reads():
+            return [(TEST_TYPE_SHARD_INDEX, 'testTypeShard', f'{test_type}#{shard}')
+                    for test_type in test_types for shard in range(TEST_TYPE_SHARDS)]
+        return [(TEST_TYPE_INDEX, 'testType', test_type) for test_type in test_types]
+    
+    @staticmethod
+    def fold_time_range(start, end, accumulator, test_types=TEST_TYPES, projection=None, max_items=None,
+                        max_read_units=None, read_bucket=None, newest_first=False):
+        """Stream results with start <= timestamp <= end into accumulators
+
+        Each type index partition (every shard of every type) is queried on
+        its timestamp range key in parallel, page by page, into its own
+        ``accumulator()`` (anything with ``add(item)``); items are never
+        collected into a list. Stops paging once ``max_items`` have been read
+        or the queries have consumed ``max_read_units`` read capacity units.
+        With a ``read_bucket`` (TokenBucket of read units per second), every
+        page waits for the capacity it consumes. With ``newest_first``, each
+        partition is read from ``end`` back, so a truncated read keeps the
+        newest results.
+        Returns (accumulators, truncated).
+        """
+        table = get_table(TABLES['TEST_RESULTS'])
+        partitions = TestResult.type_partitions(test_types)
+        lock = threading.Lock()
+        read = [0, 0.0]  # items, capacity units
+        
+        def fold(partition):
+            index_name, key_name, key_value = partition
+            accumulated = accumulator()
+            query_kwargs = {
+                'IndexName': index_name,
+                'KeyConditionExpression': Key(key_name).eq(key_value) & Key('timestamp').between(start, end),
+                'ScanIndexForward': not newest_first
+            }
+            if projection:
+                query_kwargs['ProjectionExpression'], query_kwargs['ExpressionAttributeNames'] = projection
+            if max_read_units is not None or read_bucket is not None:
+                # Small pages, so parallel partitions overshoot the budget or rate by little
+                query_kwargs['Limit'] = BUDGETED_PAGE_SIZE
+                query_kwargs['ReturnConsumedCapacity'] = 'TOTAL'
+            while True:
+                if read_bucket is not None:
+                    read_bucket.acquire()
+                response = table.query(**query_kwargs)
+                units = float((response.get('ConsumedCapacity') or {}).get('CapacityUnits', 0))
+                if read_bucket is not None:
+                    read_bucket.acquire(max(0.0, units - 1))
+                items = response.get('Items', [])
+                for item in items:
+                    accumulated.add(item)
+                with lock:
+                    read[0] += len(items)
+                    read[1] += units
+                    over_budget = ((max_items is not None and read[0] >= max_items)
+                                   or (max_read_units is not None and read[1] >= max_read_units))
+                if 'LastEvaluatedKey' not in response:
+                    return accumulated, False
+                if over_budget:
+                    return accumulated, True
+                query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        
+        try:
+            folded = list(_fanout_executor().map(fold, partitions))
+            return [accumulated for accumulated, _ in folded], any(truncated for _, truncated in folded)
+        except StorageUnavailableError:
+            raise
+        except Exception as e:
+            logger.error('Error reading test results by time range: %s', e)
+            raise Exception('Failed to read test results by time range')
+    
     @staticmethod
     def get_recent(limit=20):
         """Get recent test results"""
@@ -117,25 +342,44 @@ class TestResult:
         
         try:
             response = table.scan(Limit=limit)
-            items = response.get('Items', [])
+            items = TestResult.from_storage_items(response.get('Items', []))
             
             # Sort by timestamp (most recent first)
             items.sort(key=lambda x: x.get('timestamp', ''), reverse=True)
             return items[:limit]
+        except StorageUnavailableError:
+            raise
         except Exception as e:
-            print(f'Error getting recent test results: {str(e)}')
+            logger.error('Error getting recent test results: %s', e)
             raise Exception('Failed to get recent test results')
     
     @staticmethod
-    def delete(test_id):
+    def delete(test_id, timestamp=None):
         """Delete test result"""
         table = get_table(TABLES['TEST_RESULTS'])
+        timestamp = timestamp or TestResult.timestamp_for_id(test_id)
         
         try:
-            table.delete_item(Key={'testId': test_id})
+            if not timestamp:
+                # Legacy UUID ID: look up the range key first
+                response = table.query(
+                    KeyConditionExpression=Key('testId').eq(test_id),
+                    ProjectionExpression='#ts',
+                    ExpressionAttributeNames={'#ts': 'timestamp'},
+                    Limit=1
+                )
+                items = response.get('Items', [])
+                if not items:
+                    return False
+                timestamp = items[0]['timestamp']
+            
+            response = table.delete_item(Key={'testId': test_id, 'timestamp': timestamp}, ReturnValues='ALL_OLD')
+            recent_results.invalidate((response.get('Attributes') or {}).get('userId'), test_id)
             return True
+        except StorageUnavailableError:
+            raise
         except Exception as e:
-            print(f'Error deleting test result: {str(e)}')
+            logger.error('Error deleting test result: %s', e)
             raise Exception('Failed to delete test result')
     
     @staticmethod
@@ -168,14 +412,31 @@ class TestResult:
                 expression_attribute_values[':startDate'] = filters['startDate']
                 expression_attribute_values[':endDate'] = filters['endDate']
             
+            # Time dimensions stored at write time
+            for name in ('dayOfWeek', 'timeSlot', 'hourOfDay'):
+                if filters.get(name) is not None:
+                    filter_expressions.append(f'#{name} = :{name}')
+                    expression_attribute_names[f'#{name}'] = name
+                    expression_attribute_values[f':{name}'] = filters[name]
+            
             if filter_expressions:
                 scan_kwargs['FilterExpression'] = ' AND '.join(filter_expressions)
                 scan_kwargs['ExpressionAttributeValues'] = expression_attribute_values
                 scan_kwargs['ExpressionAttributeNames'] = expression_attribute_names
             
             response = table.scan(**scan_kwargs)
-            return response.get('Items', [])
+            return TestResult.from_storage_items(response.get('Items', []))
+        except StorageUnavailableError:
+            raise
         except Exception as e:
-            print(f'Error getting test results with filters: {str(e)}')
+            logger.error('Error getting test results with filters: %s', e)
             raise Exception('Failed to get test results with filters')
 
+# Writes accepted while DynamoDB was throttling, replayed in the background
+pending_writes = WriteQueue(
+    'pendingWrites',
+    writer=TestResult.save_item,
+    retryable=lambda e: isinstance(e, StorageUnavailableError),
+    max_size=int(os.getenv('WRITE_QUEUE_MAX_SIZE', 10000))
+)
+metrics.register('pendingWrites', pending_writes.stats)
@@ -0,0 +1,234 @@
+"""
+IPGrok Probe Server - WebSocket RTT, jitter and packet loss probes
+Runs alongside app.py as its own asyncio process:
+
+    python probe_server.py            # ws://localhost:3002/probe
+
+Protocol (JSON text frames):
+    server -> {"type": "probe", "seq": 1, "t": <server ms>}     at ?rate= per second
+    client -> {"type": "echo", "seq": 1}                        echo each probe back
+    server -> {"type": "stats", ...}                            about once a second
+    server -> {"type": "result", ...}                           after ?count= probes
+    client -> {"type": "ping", "seq": 1, "t": <client ms>}      client-timed RTT
+    server -> {"type": "pong", "seq": 1, "t": <client ms>, "serverTime": <ms>}
+
+RTT is measured on the server's monotonic clock, so client clocks don't
+matter. Jitter is the RFC 3550 interarrival estimate (J += (|D| - J) / 16)
+applied to consecutive RTTs. Loss counts probes with no echo after
+?timeout= ms. Stats cover the last ?window= probes.
+"""
+
+import asyncio
+import ipaddress
+import json
+import os
+import time
+from collections import deque
+
+from aiohttp import WSMsgType, web
+from dotenv import load_dotenv
+
+load_dotenv()
+
+MAX_SESSIONS = int(os.getenv('PROBE_MAX_SESSIONS', 5000))
+MAX_SESSIONS_PER_IP = int(os.getenv('PROBE_MAX_SESSIONS_PER_IP', 4))
+MAX_RATE = float(os.getenv('PROBE_MAX_RATE', 50))
+MAX_COUNT = 10000
+MAX_PADDING = 1400
+
+# Proxies (IPs or CIDRs, comma-separated) whose X-Forwarded-For is believed;
+# without them each client is identified by its socket address
+TRUSTED_PROXIES = [ipaddress.ip_network(proxy.strip(), strict=False)
+                   for proxy in os.getenv('PROBE_TRUSTED_PROXIES', '').split(',') if proxy.strip()]
+
+ALLOWED_ORIGINS = {
+    os.getenv('FRONTEND_URL', 'http://localhost:5173'),
+    'http://localhost:3000',
+    'http://127.0.0.1:3000',
+    'https://www.ipgrok.com'
+}
+
+class ProbeWindow:
+    """RTT, jitter and loss over the last ``size`` probes"""
+
+    def __init__(self, size=100, timeout=2.0):
+        self.timeout = timeout
+        self.probes = deque(maxlen=size)   # [seq, sent (monotonic s), rtt ms or None]
+        self.by_seq = {}
+        self.jitter = 0.0
+        self.last_rtt = None
+        self.sent = 0
+        self.received = 0
+
+    def record_sent(self, seq, now):
+        if len(self.probes) == self.probes.maxlen:
+            self.by_seq.pop(self.probes[0][0], None)
+        entry = [seq, now, None]
+        self.probes.append(entry)
+        self.by_seq[seq] = entry
+        self.sent += 1
+
+    def record_echo(self, seq, now):
+        entry = self.by_seq.get(seq)
+        if entry is None or entry[2] is not None:
+            return None  # unknown, outside the window, or a duplicate
+        rtt = (now - entry[1]) * 1000
+        entry[2] = rtt
+        self.received += 1
+        if self.last_rtt is not None:
+            self.jitter += (abs(rtt - self.last_rtt) - self.jitter) / 16
+        self.last_rtt = rtt
+        return rtt
+
+    def stats(self, now):
+        rtts = []
+        lost = 0
+        for _, sent, rtt in self.probes:
+            if rtt is not None:
+                rtts.append(rtt)
+            elif now - sent >= self.timeout:
+                lost += 1
+        settled = len(rtts) + lost
+        diffs = [abs(b - a) for a, b in zip(rtts, rtts[1:])]
+        return {
+            'window': settled,
+            'sent': self.sent,
+            'received': self.received,
+            'lost': lost,
+            'lossPercent': round(lost * 100 / settled, 2) if settled else 0,
+            'rtt': {
+                'min': round(min(rtts), 3),
+                'avg': round(sum(rtts) / len(rtts), 3),
+                'max': round(max(rtts), 3),
+                'last': round(rtts[-1], 3)
+            } if rtts else None,
+            'jitter': round(self.jitter, 3),
+            'windowJitter': round(sum(diffs) / len(diffs), 3) if diffs else 0
+        }
+
+def _param(request, name, default, low, high, cast=float):
+    try:
+        value = cast(request.query.get(name, default))
+    except ValueError:
+        raise web.HTTPBadRequest(text=f'{name} must be a number')
+    return max(low, min(high, value))
+
+async def _send(ws, message):
+    if not ws.closed:
+        await ws.send_str(json.dumps(message, separators=(',', ':')))
+
+async def send_probes(ws, window, rate, count, padding):
+    """Send probes on a fixed schedule (no drift), with stats once a second"""
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    stats_every = max(1, int(rate))
+    pad = 'x' * padding
+    seq = 0
+    while not ws.closed and (count == 0 or seq < count):
+        seq += 1
+        delay = start + (seq - 1) / rate - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        window.record_sent(seq, time.monotonic())
+        probe = {'type': 'probe', 'seq': seq, 't': time.time_ns() // 1_000_000}
+        if pad:
+            probe['pad'] = pad
+        await _send(ws, probe)
+        if seq % stats_every == 0:
+            await _send(ws, {'type': 'stats', **window.stats(time.monotonic())})
+
+    # Give the last probes time to come back, then report and close
+    await asyncio.sleep(window.timeout)
+    await _send(ws, {'type': 'result', **window.stats(time.monotonic())})
+    await ws.close()
+
+def _trusted(address):
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in TRUSTED_PROXIES)
+
+def client_ip(request):
+    """The client's address: the nearest X-Forwarded-For hop not added by a trusted proxy"""
+    peer = request.remote
+    if not _trusted(peer):
+        return peer
+    hops = [hop.strip() for hop in request.headers.get('X-Forwarded-For', '').split(',') if hop.strip()]
+    for hop in reversed(hops):
+        if not _trusted(hop):
+            return hop
+    return hops[0] if hops else peer
+
+async def probe_handler(request):
+    """WebSocket probe session"""
+    sessions = request.app['sessions']
+    origin = request.headers.get('Origin')
+    if origin and origin not in ALLOWED_ORIGINS:
+        raise web.HTTPForbidden(text='Origin not allowed')
+    peer = client_ip(request)
+    if len(sessions) >= MAX_SESSIONS or sum(1 for ip in sessions.values() if ip == peer) >= MAX_SESSIONS_PER_IP:
+        raise web.HTTPServiceUnavailable(text='Too many probe sessions', headers={'Retry-After': '5'})
+
+    rate = _param(request, 'rate', 10, 0.5, MAX_RATE)
+    count = _param(request, 'count', 100, 0, MAX_COUNT, int)
+    window = ProbeWindow(
+        size=_param(request, 'window', 100, 10, 1000, int),
+        timeout=_param(request, 'timeout', 2000, 100, 10000) / 1000
+    )
+    padding = _param(request, 'size', 0, 0, MAX_PADDING, int)
+
+    # Hold the slot from before the handshake, so concurrent handshakes
+    # can't all pass the checks above
+    ws = web.WebSocketResponse(heartbeat=30, max_msg_size=4096, compress=False)
+    sessions[ws] = peer
+    sender = None
+    try:
+        await ws.prepare(request)
+        sender = asyncio.create_task(send_probes(ws, window, rate, count, padding))
+        async for msg in ws:
+            if msg.type != WSMsgType.TEXT:
+                continue
+            received = time.monotonic()
+            try:
+                data = json.loads(msg.data)
+            except ValueError:
+                continue
+            if not isinstance(data, dict):
+                continue  # e.g. [1] or "x"; a bad message must not end the session
+            kind = data.get('type')
+            if kind == 'echo':
+                seq = data.get('seq')
+                if isinstance(seq, int) and not isinstance(seq, bool):
+                    window.record_echo(seq, received)
+            elif kind == 'ping':
+                await _send(ws, {'type': 'pong', 'seq': data.get('seq'), 't': data.get('t'),
+                                 'serverTime': time.time_ns() // 1_000_000})
+            elif kind == 'stats':
+                await _send(ws, {'type': 'stats', **window.stats(received)})
+    finally:
+        if sender is not None:
+            sender.cancel()
+        del sessions[ws]
+    return ws
+
+async def health(request):
+    """Health check endpoint"""
+    return web.json_response({
+        'status': 'OK',
+        'sessions': len(request.app['sessions']),
+        'service': 'IPGrok Probe Server'
+    })
+
+def create_app():
+    app = web.Application()
+    app['sessions'] = {}
+    app.router.add_get('/probe', probe_handler)
+    app.router.add_get('/health', health)
+    return app
+
+if __name__ == '__main__':
+    port = int(os.getenv('PROBE_PORT', 3002))
+    print(f'🚀 IPGrok Probe Server running on port {port}')
+    print(f'📡 Probe endpoint: ws://localhost:{port}/probe')
+    web.run_app(create_app(), port=port, print=None)
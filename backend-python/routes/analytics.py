@@ -4,13 +4,52 @@ Analytics API Routes
 
 from flask import Blueprint, jsonify, request
 from models.test_result import TestResult
-from datetime import datetime, timedelta
-from collections import defaultdict
+from extensions import read_limit
+from config.dynamodb import StorageUnavailableError
+from services.analytics import (
+    run_analytics, compute_performance, compute_trends, compute_comparison, compute_dashboard,
+    dashboard_panels, GROUP_BY_DIMENSIONS
+)
+from services.archive import ArchiveReader
+from services.materializer import read_summary
+from services.timeseries import (
+    compute_timeseries, parse_window, check_raw_window, needs_raw, RawWindowError, GRANULARITIES, METRICS,
+    DOWNSAMPLE_METHODS, TIMESERIES_MAX_POINTS
+)
+from models.test_result import TEST_TYPES
+from routes.auth import require_auth
+from utils.compression import compressed_jsonify
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import os
 
 analytics_bp = Blueprint('analytics', __name__)
 
+archive_reader = ArchiveReader()
+HISTORY_REPORTS = {
+    'performance': compute_performance,
+    'trends': compute_trends,
+    'comparison': compute_comparison
+}
+# Longer ranges belong in the offline tools, not a request
+HISTORY_MAX_DAYS = int(os.getenv('HISTORY_MAX_DAYS', 92))
+DASHBOARD_MAX_LIMIT = int(os.getenv('DASHBOARD_MAX_LIMIT', 1000))
+
+def load_dashboard(panels, limit):
+    """One results scan shared by every panel, plus the summary rollup"""
+    needs_results = any(panel != 'summary' for panel in panels)
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        # The rollup GetItem runs while the scan is in flight
+        summary = pool.submit(read_summary) if 'summary' in panels else None
+        results = TestResult.get_recent(limit) if needs_results else []
+        summary = summary.result() if summary else None
+    if summary is None and not needs_results:
+        results = TestResult.get_recent(100)  # no rollup yet, as in stats/summary
+    return compute_dashboard(results, panels, summary)
+
 # GET /api/analytics/performance - Get performance analytics
 @analytics_bp.route('/performance', methods=['GET'])
+@read_limit
 def get_performance_analytics():
     """Get performance analytics"""
     try:
@@ -19,6 +58,12 @@ def get_performance_analytics():
         end_date = request.args.get('endDate')
         test_type = request.args.get('testType')
         limit = int(request.args.get('limit', 100))
+        group_by = request.args.get('groupBy')
+        if group_by and group_by not in GROUP_BY_DIMENSIONS:
+            return jsonify({
+                'error': 'Validation error',
+                'message': f"groupBy must be one of: {', '.join(GROUP_BY_DIMENSIONS)}"
+            }), 400
         
         # Build filters
         filters = {}
@@ -28,99 +73,19 @@ def get_performance_analytics():
         if test_type:
             filters['testType'] = test_type
         
-        results = TestResult.get_with_filters(filters, limit)
-        
-        # Calculate performance metrics
-        performance_data = {
-            'downloadSpeeds': [],
-            'uploadSpeeds': [],
-            'latencies': [],
-            'connectionQualities': {},
-            'testTypeDistribution': {},
-            'timeSeriesData': {},
-            'summary': {
-                'totalTests': len(results),
-                'averageDownloadSpeed': 0,
-                'averageUploadSpeed': 0,
-                'averageLatency': 0,
-                'bestDownloadSpeed': 0,
-                'bestUploadSpeed': 0,
-                'lowestLatency': float('inf')
-            }
-        }
-        
-        total_download = 0
-        total_upload = 0
-        total_latency = 0
-        speed_count = 0
-        latency_count = 0
-        
-        for result in results:
-            # Count test types
-            test_type = result.get('testType')
-            performance_data['testTypeDistribution'][test_type] = \
-                performance_data['testTypeDistribution'].get(test_type, 0) + 1
-            
-            network_data = result.get('networkData', {})
-            speed_test = network_data.get('speedTest', {})
-            
-            download = float(speed_test.get('download', 0))
-            upload = float(speed_test.get('upload', 0))
-            latency = speed_test.get('latency')
-            quality = speed_test.get('connectionQuality')
-            
-            if download:
-                performance_data['downloadSpeeds'].append(download)
-                total_download += download
-                speed_count += 1
-                performance_data['summary']['bestDownloadSpeed'] = max(
-                    performance_data['summary']['bestDownloadSpeed'], download
-                )
-            
-            if upload:
-                performance_data['uploadSpeeds'].append(upload)
-                total_upload += upload
-                performance_data['summary']['bestUploadSpeed'] = max(
-                    performance_data['summary']['bestUploadSpeed'], upload
-                )
-            
-            if latency:
-                performance_data['latencies'].append(latency)
-                total_latency += latency
-                latency_count += 1
-                performance_data['summary']['lowestLatency'] = min(
-                    performance_data['summary']['lowestLatency'], latency
-                )
-            
-            if quality:
-                performance_data['connectionQualities'][quality] = \
-                    performance_data['connectionQualities'].get(quality, 0) + 1
-            
-            # Time series data
-            timestamp = result.get('timestamp', '')
-            if timestamp:
-                date_key = timestamp.split('T')[0]
-                if date_key not in performance_data['timeSeriesData']:
-                    performance_data['timeSeriesData'][date_key] = {
-                        'tests': 0,
-                        'avgDownload': 0,
-                        'avgUpload': 0,
-                        'avgLatency': 0
-                    }
-                performance_data['timeSeriesData'][date_key]['tests'] += 1
-        
-        # Calculate averages
-        if speed_count > 0:
-            performance_data['summary']['averageDownloadSpeed'] = round(total_download / speed_count, 2)
-            performance_data['summary']['averageUploadSpeed'] = round(total_upload / speed_count, 2)
-        if latency_count > 0:
-            performance_data['summary']['averageLatency'] = round(total_latency / latency_count, 2)
+        key = ('performance', filters.get('startDate'), filters.get('endDate'), filters.get('testType'), limit, group_by)
+        performance_data, stale = run_analytics(
+            key, lambda: compute_performance(TestResult.get_with_filters(filters, limit), group_by)
+        )
         
         return jsonify({
             'success': True,
+            'stale': stale,
             'data': performance_data
         }), 200
         
+    except StorageUnavailableError:
+        raise  # 503, handled app-wide
     except Exception as e:
         return jsonify({
             'error': 'Internal server error',
@@ -129,51 +94,21 @@ def get_performance_analytics():
 
 # GET /api/analytics/trends - Get trend analysis
 @analytics_bp.route('/trends', methods=['GET'])
+@read_limit
 def get_trend_analytics():
     """Get trend analysis"""
     try:
         limit = int(request.args.get('limit', 200))
-        results = TestResult.get_recent(limit)
-        
-        trends = {
-            'daily': defaultdict(lambda: {'tests': 0, 'downloadSpeeds': [], 'uploadSpeeds': [], 'latencies': []}),
-            'testTypeTrends': defaultdict(lambda: {'daily': defaultdict(int)})
-        }
-        
-        for result in results:
-            timestamp = result.get('timestamp', '')
-            if not timestamp:
-                continue
-            
-            date_key = timestamp.split('T')[0]
-            test_type = result.get('testType')
-            
-            # Daily trends
-            trends['daily'][date_key]['tests'] += 1
-            
-            # Test type trends
-            trends['testTypeTrends'][test_type]['daily'][date_key] += 1
-            
-            # Performance data
-            network_data = result.get('networkData', {})
-            speed_test = network_data.get('speedTest', {})
-            
-            if speed_test.get('download'):
-                trends['daily'][date_key]['downloadSpeeds'].append(float(speed_test['download']))
-            if speed_test.get('upload'):
-                trends['daily'][date_key]['uploadSpeeds'].append(float(speed_test['upload']))
-            if speed_test.get('latency'):
-                trends['daily'][date_key]['latencies'].append(speed_test['latency'])
-        
-        # Convert defaultdicts to regular dicts
-        trends['daily'] = dict(trends['daily'])
-        trends['testTypeTrends'] = {k: {'daily': dict(v['daily'])} for k, v in trends['testTypeTrends'].items()}
+        trends, stale = run_analytics(('trends', limit), lambda: compute_trends(TestResult.get_recent(limit)))
         
         return jsonify({
             'success': True,
+            'stale': stale,
             'data': trends
         }), 200
         
+    except StorageUnavailableError:
+        raise  # 503, handled app-wide
     except Exception as e:
         return jsonify({
             'error': 'Internal server error',
@@ -182,86 +117,179 @@ def get_trend_analytics():
 
 # GET /api/analytics/comparison - Compare performance across different criteria
 @analytics_bp.route('/comparison', methods=['GET'])
+@read_limit
 def get_comparison_analytics():
     """Compare performance across different criteria"""
     try:
         limit = int(request.args.get('limit', 500))
-        results = TestResult.get_recent(limit)
+        comparison, stale = run_analytics(
+            ('comparison', limit), lambda: compute_comparison(TestResult.get_recent(limit))
+        )
         
-        comparison = {
-            'testTypes': defaultdict(lambda: {'count': 0, 'downloadSpeeds': [], 'uploadSpeeds': [], 'latencies': []}),
-            'timeOfDay': defaultdict(lambda: {'count': 0, 'downloadSpeeds': [], 'uploadSpeeds': [], 'latencies': []}),
-            'dayOfWeek': defaultdict(lambda: {'count': 0, 'downloadSpeeds': [], 'uploadSpeeds': [], 'latencies': []})
-        }
+        return jsonify({
+            'success': True,
+            'stale': stale,
+            'data': comparison
+        }), 200
         
-        for result in results:
-            test_type = result.get('testType')
-            timestamp = result.get('timestamp', '')
-            
-            if timestamp:
-                try:
-                    dt = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
-                    hour = dt.hour
-                    day_of_week = dt.strftime('%A')
-                    
-                    # Determine time slot
-                    if 6 <= hour < 12:
-                        time_slot = 'Morning (6-12)'
-                    elif 12 <= hour < 18:
-                        time_slot = 'Afternoon (12-18)'
-                    elif 18 <= hour < 24:
-                        time_slot = 'Evening (18-24)'
-                    else:
-                        time_slot = 'Night (0-6)'
-                    
-                    # Increment counts
-                    comparison['testTypes'][test_type]['count'] += 1
-                    comparison['timeOfDay'][time_slot]['count'] += 1
-                    comparison['dayOfWeek'][day_of_week]['count'] += 1
-                    
-                    # Add performance data
-                    network_data = result.get('networkData', {})
-                    speed_test = network_data.get('speedTest', {})
-                    
-                    if speed_test.get('download'):
-                        download = float(speed_test['download'])
-                        comparison['testTypes'][test_type]['downloadSpeeds'].append(download)
-                        comparison['timeOfDay'][time_slot]['downloadSpeeds'].append(download)
-                        comparison['dayOfWeek'][day_of_week]['downloadSpeeds'].append(download)
-                    
-                    if speed_test.get('upload'):
-                        upload = float(speed_test['upload'])
-                        comparison['testTypes'][test_type]['uploadSpeeds'].append(upload)
-                        comparison['timeOfDay'][time_slot]['uploadSpeeds'].append(upload)
-                        comparison['dayOfWeek'][day_of_week]['uploadSpeeds'].append(upload)
-                    
-                    if speed_test.get('latency'):
-                        latency = speed_test['latency']
-                        comparison['testTypes'][test_type]['latencies'].append(latency)
-                        comparison['timeOfDay'][time_slot]['latencies'].append(latency)
-                        comparison['dayOfWeek'][day_of_week]['latencies'].append(latency)
-                except:
-                    pass
+    except StorageUnavailableError:
+        raise  # 503, handled app-wide
+    except Exception as e:
+        return jsonify({
+            'error': 'Internal server error',
+            'message': str(e)
+        }), 500
+
+# GET /api/analytics/dashboard - Every admin dashboard panel in one response
+@analytics_bp.route('/dashboard', methods=['GET'])
+@read_limit
+@require_auth
+def get_dashboard():
+    """Summary, performance, trends, comparison and recent results together"""
+    try:
+        try:
+            panels = dashboard_panels(request.args.get('panels'))
+        except ValueError as e:
+            return jsonify({
+                'error': 'Validation error',
+                'message': str(e)
+            }), 400
+        limit = int(request.args.get('limit', 500))
+        if not 1 <= limit <= DASHBOARD_MAX_LIMIT:
+            return jsonify({
+                'error': 'Validation error',
+                'message': f'limit must be 1-{DASHBOARD_MAX_LIMIT}'
+            }), 400
         
-        # Calculate averages for each category
-        for category in comparison:
-            for key in comparison[category]:
-                data = comparison[category][key]
-                data['avgDownload'] = round(sum(data['downloadSpeeds']) / len(data['downloadSpeeds']), 2) if data['downloadSpeeds'] else 0
-                data['avgUpload'] = round(sum(data['uploadSpeeds']) / len(data['uploadSpeeds']), 2) if data['uploadSpeeds'] else 0
-                data['avgLatency'] = round(sum(data['latencies']) / len(data['latencies']), 2) if data['latencies'] else 0
+        data, stale = run_analytics(('dashboard', panels, limit), lambda: load_dashboard(panels, limit))
         
-        # Convert defaultdicts to regular dicts
-        comparison = {k: dict(v) for k, v in comparison.items()}
+        return compressed_jsonify({
+            'success': True,
+            'stale': stale,
+            'panels': list(panels),
+            'data': data
+        })
+        
+    except StorageUnavailableError:
+        raise  # 503, handled app-wide
+    except Exception as e:
+        return jsonify({
+            'error': 'Internal server error',
+            'message': str(e)
+        }), 500
+
+# GET /api/analytics/timeseries - Downsampled metric series for charts
+@analytics_bp.route('/timeseries', methods=['GET'])
+@read_limit
+def get_timeseries_analytics():
+    """Fixed-size series of one metric over a time window"""
+    try:
+        metric = request.args.get('metric', 'download')
+        granularity = request.args.get('granularity', '1h')
+        downsample = request.args.get('downsample', 'buckets')
+        test_type = request.args.get('testType')
+        start, end = request.args.get('from'), request.args.get('to')
+        errors = []
+        if metric not in METRICS:
+            errors.append(f"metric must be one of: {', '.join(METRICS)}")
+        if granularity not in GRANULARITIES:
+            errors.append(f"granularity must be one of: {', '.join(GRANULARITIES)}")
+        if downsample not in DOWNSAMPLE_METHODS:
+            errors.append(f"downsample must be one of: {', '.join(DOWNSAMPLE_METHODS)}")
+        if test_type and test_type not in TEST_TYPES:
+            errors.append(f"testType must be one of: {', '.join(TEST_TYPES)}")
+        try:
+            points = int(request.args.get('points', 200))
+        except ValueError:
+            points = 0
+        if not 3 <= points <= TIMESERIES_MAX_POINTS:
+            errors.append(f'points must be 3-{TIMESERIES_MAX_POINTS}')
+        if not errors:
+            step = GRANULARITIES[granularity]
+            try:
+                _, start_ms, end_ms, _ = parse_window(start, end, step, points)
+                if needs_raw(step, test_type):
+                    check_raw_window(start_ms, end_ms)
+            except RawWindowError as e:
+                errors.append(str(e))
+            except ValueError as e:
+                errors.append(f'Invalid from/to window: {e}')
+        if errors:
+            return jsonify({
+                'error': 'Validation error',
+                'message': '; '.join(errors)
+            }), 400
+        
+        data, stale = run_analytics(
+            ('timeseries', metric, granularity, start, end, points, downsample, test_type),
+            lambda: compute_timeseries(metric, granularity, start, end, points, downsample, test_type)
+        )
         
         return jsonify({
             'success': True,
-            'data': comparison
+            'stale': stale,
+            'data': data
         }), 200
         
+    except RawWindowError as e:
+        # Daily views not materialized yet, and the window is too long for raw reads
+        return jsonify({
+            'error': 'Service unavailable',
+            'message': str(e)
+        }), 503
+    except StorageUnavailableError:
+        raise
     except Exception as e:
         return jsonify({
             'error': 'Internal server error',
             'message': str(e)
         }), 500
 
+# GET /api/analytics/history - Analytics over archived (older) results
+@analytics_bp.route('/history', methods=['GET'])
+@read_limit
+def get_history_analytics():
+    """Run a report over the columnar archive"""
+    try:
+        report = request.args.get('report', 'performance')
+        start_date = request.args.get('startDate')
+        end_date = request.args.get('endDate')
+        if report not in HISTORY_REPORTS:
+            return jsonify({
+                'error': 'Validation error',
+                'message': f"report must be one of: {', '.join(HISTORY_REPORTS)}"
+            }), 400
+        try:
+            span = (datetime.fromisoformat(end_date[:10]) - datetime.fromisoformat(start_date[:10])).days
+        except (TypeError, ValueError):
+            return jsonify({
+                'error': 'Validation error',
+                'message': 'startDate and endDate (YYYY-MM-DD) are required'
+            }), 400
+        if span < 0 or span > HISTORY_MAX_DAYS:
+            return jsonify({
+                'error': 'Validation error',
+                'message': f'Date range must be 0-{HISTORY_MAX_DAYS} days'
+            }), 400
+        
+        compute = HISTORY_REPORTS[report]
+        data, stale = run_analytics(
+            ('history', report, start_date, end_date),
+            # Folded item by item: only one archived day is decoded at a time
+            lambda: compute(archive_reader.items(start_date, end_date))
+        )
+        
+        return jsonify({
+            'success': True,
+            'stale': stale,
+            'report': report,
+            'data': data
+        }), 200
+        
+    except StorageUnavailableError:
+        raise
+    except Exception as e:
+        return jsonify({
+            'error': 'Internal server error',
+            'message': str(e)
+        }), 500
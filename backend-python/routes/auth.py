@@ -6,9 +6,14 @@ from flask import Blueprint, jsonify, request
 from functools import wraps
 import jwt
 import os
+import time
 from datetime import datetime, timedelta
 import hashlib
 
+from utils.cache import LRUCache
+from utils.token_revocation import RevocationList
+from utils import metrics
+
 auth_bp = Blueprint('auth', __name__)
 
 # Admin credentials (in production, use environment variables and hashed passwords)
@@ -20,20 +25,54 @@ ADMIN_USERS = {
 JWT_SECRET = os.getenv('JWT_SECRET', 'your-secret-key-change-in-production')
 JWT_EXPIRY_HOURS = 24
 
+# Verified tokens, keyed by token hash and kept until the token's own `exp`
+TOKEN_CACHE = LRUCache(max_size=int(os.getenv('TOKEN_CACHE_SIZE', 1024)))
+
+# Tokens revoked by /logout. Set TOKEN_REVOCATION_FILE to share across workers.
+REVOKED_TOKENS = RevocationList(os.getenv('TOKEN_REVOCATION_FILE'))
+
+metrics.register('tokenCache', TOKEN_CACHE.stats)
+
 def hash_password(password):
     """Hash a password"""
     return hashlib.sha256(password.encode()).hexdigest()
 
+def hash_token(token):
+    """Hash a token for use as a cache/revocation key"""
+    return hashlib.sha256(token.encode()).hexdigest()
+
 def verify_token(token):
-    """Verify JWT token"""
+    """Verify JWT token (cached until expiry, rejected once revoked)"""
+    token_hash = hash_token(token)
+    if REVOKED_TOKENS.is_revoked(token_hash):
+        metrics.increment('auth.revokedTokenRejected')
+        return None
+
+    payload = TOKEN_CACHE.get(token_hash)
+    if payload is not None:
+        return payload
+
     try:
         payload = jwt.decode(token, JWT_SECRET, algorithms=['HS256'])
-        return payload
     except jwt.ExpiredSignatureError:
         return None
     except jwt.InvalidTokenError:
         return None
 
+    TOKEN_CACHE.set(token_hash, payload, expires_at=payload.get('exp', time.time()))
+    return payload
+
+def revoke_token(token):
+    """Revoke a token until it would have expired anyway"""
+    payload = verify_token(token)
+    if not payload:
+        return False
+    token_hash = hash_token(token)
+    REVOKED_TOKENS.revoke(token_hash, payload.get('exp', time.time() + JWT_EXPIRY_HOURS * 3600))
+    TOKEN_CACHE.pop(token_hash)
+    metrics.increment('auth.tokensRevoked')
+    return True
+
 def require_auth(f):
     """Decorator to require authentication"""
     @wraps(f)
@@ -137,10 +176,14 @@ def verify():
             'message': str(e)
         }), 500
 
-# POST /api/auth/logout - Logout (client-side token deletion)
+# POST /api/auth/logout - Logout (revokes the presented token)
 @auth_bp.route('/logout', methods=['POST'])
 def logout():
-    """Logout endpoint (token invalidation happens client-side)"""
+    """Logout endpoint (revokes the bearer token server-side)"""
+    token = request.headers.get('Authorization', '').replace('Bearer ', '')
+    if token:
+        revoke_token(token)
+
     return jsonify({
         'success': True,
         'message': 'Logged out successfully'
@@ -0,0 +1,200 @@
+"""
+Speed Test API Routes
+
+Download bytes come from a random buffer generated once per process and kept
+as immutable 64KB chunks, so a download yields existing bytes objects and
+copies nothing (WSGI servers require bytes, not memoryviews). Byte N of any
+download is buffer[N % size], so Range requests return consistent content.
+"""
+
+from flask import Blueprint, Response, jsonify, request
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+
+from extensions import probe_limit, speed_test_limit
+from utils import metrics
+from utils.shm_tables import LocalRecordTable, SharedRecordTable, shm_path
+
+logger = logging.getLogger(__name__)
+
+speed_test_bp = Blueprint('speed_test', __name__)
+
+CHUNK_BYTES = 64 * 1024
+BUFFER_BYTES = max(CHUNK_BYTES, int(os.getenv('SPEEDTEST_BUFFER_BYTES', 4 * 1024 * 1024)) // CHUNK_BYTES * CHUNK_BYTES)
+MAX_TRANSFER_BYTES = int(os.getenv('SPEEDTEST_MAX_BYTES', 100 * 1024 * 1024))
+DEFAULT_DOWNLOAD_BYTES = 10 * 1024 * 1024
+UPLOAD_SAMPLE_SECONDS = 0.25
+
+# Download results go to a shared-memory table so any worker can answer the
+# follow-up lookup (the download response has already been sent when timing ends)
+RESULTS_SHM = os.getenv('SPEEDTEST_RESULTS_SHM') or shm_path('ipgrok-speedtest-results')
+RESULT_TTL_SECONDS = 300
+
+NO_STORE = {'Cache-Control': 'no-store, no-transform'}
+TRANSFER_ID = re.compile(r'^[0-9a-f]{32}$')
+
+_chunks = None
+_chunks_lock = threading.Lock()
+
+def random_chunks():
+    """The per-process random buffer as a tuple of CHUNK_BYTES bytes objects"""
+    global _chunks
+    if _chunks is None:
+        with _chunks_lock:
+            if _chunks is None:
+                _chunks = tuple(os.urandom(CHUNK_BYTES) for _ in range(BUFFER_BYTES // CHUNK_BYTES))
+    return _chunks
+
+def throughput(num_bytes, seconds):
+    return {
+        'bytes': num_bytes,
+        'durationMs': round(seconds * 1000, 3),
+        'mbps': round(num_bytes * 8 / seconds / 1e6, 2) if seconds > 0 else 0
+    }
+
+if RESULTS_SHM:
+    transfers = SharedRecordTable(RESULTS_SHM)
+else:
+    # No /dev/shm (e.g. Lambda): lookups only find downloads this process served
+    logger.warning('No /dev/shm; download timings are kept per process')
+    transfers = LocalRecordTable()
+
+def save_transfer(transfer_id, result):
+    transfers.set(transfer_id, result, RESULT_TTL_SECONDS)
+
+def load_transfer(transfer_id):
+    return transfers.get(transfer_id)
+
+def stream_download(transfer_id, start, stop, total):
+    """Yield bytes [start, stop) of the virtual download and record the timing"""
+    chunks = random_chunks()
+    position = start
+    started = time.perf_counter()
+    try:
+        while position < stop:
+            index, offset = divmod(position % BUFFER_BYTES, CHUNK_BYTES)
+            n = min(CHUNK_BYTES - offset, stop - position)
+            chunk = chunks[index]
+            yield chunk if n == CHUNK_BYTES else chunk[offset:offset + n]
+            position += n
+    finally:
+        sent = position - start
+        result = {
+            'transferId': transfer_id,
+            'direction': 'download',
+            'complete': position >= stop,
+            'range': [start, stop - 1],
+            'size': total,
+            **throughput(sent, time.perf_counter() - started)
+        }
+        metrics.increment('speedTest.downloadBytes', sent)
+        save_transfer(transfer_id, result)
+
+# GET /api/speed-test/download?bytes=N - Stream N bytes of random data
+@speed_test_bp.route('/download', methods=['GET'])
+@speed_test_limit
+def download():
+    """Stream incompressible data (supports Range)"""
+    try:
+        total = int(request.args.get('bytes', DEFAULT_DOWNLOAD_BYTES))
+    except ValueError:
+        return jsonify({'error': 'Invalid size', 'message': 'bytes must be an integer'}), 400
+    if total < 1 or total > MAX_TRANSFER_BYTES:
+        return jsonify({
+            'error': 'Invalid size',
+            'message': f'bytes must be between 1 and {MAX_TRANSFER_BYTES}'
+        }), 400
+
+    headers = {**NO_STORE, 'Accept-Ranges': 'bytes'}
+    status = 200
+    start, stop = 0, total
+    if request.range is not None:
+        byte_range = request.range.range_for_length(total)
+        if byte_range is None:
+            return Response(status=416, headers={**headers, 'Content-Range': f'bytes */{total}'})
+        start, stop = byte_range
+        status = 206
+        headers['Content-Range'] = f'bytes {start}-{stop - 1}/{total}'
+
+    transfer_id = uuid.uuid4().hex
+    headers['Content-Length'] = str(stop - start)
+    headers['X-Transfer-Id'] = transfer_id
+    return Response(stream_download(transfer_id, start, stop, total), status=status,
+                    mimetype='application/octet-stream', headers=headers, direct_passthrough=True)
+
+# GET /api/speed-test/transfers/<transferId> - Server-side timing of a download
+@speed_test_bp.route('/transfers/<transfer_id>', methods=['GET'])
+@probe_limit
+def get_transfer(transfer_id):
+    """Server-measured throughput for a finished download"""
+    result = load_transfer(transfer_id) if TRANSFER_ID.match(transfer_id) else None
+    if result is None:
+        return jsonify({'error': 'Transfer not found'}), 404
+    return jsonify({'success': True, 'data': result}), 200, NO_STORE
+
+# POST /api/speed-test/upload - Discard the body, timing it in chunks
+@speed_test_bp.route('/upload', methods=['POST'])
+@speed_test_limit
+def upload():
+    """Upload sink reporting server-side throughput"""
+    length = request.content_length
+    chunked = 'chunked' in request.headers.get('Transfer-Encoding', '').lower()
+    if length is None and not chunked:
+        return jsonify({'error': 'Length required'}), 411
+    if length is not None and length > MAX_TRANSFER_BYTES:
+        return jsonify({'error': 'Upload too large', 'message': f'Maximum is {MAX_TRANSFER_BYTES} bytes'}), 413
+
+    # Read the raw input: the app-wide MAX_CONTENT_LENGTH is for JSON bodies
+    stream = request.environ['wsgi.input']
+    remaining = length if length is not None else MAX_TRANSFER_BYTES + 1
+    received = 0
+    samples = []
+    first_byte = bucket_start = None
+    bucket_bytes = 0
+    while remaining > 0:
+        chunk = stream.read(min(CHUNK_BYTES, remaining))
+        if not chunk:
+            break
+        now = time.perf_counter()
+        if first_byte is None:
+            first_byte = bucket_start = now
+        received += len(chunk)
+        remaining -= len(chunk)
+        bucket_bytes += len(chunk)
+        if now - bucket_start >= UPLOAD_SAMPLE_SECONDS:
+            samples.append(throughput(bucket_bytes, now - bucket_start)['mbps'])
+            bucket_start, bucket_bytes = now, 0
+    finished = time.perf_counter()
+
+    if received > MAX_TRANSFER_BYTES:
+        return jsonify({'error': 'Upload too large', 'message': f'Maximum is {MAX_TRANSFER_BYTES} bytes'}), 413
+    if bucket_bytes and first_byte is not None and finished > bucket_start:
+        samples.append(throughput(bucket_bytes, finished - bucket_start)['mbps'])
+
+    metrics.increment('speedTest.uploadBytes', received)
+    return jsonify({
+        'success': True,
+        'data': {
+            'direction': 'upload',
+            'complete': length is None or received == length,
+            'samplesMbps': samples,
+            'sampleIntervalMs': UPLOAD_SAMPLE_SECONDS * 1000,
+            **throughput(received, finished - first_byte if first_byte is not None else 0)
+        }
+    }), 200, NO_STORE
+
+# GET /api/speed-test/ping - Latency echo
+@speed_test_bp.route('/ping', methods=['GET', 'POST'])
+@probe_limit
+def ping():
+    """Echo ?seq with the server receive time (plain text, no JSON encoding)"""
+    received = time.time_ns()
+    return Response(request.args.get('seq', ''), mimetype='text/plain', headers={
+        **NO_STORE,
+        'X-Server-Time-Ns': str(received),
+        'Server-Timing': f'app;dur={(time.time_ns() - received) / 1e6:.3f}'
+    })
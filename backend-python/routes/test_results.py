@@ -3,25 +3,46 @@ Test Results API Routes
 """
 
 from flask import Blueprint, jsonify, request
-from marshmallow import Schema, fields, ValidationError, validate
-from models.test_result import TestResult
-from datetime import datetime
+from marshmallow import Schema, fields, ValidationError, validate, validates_schema
+from models.test_result import TestResult, TEST_TYPES, pending_writes
+from config.dynamodb import StorageUnavailableError
+from utils.write_queue import QueueFullError
+from extensions import read_limit, write_limit
+from utils.payload_validation import BoundedDict, FastLoader, SampleArrays
+from utils.time_dimensions import DAYS_OF_WEEK, TIME_SLOTS
+from services.analytics import run_analytics, compute_summary
+from services.materializer import read_summary
+from services.sample_metrics import apply_samples
+from services.ip_enrichment import enrich
+from services.idempotency import (
+    idempotency_store, validate_key, fingerprint, IdempotencyKeyError, IdempotencyConflictError,
+    IdempotencyPendingError
+)
+from services.percentiles import percentile_table
+from services.purge import PURGE_MAX_IDS, PurgeJobStateError, create_job, get_job, resume_job, cancel_job
+from routes.auth import require_auth
+from utils.ulid import iso_to_ms, ms_to_iso
+import os
 
 test_results_bp = Blueprint('test_results', __name__)
 
+MAX_SAMPLES = int(os.getenv('MAX_SAMPLES_PER_ARRAY', 5000))
+
 # Validation schemas
 class TestResultSchema(Schema):
     """Schema for validating test result input"""
     testType = fields.Str(required=True, validate=validate.OneOf(['quickTest', 'detailedAnalysis', 'manualTest']))
-    networkData = fields.Dict(required=False)
-    mediaData = fields.Dict(required=False)
-    systemData = fields.Dict(required=False)
-    advancedTestsData = fields.Dict(required=False)
+    networkData = BoundedDict(required=False)
+    mediaData = BoundedDict(required=False)
+    systemData = BoundedDict(required=False)
+    advancedTestsData = BoundedDict(required=False)
     userId = fields.Str(required=False)
     ipAddress = fields.Str(required=False)
     userAgent = fields.Str(required=False)
-    location = fields.Dict(required=False)
-    deviceInfo = fields.Dict(required=False)
+    location = BoundedDict(required=False)
+    deviceInfo = BoundedDict(required=False)
+    # Raw ping RTTs (ms, null = lost) and throughput samples (Mbps)
+    samples = SampleArrays(['ping', 'download', 'upload'], required=False, max_length=MAX_SAMPLES)
 
 class FilterSchema(Schema):
     """Schema for validating filter parameters"""
@@ -30,15 +51,80 @@ class FilterSchema(Schema):
     startDate = fields.DateTime(required=False)
     endDate = fields.DateTime(required=False)
     limit = fields.Int(required=False, validate=validate.Range(min=1, max=100))
+    dayOfWeek = fields.Str(required=False, validate=validate.OneOf(DAYS_OF_WEEK))
+    timeSlot = fields.Str(required=False, validate=validate.OneOf(TIME_SLOTS))
+    hourOfDay = fields.Int(required=False, validate=validate.Range(min=0, max=23))
+
+class PurgeFilterSchema(Schema):
+    """Which results a filter purge deletes"""
+    testType = fields.Str(required=False, validate=validate.OneOf(TEST_TYPES))
+    userId = fields.Str(required=False)
+    startDate = fields.DateTime(required=False)
+    endDate = fields.DateTime(required=False)
+
+    @validates_schema
+    def validate_criteria(self, data, **kwargs):
+        if not data:
+            raise ValidationError('Give at least one of userId, testType, startDate, endDate')
+        if data.get('startDate') and data.get('endDate') and data['startDate'] > data['endDate']:
+            raise ValidationError('startDate must not be after endDate', 'startDate')
+
+class PurgeSchema(Schema):
+    """Schema for a bulk purge: test IDs or a filter"""
+    ids = fields.List(fields.Str(validate=validate.Length(min=1, max=64)),
+                      validate=validate.Length(min=1, max=PURGE_MAX_IDS))
+    filter = fields.Nested(PurgeFilterSchema)
+    dryRun = fields.Bool(load_default=False)
+
+    @validates_schema
+    def validate_target(self, data, **kwargs):
+        if ('ids' in data) == ('filter' in data):
+            raise ValidationError('Give either ids or filter')
+
+# Schemas are stateless, so build them once instead of per request
+test_result_loader = FastLoader(TestResultSchema())
+filter_schema = FilterSchema()
+purge_schema = PurgeSchema()
+
+# Reject oversized bodies before parsing them (MAX_CONTENT_LENGTH is app-wide);
+# DynamoDB rejects items over 400KB anyway
+MAX_TEST_RESULT_BYTES = int(os.getenv('MAX_TEST_RESULT_BYTES', 350 * 1024))
+
+def replayed_response(test_id):
+    """Answer a retried upload with the testId of the original"""
+    response = jsonify({
+        'success': True,
+        'testId': test_id,
+        'replayed': True,
+        'message': 'Test result already received'
+    })
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response, 200
 
 # POST /api/test-results - Create new test result
 @test_results_bp.route('', methods=['POST'])
+@write_limit
 def create_test_result():
     """Create a new test result"""
     try:
+        if request.content_length and request.content_length > MAX_TEST_RESULT_BYTES:
+            return jsonify({
+                'error': 'Payload too large',
+                'message': f'Test results are limited to {MAX_TEST_RESULT_BYTES} bytes'
+            }), 413
+
+        # Retries reuse the client's Idempotency-Key; answer repeats this
+        # worker has seen before parsing anything
+        idempotency_key = request.headers.get('Idempotency-Key')
+        if idempotency_key is not None:
+            validate_key(idempotency_key)
+            body_fingerprint = fingerprint(request.get_data())
+            original_id = idempotency_store.replay(idempotency_key, body_fingerprint)
+            if original_id:
+                return replayed_response(original_id)
+
         # Validate request body
-        schema = TestResultSchema()
-        data = schema.load(request.json)
+        data = test_result_loader.load(request.json)
         
         # Extract client information
         client_info = {
@@ -47,16 +133,50 @@ def create_test_result():
             'location': data.get('location')
         }
         
+        # ASN/ISP/region from the local prefix database (no network calls)
+        network = enrich(request.remote_addr)
+        if network:
+            client_info['network'] = network
+        
         # Merge client info with provided data
         data.update(client_info)
         
+        # Derive speedTest metrics from raw samples when they were sent
+        apply_samples(data)
+        
         # Create and save test result
         test_result = TestResult(data)
-        test_id = test_result.save()
+        if idempotency_key is not None:
+            original_id, replayed = idempotency_store.claim(idempotency_key, body_fingerprint, test_result.test_id)
+            if replayed:
+                return replayed_response(original_id)
+        try:
+            try:
+                test_id = test_result.save()
+            except StorageUnavailableError:
+                # Storage is throttling: accept the result and write it later
+                pending_writes.enqueue(test_result.to_item())
+                if idempotency_key is not None:
+                    idempotency_store.complete(idempotency_key, body_fingerprint, test_result.test_id)
+                return jsonify({
+                    'success': True,
+                    'testId': test_result.test_id,
+                    'queued': True,
+                    'percentileRanks': percentile_table.ranks(data['testType'], data),
+                    'message': 'Test result accepted and queued for saving'
+                }), 202
+        except Exception:
+            # Nothing was stored, so let the client's retry claim the key again
+            if idempotency_key is not None:
+                idempotency_store.release(idempotency_key)
+            raise
+        if idempotency_key is not None:
+            idempotency_store.complete(idempotency_key, body_fingerprint, test_id)
         
         return jsonify({
             'success': True,
             'testId': test_id,
+            'percentileRanks': percentile_table.ranks(data['testType'], data),
             'message': 'Test result saved successfully'
         }), 201
         
@@ -65,6 +185,23 @@ def create_test_result():
             'error': 'Validation error',
             'details': e.messages
         }), 400
+    except IdempotencyKeyError as e:
+        return jsonify({
+            'error': 'Validation error',
+            'details': {'Idempotency-Key': [str(e)]}
+        }), 400
+    except IdempotencyConflictError as e:
+        return jsonify({
+            'error': 'Idempotency key reused',
+            'message': str(e)
+        }), 422
+    except IdempotencyPendingError as e:
+        return jsonify({
+            'error': 'Idempotency key in use',
+            'message': str(e)
+        }), 409, {'Retry-After': str(e.retry_after)}
+    except QueueFullError:
+        raise StorageUnavailableError('Storage is unavailable and the write queue is full')
     except Exception as e:
         return jsonify({
             'error': 'Internal server error',
@@ -73,12 +210,12 @@ def create_test_result():
 
 # GET /api/test-results - Get test results with optional filters
 @test_results_bp.route('', methods=['GET'])
+@read_limit
 def get_test_results():
     """Get test results with optional filters"""
     try:
         # Validate query parameters
-        schema = FilterSchema()
-        filters = schema.load(request.args)
+        filters = filter_schema.load(request.args)
         
         limit = int(filters.get('limit', 50))
         if 'limit' in filters:
@@ -98,6 +235,8 @@ def get_test_results():
             'error': 'Validation error',
             'details': e.messages
         }), 400
+    except StorageUnavailableError:
+        raise
     except Exception as e:
         return jsonify({
             'error': 'Internal server error',
@@ -106,6 +245,7 @@ def get_test_results():
 
 # GET /api/test-results/recent - Get recent test results
 @test_results_bp.route('/recent', methods=['GET'])
+@read_limit
 def get_recent_test_results():
     """Get recent test results"""
     try:
@@ -118,6 +258,8 @@ def get_recent_test_results():
             'results': results
         }), 200
         
+    except StorageUnavailableError:
+        raise
     except Exception as e:
         return jsonify({
             'error': 'Internal server error',
@@ -126,6 +268,7 @@ def get_recent_test_results():
 
 # GET /api/test-results/user/<userId> - Get test results by user
 @test_results_bp.route('/user/<user_id>', methods=['GET'])
+@read_limit
 def get_test_results_by_user(user_id):
     """Get test results by user"""
     try:
@@ -139,6 +282,8 @@ def get_test_results_by_user(user_id):
             'results': results
         }), 200
         
+    except StorageUnavailableError:
+        raise
     except Exception as e:
         return jsonify({
             'error': 'Internal server error',
@@ -147,6 +292,7 @@ def get_test_results_by_user(user_id):
 
 # GET /api/test-results/type/<testType> - Get test results by type
 @test_results_bp.route('/type/<test_type>', methods=['GET'])
+@read_limit
 def get_test_results_by_type(test_type):
     """Get test results by type"""
     try:
@@ -160,6 +306,8 @@ def get_test_results_by_type(test_type):
             'results': results
         }), 200
         
+    except StorageUnavailableError:
+        raise
     except Exception as e:
         return jsonify({
             'error': 'Internal server error',
@@ -168,6 +316,7 @@ def get_test_results_by_type(test_type):
 
 # GET /api/test-results/<testId> - Get specific test result
 @test_results_bp.route('/<test_id>', methods=['GET'])
+@read_limit
 def get_test_result(test_id):
     """Get a specific test result"""
     try:
@@ -181,9 +330,12 @@ def get_test_result(test_id):
         
         return jsonify({
             'success': True,
-            'result': result
+            'result': result,
+            'percentileRanks': percentile_table.ranks(result.get('testType'), result)
         }), 200
         
+    except StorageUnavailableError:
+        raise
     except Exception as e:
         return jsonify({
             'error': 'Internal server error',
@@ -192,6 +344,7 @@ def get_test_result(test_id):
 
 # DELETE /api/test-results/<testId> - Delete test result
 @test_results_bp.route('/<test_id>', methods=['DELETE'])
+@write_limit
 def delete_test_result(test_id):
     """Delete a test result"""
     try:
@@ -202,6 +355,134 @@ def delete_test_result(test_id):
             'message': 'Test result deleted successfully'
         }), 200
         
+    except StorageUnavailableError:
+        raise
+    except Exception as e:
+        return jsonify({
+            'error': 'Internal server error',
+            'message': str(e)
+        }), 500
+
+def purge_spec(data):
+    """Job spec from a loaded purge request, with timestamps as stored"""
+    if 'ids' in data:
+        return {'ids': data['ids']}
+    criteria = dict(data['filter'])
+    for name in ('startDate', 'endDate'):
+        if name in criteria:
+            criteria[name] = ms_to_iso(iso_to_ms(criteria[name].isoformat()))
+    return {'filter': criteria}
+
+def purge_job_not_found(job_id):
+    return jsonify({
+        'error': 'Purge job not found',
+        'message': f'No purge job found with ID: {job_id}'
+    }), 404
+
+# POST /api/test-results/purge - Start a bulk purge job (admin)
+@test_results_bp.route('/purge', methods=['POST'])
+@write_limit
+@require_auth
+def start_purge():
+    """Delete test results by ID list or filter in a background job"""
+    try:
+        data = purge_schema.load(request.get_json(silent=True) or {})
+        job = create_job(purge_spec(data), dry_run=data['dryRun'])
+        
+        return jsonify({
+            'success': True,
+            'job': job
+        }), 202
+        
+    except ValidationError as e:
+        return jsonify({
+            'error': 'Validation error',
+            'details': e.messages
+        }), 400
+    except StorageUnavailableError:
+        raise  # 503, handled app-wide
+    except Exception as e:
+        return jsonify({
+            'error': 'Internal server error',
+            'message': str(e)
+        }), 500
+
+# GET /api/test-results/purge/<jobId> - Purge job status and progress (admin)
+@test_results_bp.route('/purge/<job_id>', methods=['GET'])
+@read_limit
+@require_auth
+def get_purge(job_id):
+    """Get a purge job"""
+    try:
+        job = get_job(job_id)
+        if not job:
+            return purge_job_not_found(job_id)
+        
+        return jsonify({
+            'success': True,
+            'job': job
+        }), 200
+        
+    except StorageUnavailableError:
+        raise
+    except Exception as e:
+        return jsonify({
+            'error': 'Internal server error',
+            'message': str(e)
+        }), 500
+
+# POST /api/test-results/purge/<jobId>/resume - Continue an interrupted purge job (admin)
+@test_results_bp.route('/purge/<job_id>/resume', methods=['POST'])
+@write_limit
+@require_auth
+def resume_purge(job_id):
+    """Resume a purge job from its last checkpoint"""
+    try:
+        job = resume_job(job_id)
+        if not job:
+            return purge_job_not_found(job_id)
+        
+        return jsonify({
+            'success': True,
+            'job': job
+        }), 202
+        
+    except PurgeJobStateError as e:
+        return jsonify({
+            'error': 'Purge job not resumable',
+            'message': str(e)
+        }), 409
+    except StorageUnavailableError:
+        raise
+    except Exception as e:
+        return jsonify({
+            'error': 'Internal server error',
+            'message': str(e)
+        }), 500
+
+# DELETE /api/test-results/purge/<jobId> - Cancel a purge job (admin)
+@test_results_bp.route('/purge/<job_id>', methods=['DELETE'])
+@write_limit
+@require_auth
+def cancel_purge(job_id):
+    """Cancel a purge job (results already deleted stay deleted)"""
+    try:
+        job = cancel_job(job_id)
+        if not job:
+            return purge_job_not_found(job_id)
+        
+        return jsonify({
+            'success': True,
+            'job': job
+        }), 200
+        
+    except PurgeJobStateError as e:
+        return jsonify({
+            'error': 'Purge job already finished',
+            'message': str(e)
+        }), 409
+    except StorageUnavailableError:
+        raise
     except Exception as e:
         return jsonify({
             'error': 'Internal server error',
@@ -210,84 +491,26 @@ def delete_test_result(test_id):
 
 # GET /api/test-results/stats/summary - Get test statistics summary
 @test_results_bp.route('/stats/summary', methods=['GET'])
+@read_limit
 def get_test_statistics():
     """Get test statistics summary"""
     try:
-        recent_results = TestResult.get_recent(100)
-        
-        # Calculate statistics
-        stats = {
-            'totalTests': len(recent_results),
-            'testTypes': {},
-            'averageDownloadSpeed': 0,
-            'averageUploadSpeed': 0,
-            'averageLatency': 0,
-            'topLocations': {},
-            'recentActivity': {}
-        }
+        # One GetItem on the stream-materialized view; scan the latest
+        # results only until the materializer has produced it
+        def load_summary():
+            stats = read_summary()
+            return stats if stats is not None else compute_summary(TestResult.get_recent(100))
         
-        total_download = 0
-        total_upload = 0
-        total_latency = 0
-        speed_count = 0
-        latency_count = 0
-        
-        for result in recent_results:
-            # Count test types
-            test_type = result.get('testType')
-            stats['testTypes'][test_type] = stats['testTypes'].get(test_type, 0) + 1
-            
-            # Calculate speed averages
-            network_data = result.get('networkData', {})
-            if network_data.get('speedTest'):
-                speed_test = network_data['speedTest']
-                download = float(speed_test.get('download', 0))
-                upload = float(speed_test.get('upload', 0))
-                latency = speed_test.get('latency')
-                
-                if download:
-                    total_download += download
-                    speed_count += 1
-                if upload:
-                    total_upload += upload
-                if latency:
-                    total_latency += latency
-                    latency_count += 1
-            
-            # Count locations
-            ip_address = result.get('ipAddress')
-            if ip_address:
-                stats['topLocations'][ip_address] = stats['topLocations'].get(ip_address, 0) + 1
-            
-            # Recent activity (last 7 days)
-            timestamp = result.get('timestamp', '')
-            if timestamp:
-                try:
-                    test_date = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
-                    date_key = test_date.strftime('%Y-%m-%d')
-                    stats['recentActivity'][date_key] = stats['recentActivity'].get(date_key, 0) + 1
-                except:
-                    pass
-        
-        # Calculate averages
-        if speed_count > 0:
-            stats['averageDownloadSpeed'] = round(total_download / speed_count, 2)
-            stats['averageUploadSpeed'] = round(total_upload / speed_count, 2)
-        if latency_count > 0:
-            stats['averageLatency'] = round(total_latency / latency_count, 2)
-        
-        # Sort top locations
-        stats['topLocations'] = dict(sorted(
-            stats['topLocations'].items(),
-            key=lambda x: x[1],
-            reverse=True
-        )[:10])
+        stats, stale = run_analytics(('summary',), load_summary)
         
         return jsonify({
             'success': True,
+            'stale': stale,
             'stats': stats
         }), 200
         
+    except StorageUnavailableError:
+        raise  # 503, handled app-wide
     except Exception as e:
         return jsonify({
             'error': 'Internal server error',
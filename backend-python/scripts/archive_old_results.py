@@ -0,0 +1,166 @@
+"""
+Retention job: move old test results into the columnar archive
+
+Scans for results older than --days that haven't been archived yet, writes
+them to day-partitioned archive files, and only then marks each item with
+archivedAt and a TTL (expiresAt) so DynamoDB deletes it for free. Re-running
+is safe: results already in a day's archive are not written twice.
+
+Before archiving, TTL on expiresAt is enabled if the table doesn't have it
+yet (tables created before TABLE_TTL). If the table's TTL is on another
+attribute the job refuses to run, since archived items would never be deleted.
+
+Usage:
+    python scripts/archive_old_results.py --days 90
+    python scripts/archive_old_results.py --days 30 --segments 8 --max-writes 20 --dry-run
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from boto3.dynamodb.conditions import Attr
+from botocore.exceptions import ClientError
+
+import config.dynamodb as db
+from services.archive import ARCHIVE_DIR, ArchiveWriter
+from utils.token_bucket import TokenBucket
+
+class RetentionJob:
+    def __init__(self, table_name, cutoff, writer, limiter, batch_size, ttl_delay, dry_run):
+        self.table_name = table_name
+        self.cutoff = cutoff
+        self.writer = writer
+        self.limiter = limiter
+        self.batch_size = batch_size
+        self.ttl_delay = ttl_delay
+        self.dry_run = dry_run
+        self.buffers = defaultdict(list)
+        self.buffer_lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.progress = {'scanned': 0, 'archived': 0, 'expired': 0}
+        self.progress_lock = threading.Lock()
+
+    def _count(self, name, amount=1):
+        with self.progress_lock:
+            self.progress[name] += amount
+
+    def scan_segment(self, segment, total_segments):
+        table = db.get_table(self.table_name)
+        scan_kwargs = {
+            'Segment': segment,
+            'TotalSegments': total_segments,
+            'FilterExpression': Attr('timestamp').lt(self.cutoff) & Attr('archivedAt').not_exists()
+        }
+        while True:
+            response = self._retry(table.scan, **scan_kwargs)
+            self._count('scanned', response.get('ScannedCount', 0))
+            for item in response.get('Items', []):
+                self.add(item)
+            if 'LastEvaluatedKey' not in response:
+                return
+            scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    def add(self, item):
+        day = item['timestamp'][:10]
+        with self.buffer_lock:
+            self.buffers[day].append(item)
+            if len(self.buffers[day]) < self.batch_size:
+                return
+            items = self.buffers.pop(day)
+        self.flush(day, items)
+
+    def flush_all(self):
+        with self.buffer_lock:
+            buffers, self.buffers = self.buffers, defaultdict(list)
+        for day, items in sorted(buffers.items()):
+            self.flush(day, items)
+
+    def flush(self, day, items):
+        if self.dry_run:
+            self._count('archived', len(items))
+            return
+        # The archive write must be durable before any item gets a TTL
+        with self.write_lock:
+            self.writer.write_day(day, items)
+        self._count('archived', len(items))
+        self.expire(items)
+
+    def expire(self, items):
+        table = db.get_table(self.table_name)
+        now = int(time.time())
+        for item in items:
+            self.limiter.acquire()
+            try:
+                self._retry(
+                    table.update_item,
+                    Key={'testId': item['testId'], 'timestamp': item['timestamp']},
+                    UpdateExpression='SET archivedAt = :now, expiresAt = :expires',
+                    ConditionExpression='attribute_exists(testId)',
+                    ExpressionAttributeValues={':now': now, ':expires': now + self.ttl_delay}
+                )
+                self._count('expired')
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise  # deleted meanwhile: nothing to expire
+
+    def _retry(self, fn, **kwargs):
+        while True:
+            try:
+                return fn(**kwargs)
+            except db.StorageUnavailableError as e:
+                time.sleep(max(1.0, e.retry_after))
+
+def main():
+    parser = argparse.ArgumentParser(description='Archive test results older than the retention age')
+    parser.add_argument('--days', type=int, default=int(os.getenv('ARCHIVE_AFTER_DAYS', 90)),
+                        help='archive results older than this many days')
+    parser.add_argument('--archive-dir', default=ARCHIVE_DIR)
+    parser.add_argument('--segments', type=int, default=4, help='parallel scan segments')
+    parser.add_argument('--max-writes', type=float, default=4.0,
+                        help='TTL update_item calls per second (stay under the table WCU)')
+    parser.add_argument('--batch-size', type=int, default=5000, help='rows per archive part file')
+    parser.add_argument('--ttl-delay', type=int, default=0,
+                        help='seconds after archiving before DynamoDB may delete the item')
+    parser.add_argument('--dry-run', action='store_true', help='scan and count only')
+    args = parser.parse_args()
+
+    db.init_dynamodb()
+    if not args.dry_run:
+        try:
+            status = db.ensure_ttl(db.TABLES['TEST_RESULTS'], db.TABLE_TTL['TEST_RESULTS'])
+        except RuntimeError as e:
+            sys.exit(f'❌ {e}; refusing to mark results for expiry')
+        if status == 'ENABLING':
+            print(f"ℹ️  Enabling TTL on {db.TABLE_TTL['TEST_RESULTS']} (takes up to an hour)")
+    cutoff = (datetime.utcnow() - timedelta(days=args.days)).isoformat() + 'Z'
+    job = RetentionJob(db.TABLES['TEST_RESULTS'], cutoff, ArchiveWriter(args.archive_dir),
+                       TokenBucket(args.max_writes), args.batch_size, args.ttl_delay, args.dry_run)
+
+    print(f'🗄️  Archiving results before {cutoff} to {args.archive_dir}'
+          f"{' (dry run)' if args.dry_run else ''}")
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=args.segments) as pool:
+        futures = [pool.submit(job.scan_segment, s, args.segments) for s in range(args.segments)]
+        while wait(futures, timeout=5).not_done:
+            print(f"   scanned={job.progress['scanned']} archived={job.progress['archived']} "
+                  f"expired={job.progress['expired']} ({time.monotonic() - started:.0f}s)")
+        for future in futures:
+            future.result()
+    job.flush_all()
+
+    print(f"✅ Archived {job.progress['archived']} results, set TTL on {job.progress['expired']} "
+          f"(scanned {job.progress['scanned']}) in {time.monotonic() - started:.0f}s")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+"""
+Backfill precomputed time dimensions on existing test results
+
+Sets epochMs, dateKey, hourOfDay, timeSlot and dayOfWeek (stored by
+TestResult.save() since they were introduced) on items written before that.
+Segments of a parallel scan run concurrently; reads and writes are paced to
+a capacity budget using the consumed capacity DynamoDB reports, so the job
+can run next to production traffic. Items that already have the fields are
+skipped, so the job can be stopped and re-run.
+
+Usage:
+    python scripts/backfill_time_dimensions.py --segments 8 --max-reads 50 --max-writes 20
+    python scripts/backfill_time_dimensions.py --dry-run
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from botocore.exceptions import ClientError
+
+import config.dynamodb as db
+from utils.time_dimensions import TIME_DIMENSIONS, time_dimensions
+from utils.token_bucket import TokenBucket
+
+# Segments update the shared progress counts from pool threads
+progress_lock = threading.Lock()
+
+def count(progress, name, amount=1):
+    with progress_lock:
+        progress[name] += amount
+
+def _consumed(response, default):
+    return float((response.get('ConsumedCapacity') or {}).get('CapacityUnits', default))
+
+def _with_retry(call):
+    while True:
+        try:
+            return call()
+        except db.StorageUnavailableError as e:
+            time.sleep(max(1.0, e.retry_after))
+
+def backfill_segment(table_name, segment, total_segments, page_size, readers, writers, dry_run, progress):
+    table = db.get_table(table_name)
+    scan_kwargs = {
+        'Segment': segment,
+        'TotalSegments': total_segments,
+        'Limit': page_size,
+        'ProjectionExpression': 'testId, #ts, ' + ', '.join(TIME_DIMENSIONS),
+        'ExpressionAttributeNames': {'#ts': 'timestamp'},
+        'ReturnConsumedCapacity': 'TOTAL'
+    }
+    while True:
+        readers.acquire()
+        response = _with_retry(lambda: table.scan(**scan_kwargs))
+        # The first unit was taken up front; charge the rest of the page
+        readers.acquire(max(0.0, _consumed(response, 1) - 1))
+
+        for item in response.get('Items', []):
+            count(progress, 'scanned')
+            try:
+                dimensions = time_dimensions(item.get('timestamp', ''))
+            except (TypeError, ValueError):
+                count(progress, 'unparseable')
+                continue
+            if all(item.get(name) == value for name, value in dimensions.items()):
+                continue
+            if dry_run:
+                count(progress, 'updated')
+                continue
+
+            writers.acquire()
+            try:
+                result = _with_retry(lambda: table.update_item(
+                    Key={'testId': item['testId'], 'timestamp': item['timestamp']},
+                    UpdateExpression='SET ' + ', '.join(f'#{name} = :{name}' for name in dimensions),
+                    # Never re-create an item deleted since the scan read it
+                    ConditionExpression='attribute_exists(testId)',
+                    ExpressionAttributeNames={f'#{name}': name for name in dimensions},
+                    ExpressionAttributeValues={f':{name}': value for name, value in dimensions.items()},
+                    ReturnConsumedCapacity='TOTAL'
+                ))
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+                count(progress, 'deleted')
+                continue
+            # Large items cost more than one write unit per update
+            writers.acquire(max(0.0, _consumed(result, 1) - 1))
+            count(progress, 'updated')
+
+        if 'LastEvaluatedKey' not in response:
+            return
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+def backfill(table_name, segments, page_size, max_reads, max_writes, dry_run):
+    readers = TokenBucket(max_reads)
+    writers = TokenBucket(max_writes)
+    progress = {'scanned': 0, 'updated': 0, 'unparseable': 0, 'deleted': 0}
+    started = time.monotonic()
+
+    with ThreadPoolExecutor(max_workers=segments) as pool:
+        futures = [pool.submit(backfill_segment, table_name, s, segments, page_size, readers, writers,
+                               dry_run, progress)
+                   for s in range(segments)]
+        while wait(futures, timeout=5).not_done:
+            elapsed = time.monotonic() - started
+            print(f"   scanned={progress['scanned']} updated={progress['updated']} "
+                  f"({elapsed:.0f}s, {progress['scanned'] / max(elapsed, 1):.0f} items/s)")
+        for future in futures:
+            future.result()
+
+    verb = 'would update' if dry_run else 'updated'
+    print(f"✅ Backfill complete: scanned {progress['scanned']}, {verb} {progress['updated']}, "
+          f"skipped {progress['unparseable']} unparseable and {progress['deleted']} deleted "
+          f'in {time.monotonic() - started:.0f}s')
+
+def main():
+    parser = argparse.ArgumentParser(description='Backfill precomputed time dimensions')
+    parser.add_argument('--segments', type=int, default=4, help='parallel scan segments')
+    parser.add_argument('--page-size', type=int, default=100, help='items per scan page')
+    parser.add_argument('--max-reads', type=float, default=10.0,
+                        help='read capacity units per second for the scan')
+    parser.add_argument('--max-writes', type=float, default=4.0,
+                        help='write capacity units per second for the updates')
+    parser.add_argument('--dry-run', action='store_true', help='count items without updating them')
+    args = parser.parse_args()
+
+    db.init_dynamodb()
+    backfill(db.TABLES['TEST_RESULTS'], args.segments, args.page_size, args.max_reads, args.max_writes,
+             args.dry_run)
+
+if __name__ == '__main__':
+    main()
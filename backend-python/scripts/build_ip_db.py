@@ -0,0 +1,73 @@
+"""
+Compile an IP prefix database into the memory-mapped trie used for enrichment
+
+Input formats (plain or .gz):
+    iptoasn   ip2asn-combined.tsv from iptoasn.com
+              range_start  range_end  asn  country  description
+    csv       header row: network,asn,isp,region  (network in CIDR form)
+
+Usage:
+    python scripts/build_ip_db.py ip2asn-combined.tsv.gz -o data/ipdb.trie
+    python scripts/build_ip_db.py prefixes.csv --format csv -o data/ipdb.trie
+
+Point IP_DB_PATH at the output file; rebuilding replaces it atomically, and
+workers pick it up on restart.
+"""
+
+import argparse
+import csv
+import gzip
+import ipaddress
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.ip_trie import IPTrie, build
+
+def open_text(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', newline='')
+    return open(path, encoding='utf-8', newline='')
+
+def read_iptoasn(path):
+    with open_text(path) as f:
+        for line in f:
+            parts = line.rstrip('\n').split('\t')
+            if len(parts) < 5 or parts[2] == '0':
+                continue  # AS 0: not routed
+            start, end = ipaddress.ip_address(parts[0]), ipaddress.ip_address(parts[1])
+            for network in ipaddress.summarize_address_range(start, end):
+                yield network, parts[2], parts[4], parts[3]
+
+def read_csv(path):
+    with open_text(path) as f:
+        for row in csv.DictReader(f):
+            yield row['network'], row.get('asn'), row.get('isp'), row.get('region')
+
+def main():
+    parser = argparse.ArgumentParser(description='Compile the IP enrichment trie')
+    parser.add_argument('input')
+    parser.add_argument('--format', choices=['iptoasn', 'csv'], default='iptoasn')
+    parser.add_argument('-o', '--output', default='data/ipdb.trie')
+    args = parser.parse_args()
+
+    started = time.monotonic()
+    reader = read_iptoasn if args.format == 'iptoasn' else read_csv
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    nodes, records = build(reader(args.input), args.output)
+    print(f'✅ Wrote {args.output}: {nodes} nodes, {records} networks, '
+          f'{os.path.getsize(args.output) / 1e6:.1f} MB in {time.monotonic() - started:.1f}s')
+
+    # Sanity check: time lookups against the file just written
+    trie = IPTrie(args.output)
+    probes = ['8.8.8.8', '1.1.1.1', '2001:4860:4860::8888'] * 10000
+    started = time.perf_counter()
+    for ip in probes:
+        trie.lookup(ip)
+    print(f'   {(time.perf_counter() - started) / len(probes) * 1e6:.1f} µs per lookup; '
+          f'8.8.8.8 -> {trie.lookup("8.8.8.8")}')
+
+if __name__ == '__main__':
+    main()
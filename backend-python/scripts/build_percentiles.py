@@ -0,0 +1,44 @@
+"""
+Rebuild the percentile-rank quantiles (services/percentiles.py)
+
+Run from cron where the app isn't on Lambda, at least as often as
+PERCENTILE_REFRESH_SECONDS. Reads are paced to --max-reads capacity units per
+second so the build doesn't take capacity from requests. Only days not yet
+stored in full are read, so after the first run a build reads little more
+than the current day.
+
+Usage:
+    python scripts/build_percentiles.py
+    python scripts/build_percentiles.py --max-reads 10
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+load_dotenv()
+
+import config.dynamodb as db
+from services.percentiles import PERCENTILE_MAX_READS, rebuild
+
+def main():
+    parser = argparse.ArgumentParser(description='Rebuild the percentile-rank quantiles')
+    parser.add_argument('--max-reads', type=float, default=PERCENTILE_MAX_READS,
+                        help='read capacity units per second for the build')
+    args = parser.parse_args()
+
+    db.init_dynamodb()
+    started = time.monotonic()
+    result = rebuild(max_reads=args.max_reads)
+    for test_type, counts in result['counts'].items():
+        print(f"   {test_type}: " + ', '.join(f'{metric}={count}' for metric, count in counts.items()))
+    print(f"✅ Built percentiles at {result['builtAt']} in {time.monotonic() - started:.0f}s")
+    if not result['complete']:
+        print("   Some days are still partial; the next run continues them")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,359 @@
+"""
+HTTP load generator for the IPGrok backend
+
+Replays a weighted traffic mix (QuickTest POSTs, dashboard analytics polling,
+admin exports) against a running instance using asyncio virtual users.
+
+Usage:
+    python scripts/load_test.py --url http://localhost:3001 --users 200 \\
+        --ramp-up 60 --duration 300 --soak 0
+
+    python scripts/load_test.py --mode open --rate 50 --duration 120
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+
+import aiohttp
+
+# Default traffic mix: name -> (weight, method, path, needs_auth)
+DEFAULT_PROFILE = {
+    'quickTest.post': (80, 'POST', '/api/test-results', False),
+    'stats.summary': (5, 'GET', '/api/test-results/stats/summary', False),
+    'analytics.performance': (4, 'GET', '/api/analytics/performance', False),
+    'analytics.trends': (3, 'GET', '/api/analytics/trends', False),
+    'analytics.comparison': (3, 'GET', '/api/analytics/comparison', False),
+    'admin.export': (5, 'GET', '/api/test-results?limit=100', True),
+}
+
+def load_profile(path):
+    """Load a traffic profile from a JSON file.
+
+    The file maps request names to {"weight", "method", "path", "auth"}.
+    """
+    with open(path) as f:
+        raw = json.load(f)
+    return {
+        name: (spec['weight'], spec.get('method', 'GET'), spec['path'], spec.get('auth', False))
+        for name, spec in raw.items()
+    }
+
+def quick_test_payload():
+    """Build a payload shaped like the one QuickTest posts"""
+    download = round(random.lognormvariate(4, 0.8), 2)
+    return {
+        'testType': 'quickTest',
+        'userId': f'load-{random.randint(1, 5000)}',
+        'networkData': {
+            'speedTest': {
+                'download': download,
+                'upload': round(download * random.uniform(0.05, 0.4), 2),
+                'latency': random.randint(5, 120),
+                'connectionQuality': random.choice(['excellent', 'good', 'fair', 'poor'])
+            }
+        },
+        'systemData': {
+            'browser': 'LoadTest',
+            'platform': sys.platform,
+            'cores': os.cpu_count()
+        },
+        'location': {}
+    }
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+class Phase:
+    """A load phase that interpolates the target level over its duration"""
+
+    def __init__(self, name, duration, start_level, end_level):
+        self.name = name
+        self.duration = duration
+        self.start_level = start_level
+        self.end_level = end_level
+
+    def level_at(self, elapsed):
+        if self.duration <= 0:
+            return self.end_level
+        progress = min(1.0, elapsed / self.duration)
+        return self.start_level + (self.end_level - self.start_level) * progress
+
+class Schedule:
+    """Sequence of phases (ramp-up, steady, soak)"""
+
+    def __init__(self, target, ramp_up, duration, soak):
+        self.phases = []
+        if ramp_up > 0:
+            self.phases.append(Phase('ramp-up', ramp_up, 0, target))
+        if duration > 0:
+            self.phases.append(Phase('steady', duration, target, target))
+        if soak > 0:
+            self.phases.append(Phase('soak', soak, target, target))
+        self.total = sum(p.duration for p in self.phases)
+        self.peak = max((max(p.start_level, p.end_level) for p in self.phases), default=0)
+
+    def at(self, elapsed):
+        """Return (phase name, target level) at the given elapsed time"""
+        for phase in self.phases:
+            if elapsed < phase.duration:
+                return phase.name, phase.level_at(elapsed)
+            elapsed -= phase.duration
+        return None, 0
+
+class Recorder:
+    """Collects per-interval and per-endpoint request outcomes"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.started = time.monotonic()
+        self.buckets = defaultdict(lambda: {'latencies': [], 'errors': 0, 'throttled': 0, 'phase': None, 'level': 0})
+        self.endpoints = defaultdict(lambda: {'latencies': [], 'errors': 0, 'throttled': 0})
+        self.dropped = 0
+
+    def record(self, name, status, latency_ms, phase, level):
+        bucket = self.buckets[int((time.monotonic() - self.started) // self.interval)]
+        bucket['phase'] = phase
+        bucket['level'] = level
+        endpoint = self.endpoints[name]
+        for target in (bucket, endpoint):
+            target['latencies'].append(latency_ms)
+            if status == 429:
+                target['throttled'] += 1
+            elif status is None or status >= 400:
+                target['errors'] += 1
+
+    @staticmethod
+    def summarize(data, seconds=None):
+        latencies = sorted(data['latencies'])
+        count = len(latencies)
+        summary = {
+            'requests': count,
+            'p50': round(percentile(latencies, 50), 1),
+            'p90': round(percentile(latencies, 90), 1),
+            'p99': round(percentile(latencies, 99), 1),
+            'max': round(latencies[-1], 1) if latencies else 0,
+            'errorRate': round(data['errors'] / count, 4) if count else 0,
+            'throttleRate': round(data['throttled'] / count, 4) if count else 0
+        }
+        if seconds:
+            summary['rps'] = round(count / seconds, 1)
+        return summary
+
+    def timeline(self):
+        rows = []
+        for index in sorted(self.buckets):
+            bucket = self.buckets[index]
+            row = {'t': index * self.interval, 'phase': bucket['phase'], 'level': round(bucket['level'], 1)}
+            row.update(self.summarize(bucket, self.interval))
+            rows.append(row)
+        return rows
+
+def find_saturation(timeline, p99_limit_ms, error_limit):
+    """First interval where p99 latency or error/429 rate crosses its limit"""
+    for row in timeline:
+        if row['p99'] > p99_limit_ms or row['errorRate'] + row['throttleRate'] > error_limit:
+            return row
+    return None
+
+class LoadTest:
+    """Drives the traffic mix in closed- or open-loop mode"""
+
+    def __init__(self, args, profile):
+        self.args = args
+        self.base_url = args.url.rstrip('/')
+        self.names = list(profile)
+        self.weights = [profile[name][0] for name in self.names]
+        self.profile = profile
+        self.schedule = Schedule(args.rate if args.mode == 'open' else args.users,
+                                 args.ramp_up, args.duration, args.soak)
+        self.recorder = Recorder(args.interval)
+        self.token = None
+
+    async def login(self, session):
+        """Obtain an admin token for auth-protected requests"""
+        password = self.args.admin_password or os.getenv('ADMIN_PASSWORD')
+        if not password:
+            return
+        async with session.post(f'{self.base_url}/api/auth/login',
+                                json={'username': self.args.admin_user, 'password': password}) as response:
+            if response.status == 200:
+                self.token = (await response.json()).get('token')
+            else:
+                print(f'⚠️  Admin login failed ({response.status}); admin requests will be unauthenticated')
+
+    async def fire(self, session, phase, level):
+        name = random.choices(self.names, weights=self.weights)[0]
+        _, method, path, needs_auth = self.profile[name]
+        headers = {}
+        if needs_auth and self.token:
+            headers['Authorization'] = f'Bearer {self.token}'
+        kwargs = {'headers': headers}
+        if method == 'POST':
+            kwargs['json'] = quick_test_payload()
+
+        started = time.perf_counter()
+        status = None
+        try:
+            async with session.request(method, self.base_url + path, **kwargs) as response:
+                await response.read()
+                status = response.status
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            pass
+        self.recorder.record(name, status, (time.perf_counter() - started) * 1000, phase, level)
+
+    async def virtual_user(self, session, index, deadline):
+        """Closed loop: each user waits for its response, thinks, then repeats"""
+        while True:
+            elapsed = time.monotonic() - self.recorder.started
+            if elapsed >= deadline:
+                return
+            phase, level = self.schedule.at(elapsed)
+            if index >= level:
+                await asyncio.sleep(0.1)
+                continue
+            await self.fire(session, phase, level)
+            if self.args.think_time:
+                await asyncio.sleep(random.expovariate(1 / self.args.think_time))
+
+    async def run_closed(self, session):
+        deadline = self.schedule.total
+        await asyncio.gather(*(self.virtual_user(session, i, deadline) for i in range(self.args.users)))
+
+    async def run_open(self, session):
+        """Open loop: Poisson arrivals at the scheduled rate, regardless of responses
+
+        The rate changes during a ramp, so arrivals are drawn at the peak rate
+        and each one is kept with probability rate/peak at its own time
+        (thinning). A gap drawn while the rate is near 0 can't stall the ramp.
+        """
+        in_flight = set()
+        peak = self.schedule.peak
+        if peak <= 0:
+            return
+        next_at = 0.0
+        while True:
+            next_at += random.expovariate(peak)
+            phase, rate = self.schedule.at(next_at)
+            if phase is None:
+                break
+            delay = next_at - (time.monotonic() - self.recorder.started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if random.random() * peak >= rate:
+                continue
+            if len(in_flight) >= self.args.max_in_flight:
+                self.recorder.dropped += 1
+                continue
+            task = asyncio.create_task(self.fire(session, phase, rate))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+        if in_flight:
+            await asyncio.gather(*in_flight)
+
+    async def report_progress(self):
+        last_reported = -1
+        while True:
+            await asyncio.sleep(self.args.interval)
+            timeline = self.recorder.timeline()
+            if len(timeline) >= 2 and timeline[-2]['t'] > last_reported:
+                row = timeline[-2]  # last complete interval
+                last_reported = row['t']
+                print(f"[{row['t']:>5}s {row['phase'] or '-':<8}] level={row['level']:<7} "
+                      f"rps={row['rps']:<8} p50={row['p50']:<7} p99={row['p99']:<8} "
+                      f"err={row['errorRate']:.2%} 429={row['throttleRate']:.2%}")
+
+    async def run(self):
+        timeout = aiohttp.ClientTimeout(total=self.args.timeout)
+        connector = aiohttp.TCPConnector(limit=0)
+        async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+            await self.login(session)
+            self.recorder.started = time.monotonic()
+            reporter = asyncio.create_task(self.report_progress())
+            try:
+                if self.args.mode == 'open':
+                    await self.run_open(session)
+                else:
+                    await self.run_closed(session)
+            finally:
+                reporter.cancel()
+
+    def results(self):
+        timeline = self.recorder.timeline()
+        total = {'latencies': [], 'errors': 0, 'throttled': 0}
+        for data in self.recorder.endpoints.values():
+            total['latencies'].extend(data['latencies'])
+            total['errors'] += data['errors']
+            total['throttled'] += data['throttled']
+        elapsed = max(1e-9, time.monotonic() - self.recorder.started)
+        return {
+            'mode': self.args.mode,
+            'phases': [{'name': p.name, 'duration': p.duration} for p in self.schedule.phases],
+            'summary': self.recorder.summarize(total, elapsed),
+            'dropped': self.recorder.dropped,
+            'endpoints': {name: self.recorder.summarize(data, elapsed)
+                          for name, data in sorted(self.recorder.endpoints.items())},
+            'saturation': find_saturation(timeline, self.args.p99_limit, self.args.error_limit),
+            'timeline': timeline
+        }
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='IPGrok backend load generator')
+    parser.add_argument('--url', default=os.getenv('LOAD_TEST_URL', 'http://localhost:3001'))
+    parser.add_argument('--mode', choices=['closed', 'open'], default='closed',
+                        help='closed: fixed virtual users; open: fixed arrival rate')
+    parser.add_argument('--users', type=int, default=50, help='virtual users (closed loop)')
+    parser.add_argument('--rate', type=float, default=20.0, help='requests per second (open loop)')
+    parser.add_argument('--think-time', type=float, default=1.0, help='mean think time in seconds (closed loop)')
+    parser.add_argument('--max-in-flight', type=int, default=2000, help='in-flight cap (open loop)')
+    parser.add_argument('--ramp-up', type=int, default=30, help='ramp-up phase seconds')
+    parser.add_argument('--duration', type=int, default=120, help='steady phase seconds')
+    parser.add_argument('--soak', type=int, default=0, help='soak phase seconds')
+    parser.add_argument('--interval', type=int, default=5, help='reporting interval seconds')
+    parser.add_argument('--timeout', type=float, default=30.0, help='per-request timeout seconds')
+    parser.add_argument('--profile', help='JSON traffic profile (defaults to the built-in mix)')
+    parser.add_argument('--admin-user', default='admin')
+    parser.add_argument('--admin-password', help='defaults to $ADMIN_PASSWORD')
+    parser.add_argument('--p99-limit', type=float, default=1000.0, help='saturation p99 threshold in ms')
+    parser.add_argument('--error-limit', type=float, default=0.01, help='saturation error+429 rate threshold')
+    parser.add_argument('--output', help='write the full JSON report to this file')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    profile = load_profile(args.profile) if args.profile else DEFAULT_PROFILE
+
+    test = LoadTest(args, profile)
+    print(f'🚀 Load test ({args.mode} loop) against {test.base_url} for {test.schedule.total}s')
+    asyncio.run(test.run())
+    report = test.results()
+
+    summary = report['summary']
+    print(f"\n📊 {summary['requests']} requests, {summary['rps']} req/s, "
+          f"p50={summary['p50']}ms p90={summary['p90']}ms p99={summary['p99']}ms, "
+          f"errors={summary['errorRate']:.2%}, 429s={summary['throttleRate']:.2%}")
+    for name, stats in report['endpoints'].items():
+        print(f"   {name:<24} n={stats['requests']:<7} p50={stats['p50']:<7} p99={stats['p99']:<8} "
+              f"err={stats['errorRate']:.2%} 429={stats['throttleRate']:.2%}")
+    if report['saturation']:
+        row = report['saturation']
+        print(f"⚠️  Saturation at t={row['t']}s, level={row['level']} ({row['phase']})")
+    else:
+        print('✅ No saturation detected within the configured thresholds')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'📝 Report written to {args.output}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+"""
+Migrate the test results table to the write-sharded TestTypeIndex
+
+Steps (each is idempotent and can be re-run):
+    1. --create-index        add TestTypeShardIndex (testTypeShard, timestamp)
+    2. --backfill            set testTypeShard on existing items
+    3. --drop-legacy-index   remove the old hot TestTypeIndex
+
+Usage:
+    python scripts/migrate_test_type_shards.py --create-index --backfill
+    python scripts/migrate_test_type_shards.py --backfill --shards 16 --segments 8 --max-writes 20
+    python scripts/migrate_test_type_shards.py --drop-legacy-index
+
+Changing TEST_TYPE_SHARDS later means re-running --backfill with the new
+count; reads use the count from the environment.
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from botocore.exceptions import ClientError
+
+import config.dynamodb as db
+from models.test_result import TestResult
+from utils.token_bucket import TokenBucket
+
+# Segments update the shared progress counts from pool threads
+progress_lock = threading.Lock()
+
+def count(progress, name, amount=1):
+    with progress_lock:
+        progress[name] += amount
+
+def create_index(table_name):
+    schema = db.TABLE_SCHEMAS['TEST_RESULTS']
+    index = next(i for i in schema['GlobalSecondaryIndexes'] if i['IndexName'] == db.TEST_TYPE_SHARD_INDEX)
+    try:
+        db.dynamodb.update_table(
+            TableName=table_name,
+            AttributeDefinitions=[{'AttributeName': 'testTypeShard', 'AttributeType': 'S'},
+                                  {'AttributeName': 'timestamp', 'AttributeType': 'S'}],
+            GlobalSecondaryIndexUpdates=[{'Create': index}]
+        )
+        print(f'✅ Creating {db.TEST_TYPE_SHARD_INDEX} (backfill can start while it builds)')
+    except ClientError as e:
+        message = str(e)
+        if 'already exists' in message:
+            print(f'ℹ️  {db.TEST_TYPE_SHARD_INDEX} already exists')
+        else:
+            raise
+
+def drop_legacy_index(table_name):
+    try:
+        db.dynamodb.update_table(
+            TableName=table_name,
+            GlobalSecondaryIndexUpdates=[{'Delete': {'IndexName': db.TEST_TYPE_INDEX}}]
+        )
+        print('✅ Dropping legacy TestTypeIndex')
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ResourceNotFoundException' or 'does not exist' in str(e):
+            print('ℹ️  Legacy TestTypeIndex already removed')
+        else:
+            raise
+
+def backfill_segment(table_name, segment, total_segments, shards, limiter, progress):
+    table = db.get_table(table_name)
+    scan_kwargs = {
+        'Segment': segment,
+        'TotalSegments': total_segments,
+        'ProjectionExpression': 'testId, #ts, testType, testTypeShard',
+        'ExpressionAttributeNames': {'#ts': 'timestamp'}
+    }
+    while True:
+        response = table.scan(**scan_kwargs)
+        for item in response.get('Items', []):
+            count(progress, 'scanned')
+            if not item.get('testType'):
+                continue
+            shard_key = TestResult.shard_key(item['testType'], item['testId'], shards)
+            if item.get('testTypeShard') == shard_key:
+                continue
+            limiter.acquire()
+            while True:
+                try:
+                    table.update_item(
+                        Key={'testId': item['testId'], 'timestamp': item['timestamp']},
+                        UpdateExpression='SET testTypeShard = :shard',
+                        ExpressionAttributeValues={':shard': shard_key}
+                    )
+                    break
+                except db.StorageUnavailableError as e:
+                    time.sleep(max(1.0, e.retry_after))
+            count(progress, 'updated')
+        if 'LastEvaluatedKey' not in response:
+            return
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+def backfill(table_name, shards, segments, max_writes):
+    limiter = TokenBucket(max_writes)
+    progress = {'scanned': 0, 'updated': 0}
+    started = time.monotonic()
+
+    with ThreadPoolExecutor(max_workers=segments) as pool:
+        futures = [pool.submit(backfill_segment, table_name, s, segments, shards, limiter, progress)
+                   for s in range(segments)]
+        while wait(futures, timeout=5).not_done:
+            print(f"   scanned={progress['scanned']} updated={progress['updated']} "
+                  f"({time.monotonic() - started:.0f}s)")
+        for future in futures:
+            future.result()
+
+    print(f"✅ Backfill complete: scanned {progress['scanned']}, updated {progress['updated']} "
+          f'items across {shards} shards')
+
+def main():
+    parser = argparse.ArgumentParser(description='Migrate to the write-sharded TestTypeIndex')
+    parser.add_argument('--create-index', action='store_true')
+    parser.add_argument('--backfill', action='store_true')
+    parser.add_argument('--drop-legacy-index', action='store_true')
+    parser.add_argument('--shards', type=int, default=db.TEST_TYPE_SHARDS)
+    parser.add_argument('--segments', type=int, default=4, help='parallel scan segments')
+    parser.add_argument('--max-writes', type=float, default=4.0,
+                        help='update_item calls per second (stay under the table WCU)')
+    args = parser.parse_args()
+
+    if not (args.create_index or args.backfill or args.drop_legacy_index):
+        parser.error('choose at least one of --create-index, --backfill, --drop-legacy-index')
+
+    db.init_dynamodb()
+    table_name = db.TABLES['TEST_RESULTS']
+    if args.create_index:
+        create_index(table_name)
+    if args.backfill:
+        backfill(table_name, args.shards, args.segments, args.max_writes)
+    if args.drop_legacy_index:
+        drop_legacy_index(table_name)
+
+if __name__ == '__main__':
+    main()
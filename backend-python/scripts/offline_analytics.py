@@ -0,0 +1,144 @@
+"""
+Offline analytics over exported or archived test results
+
+Runs the same performance, trends and comparison computations as the API, but
+over files instead of a request-bound scan, so quarterly reports can cover
+millions of results. Inputs are spread over a process pool: each task builds
+a partial aggregate for one file (or one byte range of a large NDJSON file),
+and the partials are merged in input order, so the output is exactly what the
+API function would return for the same results in one pass.
+
+Inputs (any mix):
+    NDJSON      one test result item per line (.ndjson/.jsonl, optionally .gz);
+                uncompressed files are split into --chunk-mb ranges
+    columnar    archive part files (.arrow), or an archive directory holding
+                date=YYYY-MM-DD partitions (see services/archive.py)
+
+Usage:
+    python scripts/offline_analytics.py archive --report performance --start 2025-01-01 --end 2025-03-31
+    python scripts/offline_analytics.py exports/*.ndjson.gz --report comparison -o q1-comparison.json
+    python scripts/offline_analytics.py archive --report performance --group-by isp --workers 16
+"""
+
+import argparse
+import gzip
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.analytics import (
+    GROUP_BY_DIMENSIONS, ComparisonAggregate, PerformanceAggregate, TrendsAggregate
+)
+from services.archive import ANALYTICS_COLUMNS, ArchiveReader, read_part, to_item
+
+NDJSON_SUFFIXES = ('.ndjson', '.jsonl', '.json')
+COLUMNAR_SUFFIXES = ('.arrow', '.feather')
+
+def new_aggregate(report, group_by):
+    if report == 'performance':
+        return PerformanceAggregate(group_by)
+    if report == 'trends':
+        return TrendsAggregate()
+    return ComparisonAggregate()
+
+def plan_tasks(paths, start, end, chunk_bytes):
+    """Split the inputs into (kind, path, offset, end offset) tasks, in input order"""
+    tasks = []
+    for path in paths:
+        if os.path.isdir(path):
+            reader = ArchiveReader(path)
+            for day in reader.days(start, end):
+                tasks.extend(('columnar', part, 0, None) for part in reader.day_parts(day))
+        elif path.endswith(COLUMNAR_SUFFIXES):
+            tasks.append(('columnar', path, 0, None))
+        elif path.endswith(tuple(suffix + '.gz' for suffix in NDJSON_SUFFIXES)):
+            tasks.append(('ndjson', path, 0, None))  # gzip can't be split
+        elif path.endswith(NDJSON_SUFFIXES):
+            size = os.path.getsize(path)
+            tasks.extend(('ndjson', path, offset, min(offset + chunk_bytes, size))
+                         for offset in range(0, max(size, 1), chunk_bytes))
+        else:
+            raise SystemExit(f'❌ Unrecognized input: {path}')
+    return tasks
+
+def read_ndjson(path, offset, end):
+    """Items whose line starts in [offset, end)"""
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as f:
+        if offset:
+            # Skip the line that started in the previous range
+            f.seek(offset - 1)
+            f.readline()
+        while end is None or f.tell() < end:
+            line = f.readline()
+            if not line:
+                return
+            if line.strip():
+                yield json.loads(line)
+
+def read_columnar(path):
+    for row in read_part(path, ANALYTICS_COLUMNS).to_pylist():
+        yield to_item(row)
+
+def aggregate_task(task, report, group_by, start, end):
+    """Worker: one partial aggregate for one task"""
+    kind, path, offset, end_offset = task
+    items = read_ndjson(path, offset, end_offset) if kind == 'ndjson' else read_columnar(path)
+    # A bare date as the end includes that whole day
+    end_key = end + '\uffff' if end and len(end) == 10 else end
+    aggregate = new_aggregate(report, group_by)
+    count = 0
+    for item in items:
+        timestamp = item.get('timestamp') or ''
+        if (start and timestamp < start) or (end_key and timestamp > end_key):
+            continue
+        aggregate.add(item)
+        count += 1
+    return aggregate, count
+
+def main():
+    parser = argparse.ArgumentParser(description='Analytics over NDJSON exports or the columnar archive')
+    parser.add_argument('inputs', nargs='+', help='NDJSON/.arrow files or archive directories')
+    parser.add_argument('--report', choices=['performance', 'trends', 'comparison'], default='performance')
+    parser.add_argument('--group-by', choices=GROUP_BY_DIMENSIONS, help='performance only')
+    parser.add_argument('--start', help='first timestamp or date to include')
+    parser.add_argument('--end', help='last timestamp or date to include (a date includes the whole day)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--chunk-mb', type=int, default=64, help='split uncompressed NDJSON into ranges this big')
+    parser.add_argument('-o', '--output', help='write JSON here instead of stdout')
+    args = parser.parse_args()
+
+    if args.group_by and args.report != 'performance':
+        parser.error('--group-by only applies to --report performance')
+
+    tasks = plan_tasks(args.inputs, args.start, args.end, args.chunk_mb * 1024 * 1024)
+    print(f'📊 {args.report}: {len(tasks)} tasks over {args.workers} workers', file=sys.stderr)
+    started = time.monotonic()
+
+    total = new_aggregate(args.report, args.group_by)
+    processed = 0
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = [pool.submit(aggregate_task, task, args.report, args.group_by, args.start, args.end)
+                   for task in tasks]
+        # Merge in input order so the result matches a single pass
+        for future in futures:
+            partial, count = future.result()
+            total.merge(partial)
+            processed += count
+
+    response = {'success': True, 'stale': False, 'data': total.result()}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(response, f)
+    else:
+        json.dump(response, sys.stdout)
+        sys.stdout.write('\n')
+
+    print(f'✅ {processed} results in {time.monotonic() - started:.1f}s', file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Feed recorded DynamoDB Stream batches to the materializer
+
+Each input file is either a Lambda event ({"Records": [...]}) or NDJSON with
+one event per line. By default views are kept in a local JSON state file, so
+the materializer can be exercised fully offline; --dynamodb writes to the
+ANALYTICS table instead. Replaying the same files again must not change the
+views.
+
+Usage:
+    python scripts/replay_stream.py batches/*.json
+    python scripts/replay_stream.py batches/*.json --state views.json --replay 2
+    python scripts/replay_stream.py batch.json --dynamodb
+"""
+
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from services.materializer import DynamoViewStore, MemoryViewStore, process_records, read_summary
+
+def read_events(path):
+    with open(path) as f:
+        text = f.read().strip()
+    if not text:
+        return []
+    try:
+        events = [json.loads(text)]
+    except json.JSONDecodeError:
+        events = [json.loads(line) for line in text.splitlines() if line.strip()]
+    return [event if 'Records' in event else {'Records': [event]} for event in events]
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay recorded stream batches through the materializer')
+    parser.add_argument('files', nargs='+')
+    parser.add_argument('--state', default='materialized-views.json', help='local view state file')
+    parser.add_argument('--dynamodb', action='store_true', help='write views to the ANALYTICS table')
+    parser.add_argument('--replay', type=int, default=1, help='deliver every batch this many times')
+    args = parser.parse_args()
+
+    store = DynamoViewStore() if args.dynamodb else MemoryViewStore(args.state)
+    totals = {'records': 0, 'applied': 0, 'skipped': 0}
+    for _ in range(args.replay):
+        for path in args.files:
+            for event in read_events(path):
+                result = process_records(event['Records'], store)
+                for key in totals:
+                    totals[key] += result[key]
+                print(f"   {os.path.basename(path)}: {result}")
+
+    if not args.dynamodb:
+        store.save()
+    print(f"✅ Replayed {totals['records']} records: {totals['applied']} applied, "
+          f"{totals['skipped']} skipped as duplicates")
+    print(json.dumps(read_summary(store), indent=2))
+
+if __name__ == '__main__':
+    main()
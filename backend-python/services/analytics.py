@@ -0,0 +1,435 @@
+"""
+Analytics computations
+
+Pure functions over lists of test result items, shared by the API routes.
+Routes run fetch + compute through `run_analytics`, which serves cached
+results (stale-while-revalidate) and coalesces identical concurrent requests
+into one scan.
+"""
+
+import os
+from datetime import datetime
+
+from config.dynamodb import StorageUnavailableError
+from utils import metrics
+from utils.singleflight import SingleFlight
+from utils.swr_cache import StaleWhileRevalidateCache
+from utils.time_dimensions import time_dimensions
+
+analytics_flight = SingleFlight('analytics', timeout=float(os.getenv('ANALYTICS_COALESCE_TIMEOUT', 25)))
+metrics.register('analyticsInFlight', analytics_flight.in_flight)
+
+# Last-good results, served with `stale: true` while refreshing or while
+# DynamoDB is throttling
+analytics_cache = StaleWhileRevalidateCache(
+    'analyticsCache',
+    fresh_ttl=float(os.getenv('ANALYTICS_FRESH_SECONDS', 15)),
+    max_stale=float(os.getenv('ANALYTICS_MAX_STALE_SECONDS', 3600)),
+    serve_stale_on=(StorageUnavailableError,)
+)
+metrics.register('analyticsCache', analytics_cache.stats)
+
+def run_analytics(key, compute):
+    """Return (result, stale) for a normalized request key"""
+    return analytics_cache.get(key, lambda: analytics_flight.do(key, compute))
+
+async def run_analytics_async(key, compute):
+    """run_analytics() for a coroutine function (the ASGI routes)"""
+    return await analytics_cache.get_async(key, lambda: analytics_flight.do_async(key, compute))
+
+# Group-by dimensions: the test type, or a field set by IP enrichment
+GROUP_BY_DIMENSIONS = ('testType', 'asn', 'isp', 'region')
+
+def dimension_value(result, dimension):
+    """A result's value for a group-by dimension (None if not set)"""
+    if dimension == 'testType':
+        value = result.get('testType')
+    else:
+        value = (result.get('network') or {}).get(dimension)
+    return str(value) if value is not None else None
+
+def _speed_test(result):
+    network_data = result.get('networkData', {})
+    return network_data.get('speedTest', {})
+
+class PerformanceAggregate:
+    """Mergeable state behind compute_performance
+
+    add() results, merge() partials built over later results, then result().
+    Totals are summed from the value lists at the end, so merging partials in
+    input order gives exactly what one pass over all the results gives.
+    """
+
+    def __init__(self, group_by=None):
+        self.group_by = group_by
+        self.total_tests = 0
+        self.download_speeds = []
+        self.upload_speeds = []
+        self.latencies = []
+        self.connection_qualities = {}
+        self.test_type_distribution = {}
+        self.daily_tests = {}
+        self.groups = {}
+
+    def add(self, result):
+        self.total_tests += 1
+        test_type = result.get('testType')
+        self.test_type_distribution[test_type] = self.test_type_distribution.get(test_type, 0) + 1
+
+        speed_test = _speed_test(result)
+        download = float(speed_test.get('download', 0))
+        upload = float(speed_test.get('upload', 0))
+        latency = speed_test.get('latency')
+        quality = speed_test.get('connectionQuality')
+
+        if download:
+            self.download_speeds.append(download)
+        if upload:
+            self.upload_speeds.append(upload)
+        if latency:
+            self.latencies.append(latency)
+        if quality:
+            self.connection_qualities[quality] = self.connection_qualities.get(quality, 0) + 1
+
+        timestamp = result.get('timestamp', '')
+        if timestamp:
+            date_key = result.get('dateKey') or timestamp.split('T')[0]
+            self.daily_tests[date_key] = self.daily_tests.get(date_key, 0) + 1
+
+        if self.group_by:
+            value = dimension_value(result, self.group_by) or 'unknown'
+            if value not in self.groups:
+                self.groups[value] = PerformanceAggregate()
+            self.groups[value].add(result)
+
+    def merge(self, other):
+        self.total_tests += other.total_tests
+        self.download_speeds.extend(other.download_speeds)
+        self.upload_speeds.extend(other.upload_speeds)
+        self.latencies.extend(other.latencies)
+        _add_counts(self.connection_qualities, other.connection_qualities)
+        _add_counts(self.test_type_distribution, other.test_type_distribution)
+        _add_counts(self.daily_tests, other.daily_tests)
+        for value, group in other.groups.items():
+            if value in self.groups:
+                self.groups[value].merge(group)
+            else:
+                self.groups[value] = group
+        return self
+
+    def summary(self):
+        summary = {
+            'totalTests': self.total_tests,
+            'averageDownloadSpeed': 0,
+            'averageUploadSpeed': 0,
+            'averageLatency': 0,
+            'bestDownloadSpeed': max(0, max(self.download_speeds, default=0)),
+            'bestUploadSpeed': max(0, max(self.upload_speeds, default=0)),
+            'lowestLatency': min(self.latencies, default=float('inf'))
+        }
+        # Upload is averaged over the download count, as it always has been
+        if self.download_speeds:
+            summary['averageDownloadSpeed'] = round(sum(self.download_speeds) / len(self.download_speeds), 2)
+            summary['averageUploadSpeed'] = round(sum(self.upload_speeds) / len(self.download_speeds), 2)
+        if self.latencies:
+            summary['averageLatency'] = round(sum(self.latencies) / len(self.latencies), 2)
+        return summary
+
+    def result(self):
+        performance_data = {
+            'downloadSpeeds': list(self.download_speeds),
+            'uploadSpeeds': list(self.upload_speeds),
+            'latencies': list(self.latencies),
+            'connectionQualities': dict(self.connection_qualities),
+            'testTypeDistribution': dict(self.test_type_distribution),
+            'timeSeriesData': {
+                date_key: {'tests': tests, 'avgDownload': 0, 'avgUpload': 0, 'avgLatency': 0}
+                for date_key, tests in self.daily_tests.items()
+            },
+            'summary': self.summary()
+        }
+        if self.group_by:
+            performance_data['groupBy'] = self.group_by
+            performance_data['groups'] = {
+                value: group.summary()
+                for value, group in sorted(self.groups.items(), key=lambda x: x[1].total_tests, reverse=True)
+            }
+        return performance_data
+
+class TrendsAggregate:
+    """Mergeable state behind compute_trends"""
+
+    def __init__(self):
+        self.daily = {}
+        self.test_type_daily = {}
+
+    def add(self, result):
+        timestamp = result.get('timestamp', '')
+        if not timestamp:
+            return
+
+        date_key = result.get('dateKey') or timestamp.split('T')[0]
+        test_type = result.get('testType')
+
+        day = self.daily.get(date_key)
+        if day is None:
+            day = self.daily[date_key] = {'tests': 0, 'downloadSpeeds': [], 'uploadSpeeds': [], 'latencies': []}
+        day['tests'] += 1
+
+        type_daily = self.test_type_daily.setdefault(test_type, {})
+        type_daily[date_key] = type_daily.get(date_key, 0) + 1
+
+        speed_test = _speed_test(result)
+        if speed_test.get('download'):
+            day['downloadSpeeds'].append(float(speed_test['download']))
+        if speed_test.get('upload'):
+            day['uploadSpeeds'].append(float(speed_test['upload']))
+        if speed_test.get('latency'):
+            day['latencies'].append(speed_test['latency'])
+
+    def merge(self, other):
+        for date_key, other_day in other.daily.items():
+            if date_key in self.daily:
+                _extend_bucket(self.daily[date_key], other_day, 'tests')
+            else:
+                self.daily[date_key] = other_day
+        for test_type, type_daily in other.test_type_daily.items():
+            _add_counts(self.test_type_daily.setdefault(test_type, {}), type_daily)
+        return self
+
+    def result(self):
+        return {
+            'daily': {date_key: _copy_bucket(day) for date_key, day in self.daily.items()},
+            'testTypeTrends': {k: {'daily': dict(v)} for k, v in self.test_type_daily.items()}
+        }
+
+class ComparisonAggregate:
+    """Mergeable state behind compute_comparison"""
+
+    CATEGORIES = ('testTypes', 'timeOfDay', 'dayOfWeek', 'networks', 'regions')
+
+    def __init__(self):
+        self.comparison = {category: {} for category in self.CATEGORIES}
+
+    def _bucket(self, category, key):
+        buckets = self.comparison[category]
+        if key not in buckets:
+            buckets[key] = {'count': 0, 'downloadSpeeds': [], 'uploadSpeeds': [], 'latencies': []}
+        return buckets[key]
+
+    def add(self, result):
+        test_type = result.get('testType')
+        timestamp = result.get('timestamp', '')
+        if not timestamp:
+            return
+
+        try:
+            # Stored at write time; parsed only for items saved before that
+            time_slot, day_of_week = result.get('timeSlot'), result.get('dayOfWeek')
+            if not (time_slot and day_of_week):
+                dimensions = time_dimensions(timestamp)
+                time_slot, day_of_week = dimensions['timeSlot'], dimensions['dayOfWeek']
+            self._add(result, test_type, time_slot, day_of_week)
+        except Exception:
+            pass  # unparseable timestamp or speed values: skip the rest, as before
+
+    def _add(self, result, test_type, time_slot, day_of_week):
+        # Buckets this result counts toward
+        buckets = [
+            self._bucket('testTypes', test_type),
+            self._bucket('timeOfDay', time_slot),
+            self._bucket('dayOfWeek', day_of_week)
+        ]
+        isp = dimension_value(result, 'isp')
+        region = dimension_value(result, 'region')
+        if isp:
+            buckets.append(self._bucket('networks', isp))
+        if region:
+            buckets.append(self._bucket('regions', region))
+
+        for bucket in buckets:
+            bucket['count'] += 1
+
+        speed_test = _speed_test(result)
+        if speed_test.get('download'):
+            download = float(speed_test['download'])
+            for bucket in buckets:
+                bucket['downloadSpeeds'].append(download)
+        if speed_test.get('upload'):
+            upload = float(speed_test['upload'])
+            for bucket in buckets:
+                bucket['uploadSpeeds'].append(upload)
+        if speed_test.get('latency'):
+            latency = speed_test['latency']
+            for bucket in buckets:
+                bucket['latencies'].append(latency)
+
+    def merge(self, other):
+        for category, buckets in other.comparison.items():
+            for key, bucket in buckets.items():
+                if key in self.comparison[category]:
+                    _extend_bucket(self.comparison[category][key], bucket, 'count')
+                else:
+                    self.comparison[category][key] = bucket
+        return self
+
+    def result(self):
+        comparison = {}
+        for category, buckets in self.comparison.items():
+            comparison[category] = {}
+            for key, bucket in buckets.items():
+                data = _copy_bucket(bucket)
+                data['avgDownload'] = round(sum(data['downloadSpeeds']) / len(data['downloadSpeeds']), 2) if data['downloadSpeeds'] else 0
+                data['avgUpload'] = round(sum(data['uploadSpeeds']) / len(data['uploadSpeeds']), 2) if data['uploadSpeeds'] else 0
+                data['avgLatency'] = round(sum(data['latencies']) / len(data['latencies']), 2) if data['latencies'] else 0
+                comparison[category][key] = data
+        return comparison
+
+def _add_counts(counts, other):
+    for key, count in other.items():
+        counts[key] = counts.get(key, 0) + count
+
+def _extend_bucket(bucket, other, count_key):
+    bucket[count_key] += other[count_key]
+    for name in ('downloadSpeeds', 'uploadSpeeds', 'latencies'):
+        bucket[name].extend(other[name])
+
+def _copy_bucket(bucket):
+    return {k: list(v) if isinstance(v, list) else v for k, v in bucket.items()}
+
+def _aggregate(aggregate, results):
+    for result in results:
+        aggregate.add(result)
+    return aggregate.result()
+
+def compute_performance(results, group_by=None):
+    """Performance metrics for /api/analytics/performance"""
+    return _aggregate(PerformanceAggregate(group_by), results)
+
+def compute_trends(results):
+    """Daily and per-type trends for /api/analytics/trends"""
+    return _aggregate(TrendsAggregate(), results)
+
+def compute_comparison(results):
+    """Comparison by test type, time of day and weekday for /api/analytics/comparison"""
+    return _aggregate(ComparisonAggregate(), results)
+
+def compute_summary(results):
+    """Statistics for /api/test-results/stats/summary"""
+    # Calculate statistics
+    stats = {
+        'totalTests': len(results),
+        'testTypes': {},
+        'averageDownloadSpeed': 0,
+        'averageUploadSpeed': 0,
+        'averageLatency': 0,
+        'topLocations': {},
+        'topNetworks': {},
+        'topRegions': {},
+        'recentActivity': {}
+    }
+
+    total_download = 0
+    total_upload = 0
+    total_latency = 0
+    speed_count = 0
+    latency_count = 0
+
+    for result in results:
+        # Count test types
+        test_type = result.get('testType')
+        stats['testTypes'][test_type] = stats['testTypes'].get(test_type, 0) + 1
+
+        # Calculate speed averages
+        network_data = result.get('networkData', {})
+        if network_data.get('speedTest'):
+            speed_test = network_data['speedTest']
+            download = float(speed_test.get('download', 0))
+            upload = float(speed_test.get('upload', 0))
+            latency = speed_test.get('latency')
+
+            if download:
+                total_download += download
+                speed_count += 1
+            if upload:
+                total_upload += upload
+            if latency:
+                total_latency += latency
+                latency_count += 1
+
+        # Count locations
+        ip_address = result.get('ipAddress')
+        if ip_address:
+            stats['topLocations'][ip_address] = stats['topLocations'].get(ip_address, 0) + 1
+        for dimension, top in (('isp', stats['topNetworks']), ('region', stats['topRegions'])):
+            value = dimension_value(result, dimension)
+            if value:
+                top[value] = top.get(value, 0) + 1
+
+        # Recent activity (last 7 days)
+        timestamp = result.get('timestamp', '')
+        if timestamp:
+            try:
+                date_key = result.get('dateKey') or datetime.fromisoformat(timestamp.replace('Z', '+00:00')).strftime('%Y-%m-%d')
+                stats['recentActivity'][date_key] = stats['recentActivity'].get(date_key, 0) + 1
+            except:
+                pass
+
+    # Calculate averages
+    if speed_count > 0:
+        stats['averageDownloadSpeed'] = round(total_download / speed_count, 2)
+        stats['averageUploadSpeed'] = round(total_upload / speed_count, 2)
+    if latency_count > 0:
+        stats['averageLatency'] = round(total_latency / latency_count, 2)
+
+    # Sort top locations, networks and regions
+    for name in ('topLocations', 'topNetworks', 'topRegions'):
+        stats[name] = dict(sorted(
+            stats[name].items(),
+            key=lambda x: x[1],
+            reverse=True
+        )[:10])
+    
+    return stats
+
+# Panels of /api/analytics/dashboard, in response order
+DASHBOARD_PANELS = ('summary', 'performance', 'trends', 'comparison', 'recent')
+DASHBOARD_RECENT_COUNT = 20
+
+def dashboard_panels(requested):
+    """Panels named in a ``panels`` query value (all when None), in response order"""
+    if requested is None:
+        return DASHBOARD_PANELS
+    names = {name.strip() for name in requested.split(',') if name.strip()}
+    if not names or names - set(DASHBOARD_PANELS):
+        raise ValueError(f"panels must be a comma-separated subset of: {', '.join(DASHBOARD_PANELS)}")
+    return tuple(panel for panel in DASHBOARD_PANELS if panel in names)
+
+def compute_dashboard(results, panels, summary=None):
+    """Dashboard panels from one shared, newest-first result list
+
+    The aggregates are pure Python, so threads wouldn't run them in parallel;
+    feeding them all in a single pass over the results is cheaper.
+    """
+    aggregates = {}
+    if 'performance' in panels:
+        aggregates['performance'] = PerformanceAggregate()
+    if 'trends' in panels:
+        aggregates['trends'] = TrendsAggregate()
+    if 'comparison' in panels:
+        aggregates['comparison'] = ComparisonAggregate()
+
+    adders = [aggregate.add for aggregate in aggregates.values()]
+    for result in results:
+        for add in adders:
+            add(result)
+
+    data = {}
+    for panel in panels:
+        if panel == 'summary':
+            data['summary'] = summary if summary is not None else compute_summary(results)
+        elif panel == 'recent':
+            data['recent'] = results[:DASHBOARD_RECENT_COUNT]
+        else:
+            data[panel] = aggregates[panel].result()
+    return data
@@ -0,0 +1,198 @@
+"""
+Columnar archive of old test results
+
+Results older than the retention age are moved out of DynamoDB into Arrow
+IPC (Feather v2) files, zstd-compressed and partitioned by day:
+
+    <ARCHIVE_DIR>/date=2025-01-02/part-<id>.arrow
+
+The files are read through a memory map, and only the requested columns'
+buffers are read and decompressed. The analytics columns are flattened; the
+full item is kept as JSON in the ``item`` column, and raw samples stay packed
+float32.
+"""
+
+import base64
+import json
+import os
+import uuid
+from decimal import Decimal
+
+import pyarrow as pa
+import pyarrow.feather as feather
+
+ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', 'archive')
+COMPRESSION = 'zstd'
+
+SCHEMA = pa.schema([
+    ('testId', pa.string()),
+    ('timestamp', pa.string()),
+    ('userId', pa.string()),
+    ('testType', pa.string()),
+    ('ipAddress', pa.string()),
+    ('download', pa.float64()),
+    ('upload', pa.float64()),
+    ('latency', pa.float64()),
+    ('jitter', pa.float64()),
+    ('packetLoss', pa.float64()),
+    ('connectionQuality', pa.string()),
+    ('asn', pa.string()),
+    ('isp', pa.string()),
+    ('region', pa.string()),
+    ('pingSamples', pa.binary()),
+    ('downloadSamples', pa.binary()),
+    ('uploadSamples', pa.binary()),
+    ('item', pa.string())
+])
+
+# Columns needed to rebuild the item shape the analytics functions read
+ANALYTICS_COLUMNS = ['testId', 'timestamp', 'userId', 'testType', 'ipAddress', 'download', 'upload',
+                     'latency', 'jitter', 'packetLoss', 'connectionQuality', 'asn', 'isp', 'region']
+SPEED_TEST_COLUMNS = ('download', 'upload', 'latency', 'jitter', 'packetLoss', 'connectionQuality')
+
+def _float(value):
+    try:
+        return float(value) if value not in (None, '') else None
+    except (TypeError, ValueError):
+        return None
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, (bytes, bytearray)) or hasattr(value, 'value'):
+        return base64.b64encode(bytes(getattr(value, 'value', value))).decode()
+    if isinstance(value, set):
+        return sorted(value)
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+def to_row(item):
+    """Flatten a DynamoDB item into an archive row"""
+    speed_test = (item.get('networkData') or {}).get('speedTest') or {}
+    network = item.get('network') or {}
+    raw = item.get('rawSamples') or {}
+    rest = {k: v for k, v in item.items() if k != 'rawSamples'}
+    row = {
+        'testId': item['testId'],
+        'timestamp': item['timestamp'],
+        'userId': item.get('userId'),
+        'testType': item.get('testType'),
+        'ipAddress': item.get('ipAddress'),
+        'connectionQuality': speed_test.get('connectionQuality'),
+        'asn': str(network['asn']) if network.get('asn') is not None else None,
+        'isp': network.get('isp'),
+        'region': network.get('region'),
+        'item': json.dumps(rest, default=_json_default, separators=(',', ':'))
+    }
+    for name in ('download', 'upload', 'latency', 'jitter', 'packetLoss'):
+        row[name] = _float(speed_test.get(name))
+    for name in ('ping', 'download', 'upload'):
+        blob = raw.get(name)
+        row[f'{name}Samples'] = bytes(getattr(blob, 'value', blob)) if blob is not None else None
+    return row
+
+def to_item(row):
+    """Rebuild the item fields the analytics functions use from an archive row"""
+    speed_test = {name: row[name] for name in SPEED_TEST_COLUMNS if row.get(name) is not None}
+    network = {name: row[name] for name in ('asn', 'isp', 'region') if row.get(name) is not None}
+    item = {
+        'testId': row['testId'],
+        'timestamp': row['timestamp'],
+        'userId': row.get('userId'),
+        'testType': row.get('testType'),
+        'ipAddress': row.get('ipAddress'),
+        'networkData': {'speedTest': speed_test} if speed_test else {}
+    }
+    if network:
+        item['network'] = network
+    return item
+
+def read_part(path, columns=None):
+    """One part file, memory-mapped; only the requested columns are decompressed"""
+    return feather.read_table(path, columns=columns, memory_map=True)
+
+def _fsync_dir(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+class ArchiveWriter:
+    """Writes day partitions; skips results already archived for that day"""
+
+    def __init__(self, root=ARCHIVE_DIR):
+        self.root = root
+        self.reader = ArchiveReader(root)
+        self._archived_ids = {}
+
+    def archived_ids(self, day):
+        if day not in self._archived_ids:
+            table = self.reader.read_day(day, columns=['testId'])
+            self._archived_ids[day] = set(table.column('testId').to_pylist()) if table is not None else set()
+        return self._archived_ids[day]
+
+    def write_day(self, day, items):
+        """Archive items for one day; returns the items now safely on disk"""
+        known = self.archived_ids(day)
+        new_items = [item for item in items if item['testId'] not in known]
+        if new_items:
+            directory = os.path.join(self.root, f'date={day}')
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+                _fsync_dir(self.root)
+            path = os.path.join(directory, f'part-{uuid.uuid4().hex}.arrow')
+            table = pa.Table.from_pylist([to_row(item) for item in new_items], schema=SCHEMA)
+            feather.write_feather(table, path + '.tmp', compression=COMPRESSION)
+            with open(path + '.tmp', 'rb') as f:
+                os.fsync(f.fileno())
+            os.replace(path + '.tmp', path)
+            # The rename is only durable once the directory entry is
+            _fsync_dir(directory)
+            known.update(item['testId'] for item in new_items)
+        return items
+
+class ArchiveReader:
+    """Reads day partitions through memory maps, one column set at a time"""
+
+    def __init__(self, root=ARCHIVE_DIR):
+        self.root = root
+
+    def days(self, start=None, end=None):
+        """Archived days (YYYY-MM-DD) in [start, end]"""
+        try:
+            names = os.listdir(self.root)
+        except FileNotFoundError:
+            return []
+        days = sorted(name[5:] for name in names if name.startswith('date='))
+        return [day for day in days if (not start or day >= start[:10]) and (not end or day <= end[:10])]
+
+    def day_parts(self, day):
+        """Part file paths for one day"""
+        directory = os.path.join(self.root, f'date={day}')
+        try:
+            return [os.path.join(directory, name) for name in sorted(os.listdir(directory)) if name.endswith('.arrow')]
+        except FileNotFoundError:
+            return []
+
+    def read_day(self, day, columns=None):
+        tables = [read_part(path, columns) for path in self.day_parts(day)]
+        return pa.concat_tables(tables) if tables else None
+
+    def read(self, start=None, end=None, columns=None):
+        """One table for [start, end] (None if nothing is archived)"""
+        tables = [t for t in (self.read_day(day, columns) for day in self.days(start, end)) if t is not None]
+        return pa.concat_tables(tables) if tables else None
+
+    def items(self, start=None, end=None):
+        """Archived results in [start, end] shaped like DynamoDB items"""
+        # A bare date as the end includes that whole day
+        end_key = end + '\uffff' if end and len(end) == 10 else end
+        for day in self.days(start, end):
+            table = self.read_day(day, ANALYTICS_COLUMNS)
+            if table is None:
+                continue
+            for batch in table.to_batches():
+                for row in batch.to_pylist():
+                    if (start and row['timestamp'] < start) or (end_key and row['timestamp'] > end_key):
+                        continue
+                    yield to_item(row)
@@ -0,0 +1,198 @@
+"""
+Idempotency keys for test result uploads
+
+Clients send an ``Idempotency-Key`` header with POST /api/test-results and
+reuse it when they retry. The first request claims the key with a conditional
+put in the analytics table, as ``pending``, and marks it ``complete`` once the
+result is saved or queued. A retry against a complete claim gets the original
+testId back, so nothing is written twice; one against a pending claim is told
+to retry shortly, since the original may still fail and release the key. An
+LRU in front answers retries of completed keys that land on the same worker
+without a DynamoDB read.
+
+Claims are stored as ('idempotency#<sha256 of key>', 'claim') with the
+testId, a fingerprint of the request body, the status and a TTL (expiresAt).
+A pending claim older than IDEMPOTENCY_PENDING_SECONDS was left by a worker
+that died mid-request, and the next retry takes it over.
+"""
+
+import hashlib
+import logging
+import os
+import time
+
+from botocore.exceptions import ClientError
+
+from config.dynamodb import get_table, TABLES, StorageUnavailableError
+from utils import metrics
+from utils.cache import LRUCache
+from utils.write_queue import WriteQueue
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_METRIC = 'idempotency'
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv('IDEMPOTENCY_TTL_SECONDS', 24 * 3600))
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv('IDEMPOTENCY_CACHE_SIZE', 10000))
+# A pending claim this old is abandoned; retries of one younger wait
+IDEMPOTENCY_PENDING_SECONDS = int(os.getenv('IDEMPOTENCY_PENDING_SECONDS', 60))
+PENDING_RETRY_AFTER = 1
+MAX_KEY_LENGTH = 255
+
+PENDING = 'pending'
+COMPLETE = 'complete'
+
+class IdempotencyKeyError(ValueError):
+    """The header value is not a usable key"""
+
+class IdempotencyConflictError(Exception):
+    """The key was already used with a different request body"""
+
+class IdempotencyPendingError(Exception):
+    """The original request with this key is still in progress"""
+
+    def __init__(self, message, retry_after=PENDING_RETRY_AFTER):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+def validate_key(key):
+    if not key or len(key) > MAX_KEY_LENGTH or not key.isprintable():
+        raise IdempotencyKeyError(f'Idempotency-Key must be 1-{MAX_KEY_LENGTH} printable characters')
+    return key
+
+def fingerprint(body):
+    """Hash of the raw request body; a reused key must carry the same body"""
+    return hashlib.sha256(body).hexdigest()
+
+class IdempotencyStore:
+    """Claims keys with a conditional put; remembers recent ones in an LRU"""
+
+    def __init__(self, table_name=None, cache_size=IDEMPOTENCY_CACHE_SIZE, ttl=IDEMPOTENCY_TTL_SECONDS,
+                 pending_seconds=IDEMPOTENCY_PENDING_SECONDS):
+        self.table_name = table_name
+        self.ttl = ttl
+        self.pending_seconds = pending_seconds
+        # Only completed claims are cached, so only they are replayed locally
+        self.cache = LRUCache(max_size=cache_size, ttl=ttl)
+        # Completions that hit throttling, retried so the claim doesn't stay pending
+        self.completions = WriteQueue(
+            'idempotencyCompletions',
+            writer=self._mark_complete,
+            retryable=lambda e: isinstance(e, StorageUnavailableError),
+            max_size=cache_size
+        )
+
+    def _key(self, key):
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        return {'metricId': f'{IDEMPOTENCY_METRIC}#{digest}', 'date': 'claim'}
+
+    def _table(self):
+        return get_table(self.table_name or TABLES['ANALYTICS'])
+
+    def _check(self, key, body_fingerprint, test_id, stored_fingerprint):
+        if stored_fingerprint != body_fingerprint:
+            metrics.increment('idempotency.conflicts')
+            raise IdempotencyConflictError(f'Idempotency-Key {key!r} was already used for a different test result')
+        return test_id
+
+    def replay(self, key, body_fingerprint):
+        """testId for a key this worker has already seen, or None (no I/O)"""
+        cached = self.cache.get(key)
+        if cached is None:
+            return None
+        test_id = self._check(key, body_fingerprint, *cached)
+        metrics.increment('idempotency.cacheHits')
+        return test_id
+
+    def claim(self, key, body_fingerprint, test_id):
+        """Claim the key for test_id as pending; returns (testId to report, replayed)
+
+        Raises IdempotencyPendingError while another request holds the claim.
+        Call complete() once the result is saved or queued.
+        """
+        now = int(time.time())
+        item = {
+            **self._key(key),
+            'testId': test_id,
+            'fingerprint': body_fingerprint,
+            'status': PENDING,
+            'createdAt': now,
+            'expiresAt': now + self.ttl
+        }
+        table = self._table()
+        try:
+            # Expired claims may linger until TTL deletes them, and abandoned
+            # pending ones are taken over; neither counts
+            table.put_item(
+                Item=item,
+                ConditionExpression='attribute_not_exists(metricId) OR expiresAt < :now '
+                                    'OR (#status = :pending AND createdAt < :abandoned)',
+                ExpressionAttributeNames={'#status': 'status'},
+                ExpressionAttributeValues={
+                    ':now': now,
+                    ':pending': PENDING,
+                    ':abandoned': now - self.pending_seconds
+                }
+            )
+        except StorageUnavailableError:
+            # Favour accepting the result; only this worker's LRU guards retries
+            metrics.increment('idempotency.unverified')
+            return test_id, False
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            existing = table.get_item(Key=self._key(key), ConsistentRead=True).get('Item')
+            if existing is None:
+                # Released between our put and get: the original save failed
+                return self.claim(key, body_fingerprint, test_id)
+            original = self._check(key, body_fingerprint, existing['testId'], existing['fingerprint'])
+            # Claims written before statuses existed were only made after a save
+            if existing.get('status', COMPLETE) != COMPLETE:
+                metrics.increment('idempotency.pending')
+                raise IdempotencyPendingError(f'A request with Idempotency-Key {key!r} is still in progress')
+            self.cache.set(key, (original, body_fingerprint))
+            metrics.increment('idempotency.storeHits')
+            return original, True
+
+        metrics.increment('idempotency.claims')
+        return test_id, False
+
+    def complete(self, key, body_fingerprint, test_id):
+        """Mark test_id's claim complete once the result is saved or queued"""
+        self.cache.set(key, (test_id, body_fingerprint))
+        item = {**self._key(key), 'testId': test_id}
+        try:
+            self._mark_complete(item)
+        except StorageUnavailableError:
+            try:
+                self.completions.enqueue(item)
+            except Exception as e:
+                logger.warning('Could not queue idempotency completion: %s', e)
+        except Exception as e:
+            # The claim stays pending and is taken over once abandoned
+            logger.warning('Could not complete idempotency key: %s', e)
+
+    def _mark_complete(self, item):
+        try:
+            self._table().update_item(
+                Key={'metricId': item['metricId'], 'date': item['date']},
+                UpdateExpression='SET #status = :complete',
+                # Not when the claim was never stored (unverified) or taken over
+                ConditionExpression='testId = :testId',
+                ExpressionAttributeNames={'#status': 'status'},
+                ExpressionAttributeValues={':complete': COMPLETE, ':testId': item['testId']}
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+
+    def release(self, key):
+        """Drop a claim whose save failed, so the client's retry can write"""
+        self.cache.pop(key)
+        try:
+            self._table().delete_item(Key=self._key(key))
+        except Exception as e:
+            logger.warning('Could not release idempotency key: %s', e)
+
+idempotency_store = IdempotencyStore()
+metrics.register('idempotencyCache', idempotency_store.cache.stats)
+metrics.register('idempotencyCompletions', idempotency_store.completions.stats)
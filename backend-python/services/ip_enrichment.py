@@ -0,0 +1,45 @@
+"""
+IP enrichment
+
+Maps a client IP to its network (ASN, ISP) and coarse region using the local
+trie compiled by ``scripts/build_ip_db.py``. No network calls; if IP_DB_PATH
+is unset or missing, enrichment is skipped.
+"""
+
+import logging
+import os
+
+from utils import metrics
+from utils.ip_trie import IPTrie
+
+logger = logging.getLogger(__name__)
+
+IP_DB_PATH = os.getenv('IP_DB_PATH', 'data/ipdb.trie')
+
+# Enriched fields usable as analytics group-by dimensions
+NETWORK_DIMENSIONS = ('asn', 'isp', 'region')
+
+_trie = None
+_loaded = False
+
+def get_trie():
+    """The mapped database, opened on first use (None if unavailable)"""
+    global _trie, _loaded
+    if not _loaded:
+        _loaded = True
+        if IP_DB_PATH and os.path.exists(IP_DB_PATH):
+            try:
+                _trie = IPTrie(IP_DB_PATH)
+                logger.info('IP database mapped: %s (%d networks)', IP_DB_PATH, _trie.record_count)
+            except (OSError, ValueError) as e:
+                logger.warning('IP database unavailable: %s', e)
+    return _trie
+
+def enrich(ip_address):
+    """{'asn', 'isp', 'region'} for an IP, or None"""
+    trie = get_trie()
+    if trie is None or not ip_address:
+        return None
+    network = trie.lookup(ip_address)
+    metrics.increment('ipEnrichment.hits' if network else 'ipEnrichment.misses')
+    return network
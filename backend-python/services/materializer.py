@@ -0,0 +1,402 @@
+"""
+Stream materializer
+
+Consumes DynamoDB Stream records (NEW_AND_OLD_IMAGES) from the test results
+table and keeps materialized views in the ANALYTICS table up to date, so
+read routes fetch one item instead of scanning:
+
+    ('summary', 'all')         all-time totals, per-type counts, metric sums,
+                               top locations/networks/regions and the last 7
+                               days of activity
+    ('daily', 'YYYY-MM-DD')    per-day totals and metric sums
+    ('location', <ip>)         per-location test counts
+    ('network', <isp>)         per-ISP test counts (enriched results)
+    ('region', <region>)       per-region test counts (enriched results)
+    ('stream-applied', <seq>)  idempotency markers (expire via TTL)
+
+Each record's deltas are committed in a transaction with a conditional
+marker for its sequence number. A batch is applied in a few large
+transactions; if any marker already exists (a replay), that chunk is
+retried record by record so only new records are counted.
+
+Lambda entry point: ``services.materializer.handler``.
+Local driver: ``scripts/replay_stream.py``.
+"""
+
+import json
+import logging
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from decimal import Decimal, InvalidOperation
+
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+from botocore.exceptions import ClientError
+
+import config.dynamodb as db
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_KEY = ('summary', 'all')
+MARKER_METRIC = 'stream-applied'
+MARKER_TTL_SECONDS = 2 * 24 * 3600   # streams keep records for 24 hours
+MAX_TRANSACTION_ITEMS = 100
+TOP_LOCATIONS = 10
+# Counter items summarized as top-N maps on the summary item
+TOP_VIEWS = {'location': 'topLocations', 'network': 'topNetworks', 'region': 'topRegions'}
+RECENT_DAYS = 7
+
+_deserializer = TypeDeserializer()
+_serializer = TypeSerializer()
+
+# -- record -> deltas ---------------------------------------------------------
+
+def _number(value):
+    if value in (None, ''):
+        return Decimal(0)
+    try:
+        return Decimal(str(value))
+    except InvalidOperation:
+        return Decimal(0)
+
+def item_deltas(item, sign=1):
+    """View deltas contributed by one test result item (sign=-1 to remove)"""
+    deltas = defaultdict(lambda: defaultdict(Decimal))
+    test_type = item.get('testType')
+    timestamp = item.get('timestamp', '')
+    speed_test = (item.get('networkData') or {}).get('speedTest') or {}
+    download = _number(speed_test.get('download'))
+    upload = _number(speed_test.get('upload'))
+    latency = _number(speed_test.get('latency'))
+
+    targets = [SUMMARY_KEY]
+    if timestamp:
+        targets.append(('daily', timestamp[:10]))
+    for key in targets:
+        view = deltas[key]
+        view['tests'] += sign
+        if test_type:
+            view[f'type#{test_type}'] += sign
+        if download:
+            view['downloadSum'] += sign * download
+            view['downloadCount'] += sign
+        if upload:
+            view['uploadSum'] += sign * upload
+            view['uploadCount'] += sign
+        if latency:
+            view['latencySum'] += sign * latency
+            view['latencyCount'] += sign
+
+    if item.get('ipAddress'):
+        deltas[('location', item['ipAddress'])]['tests'] += sign
+    network = item.get('network') or {}
+    if network.get('isp'):
+        deltas[('network', network['isp'])]['tests'] += sign
+    if network.get('region'):
+        deltas[('region', network['region'])]['tests'] += sign
+    return deltas
+
+def merge_deltas(target, source):
+    for key, attrs in source.items():
+        for name, value in attrs.items():
+            target[key][name] += value
+    return target
+
+def parse_record(record):
+    """Return (sequence number, deltas) for a stream record, or None if it changes nothing"""
+    # TTL deletes of archived results: they still count toward the views
+    if record.get('userIdentity', {}).get('principalId') == 'dynamodb.amazonaws.com':
+        return None
+    change = record.get('dynamodb', {})
+    sequence = change.get('SequenceNumber') or record.get('eventID')
+    images = {}
+    for name in ('NewImage', 'OldImage'):
+        if change.get(name):
+            images[name] = {k: _deserializer.deserialize(v) for k, v in change[name].items()}
+
+    deltas = defaultdict(lambda: defaultdict(Decimal))
+    if 'NewImage' in images:
+        merge_deltas(deltas, item_deltas(images['NewImage']))
+    if 'OldImage' in images:
+        merge_deltas(deltas, item_deltas(images['OldImage'], sign=-1))
+
+    deltas = {key: {n: v for n, v in attrs.items() if v} for key, attrs in deltas.items()}
+    deltas = {key: attrs for key, attrs in deltas.items() if attrs}
+    if not sequence or not deltas:
+        return None
+    return sequence, deltas
+
+# -- stores ---------------------------------------------------------------------
+
+class DynamoViewStore:
+    """Views in the ANALYTICS table"""
+
+    def __init__(self):
+        if db.dynamodb is None:
+            db.init_dynamodb()
+        self.client = db.dynamodb
+        self.table_name = db.TABLES['ANALYTICS']
+        self.table = db.get_table(self.table_name)
+
+    def transact(self, sequences, deltas):
+        """Apply deltas with markers; False if any marker already existed"""
+        expires_at = int(time.time()) + MARKER_TTL_SECONDS
+        items = [{
+            'Put': {
+                'TableName': self.table_name,
+                'Item': _serialize({'metricId': MARKER_METRIC, 'date': seq, 'expiresAt': expires_at}),
+                'ConditionExpression': 'attribute_not_exists(metricId)'
+            }
+        } for seq in sequences]
+        for (metric_id, date), attrs in deltas.items():
+            names = {f'#a{i}': name for i, name in enumerate(attrs)}
+            values = {f':v{i}': value for i, value in enumerate(attrs.values())}
+            items.append({
+                'Update': {
+                    'TableName': self.table_name,
+                    'Key': _serialize({'metricId': metric_id, 'date': date}),
+                    'UpdateExpression': 'ADD ' + ', '.join(f'#a{i} :v{i}' for i in range(len(attrs))),
+                    'ExpressionAttributeNames': names,
+                    'ExpressionAttributeValues': _serialize(values)
+                }
+            })
+        try:
+            self.client.transact_write_items(TransactItems=items)
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'TransactionCanceledException':
+                raise
+            reasons = e.response.get('CancellationReasons', [])
+            if any(r.get('Code') == 'ConditionalCheckFailed' for r in reasons[:len(sequences)]):
+                return False
+            raise
+
+    def get_item(self, key):
+        response = self.table.get_item(Key={'metricId': key[0], 'date': key[1]})
+        return response.get('Item')
+
+    def get_items(self, keys):
+        found = {}
+        for start in range(0, len(keys), 100):
+            request = {self.table_name: {'Keys': [{'metricId': m, 'date': d} for m, d in keys[start:start + 100]]}}
+            while request:
+                response = db.dynamodb_resource.batch_get_item(RequestItems=request)
+                for item in response['Responses'].get(self.table_name, []):
+                    found[(item['metricId'], item['date'])] = item
+                request = response.get('UnprocessedKeys')
+                if request:
+                    time.sleep(0.1)
+        return found
+
+    def query_since(self, metric_id, start_date):
+        from boto3.dynamodb.conditions import Key
+        response = self.table.query(
+            KeyConditionExpression=Key('metricId').eq(metric_id) & Key('date').gte(start_date)
+        )
+        return response.get('Items', [])
+
+    def query_range(self, metric_id, start_date, end_date):
+        from boto3.dynamodb.conditions import Key
+        kwargs = {'KeyConditionExpression': Key('metricId').eq(metric_id) & Key('date').between(start_date, end_date)}
+        items = []
+        while True:
+            response = self.table.query(**kwargs)
+            items.extend(response.get('Items', []))
+            if 'LastEvaluatedKey' not in response:
+                return items
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    def set_derived(self, key, attrs, expected_version):
+        """SET attrs if the item's derivedVersion matches; False on a lost race"""
+        names = {f'#a{i}': name for i, name in enumerate(attrs)}
+        values = {f':v{i}': value for i, value in enumerate(attrs.values())}
+        values[':next'] = expected_version + 1
+        values[':expected'] = expected_version
+        sets = ', '.join(f'#a{i} = :v{i}' for i in range(len(attrs)))
+        try:
+            self.table.update_item(
+                Key={'metricId': key[0], 'date': key[1]},
+                UpdateExpression=f'SET {sets}, derivedVersion = :next',
+                ConditionExpression='attribute_not_exists(derivedVersion) OR derivedVersion = :expected',
+                ExpressionAttributeNames=names,
+                ExpressionAttributeValues=values
+            )
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return False
+            raise
+
+class MemoryViewStore:
+    """In-memory store with the same semantics, optionally persisted to a JSON file"""
+
+    def __init__(self, path=None):
+        self.path = path
+        self.items = {}
+        if path:
+            try:
+                with open(path) as f:
+                    raw = json.load(f, parse_float=Decimal, parse_int=Decimal)
+                self.items = {tuple(key.split('|', 1)): item for key, item in raw.items()}
+            except FileNotFoundError:
+                pass
+
+    def save(self):
+        if self.path:
+            with open(self.path, 'w') as f:
+                json.dump({'|'.join(key): item for key, item in self.items.items()}, f, default=str, indent=1)
+
+    def transact(self, sequences, deltas):
+        if any((MARKER_METRIC, seq) in self.items for seq in sequences):
+            return False
+        for seq in sequences:
+            self.items[(MARKER_METRIC, seq)] = {'metricId': MARKER_METRIC, 'date': seq}
+        for (metric_id, date), attrs in deltas.items():
+            item = self.items.setdefault((metric_id, date), {'metricId': metric_id, 'date': date})
+            for name, value in attrs.items():
+                item[name] = item.get(name, Decimal(0)) + value
+        return True
+
+    def get_item(self, key):
+        return self.items.get(key)
+
+    def get_items(self, keys):
+        return {key: self.items[key] for key in keys if key in self.items}
+
+    def query_since(self, metric_id, start_date):
+        return [item for (m, date), item in sorted(self.items.items()) if m == metric_id and date >= start_date]
+
+    def query_range(self, metric_id, start_date, end_date):
+        return [item for (m, date), item in sorted(self.items.items())
+                if m == metric_id and start_date <= date <= end_date]
+
+    def set_derived(self, key, attrs, expected_version):
+        item = self.items.setdefault(key, {'metricId': key[0], 'date': key[1]})
+        if item.get('derivedVersion', expected_version) != expected_version:
+            return False
+        item.update(attrs)
+        item['derivedVersion'] = expected_version + 1
+        return True
+
+def _serialize(values):
+    return {k: _serializer.serialize(v) for k, v in values.items()}
+
+# -- processing -------------------------------------------------------------------
+
+def _chunks(parsed):
+    """Group records so each transaction stays within the item limit"""
+    chunk, keys = [], set()
+    for sequence, deltas in parsed:
+        new_keys = keys | set(deltas)
+        if chunk and len(chunk) + 1 + len(new_keys) > MAX_TRANSACTION_ITEMS:
+            yield chunk
+            chunk, new_keys = [], set(deltas)
+        chunk.append((sequence, deltas))
+        keys = new_keys
+    if chunk:
+        yield chunk
+
+def _merge_top(current, touched, counts, metric_id):
+    top = {name: Decimal(count) for name, count in (current or {}).items()}
+    for name in touched:
+        count = counts.get((metric_id, name), {}).get('tests', Decimal(0))
+        if count > 0:
+            top[name] = count
+        else:
+            top.pop(name, None)
+    return dict(sorted(top.items(), key=lambda x: x[1], reverse=True)[:TOP_LOCATIONS])
+
+def refresh_summary(store, touched, today=None):
+    """Recompute the summary's top-N maps and recent activity (idempotent)
+
+    ``touched`` is the set of (metricId, name) counter keys changed by the batch.
+    """
+    today = today or datetime.utcnow().date()
+    for _ in range(5):
+        summary = store.get_item(SUMMARY_KEY) or {}
+        version = int(summary.get('derivedVersion', 0))
+
+        counts = store.get_items(list(touched))
+        derived = {}
+        for metric_id, attr in TOP_VIEWS.items():
+            names = {name for m, name in touched if m == metric_id}
+            if names or attr in summary:
+                derived[attr] = _merge_top(summary.get(attr), names, counts, metric_id)
+
+        since = (today - timedelta(days=RECENT_DAYS - 1)).isoformat()
+        derived['recentActivity'] = {item['date']: item.get('tests', Decimal(0))
+                                     for item in store.query_since('daily', since)}
+
+        if store.set_derived(SUMMARY_KEY, derived, version):
+            return True
+    return False
+
+def process_records(records, store):
+    """Apply a batch of stream records; safe to call again with the same batch"""
+    parsed, seen = [], set()
+    applied = skipped = 0
+    for record in records:
+        entry = parse_record(record)
+        if entry is None:
+            continue
+        if entry[0] in seen:
+            skipped += 1
+            continue
+        seen.add(entry[0])
+        parsed.append(entry)
+
+    for chunk in _chunks(parsed):
+        merged = defaultdict(lambda: defaultdict(Decimal))
+        for _, deltas in chunk:
+            merge_deltas(merged, deltas)
+        if store.transact([seq for seq, _ in chunk], merged):
+            applied += len(chunk)
+            continue
+        # Some records were applied before (replay): retry one at a time
+        for sequence, deltas in chunk:
+            if store.transact([sequence], deltas):
+                applied += 1
+            else:
+                skipped += 1
+
+    touched = {key for _, deltas in parsed for key in deltas if key[0] in TOP_VIEWS}
+    if parsed:
+        refresh_summary(store, touched)
+    return {'records': len(records), 'applied': applied, 'skipped': skipped}
+
+def handler(event, context):
+    """Lambda handler for the test results table's DynamoDB Stream"""
+    result = process_records(event.get('Records', []), DynamoViewStore())
+    logger.info('Materialized stream batch', extra=result)
+    return result
+
+# -- reads ------------------------------------------------------------------------
+
+def read_summary(store=None):
+    """/stats/summary from the materialized item, or None if it doesn't exist yet"""
+    store = store or DynamoViewStore()
+    return summary_from_item(store.get_item(SUMMARY_KEY))
+
+def read_daily(start_date, end_date, store=None):
+    """Daily view items for YYYY-MM-DD dates in [start_date, end_date]"""
+    store = store or DynamoViewStore()
+    return store.query_range('daily', start_date, end_date)
+
+def summary_from_item(item):
+    """Shape the materialized summary item like compute_summary()"""
+    if not item:
+        return None
+
+    download_count = item.get('downloadCount', 0)
+    latency_count = item.get('latencyCount', 0)
+    return {
+        'totalTests': int(item.get('tests', 0)),
+        'testTypes': {k.split('#', 1)[1]: int(v) for k, v in item.items() if k.startswith('type#') and v},
+        'averageDownloadSpeed': round(float(item.get('downloadSum', 0)) / float(download_count), 2) if download_count else 0,
+        'averageUploadSpeed': round(float(item.get('uploadSum', 0)) / float(download_count), 2) if download_count else 0,
+        'averageLatency': round(float(item.get('latencySum', 0)) / float(latency_count), 2) if latency_count else 0,
+        'topLocations': {k: int(v) for k, v in (item.get('topLocations') or {}).items()},
+        'topNetworks': {k: int(v) for k, v in (item.get('topNetworks') or {}).items()},
+        'topRegions': {k: int(v) for k, v in (item.get('topRegions') or {}).items()},
+        'recentActivity': {k: int(v) for k, v in sorted((item.get('recentActivity') or {}).items())}
+    }
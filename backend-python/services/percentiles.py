@@ -0,0 +1,448 @@
+"""
+Percentile ranks: "faster than X% of tests"
+
+For each test type and metric (download, upload, latency) a CDF is kept as
+``PERCENTILE_POINTS`` evenly spaced quantiles. A result's rank is a binary
+search over them, so answering costs no I/O.
+
+CDFs are built from the results of the last ``PERCENTILE_WINDOW_DAYS``,
+streamed from the type index partitions into log-bucket histograms. The
+histograms are mergeable, and their quantiles are within 1% of the true
+value using a few hundred buckets however many results there are. The
+quantiles are stored in the analytics table as ('percentiles', <testType>).
+
+Rebuilds read from the same tables as requests, so they are paced to
+``PERCENTILE_MAX_READS`` read units per second. At that pace a whole window
+takes longer than one Lambda invocation, so each (testType, day) is folded
+into its own histogram, stored as ('percentiles-day#<testType>', <day>)
+with the range it covers. A build only reads what its days are missing,
+newest first, one slice at a time, and saves partial days when it runs out
+of time; the CDFs are merged from the stored days. Builds run on a schedule:
+``handler`` on Lambda, scripts/build_percentiles.py from cron elsewhere.
+Every worker reloads the stored quantiles in the background each
+``PERCENTILE_REFRESH_SECONDS``. With PERCENTILE_BUILD_IN_PROCESS=true, a
+worker that finds them stale also rebuilds them itself, if it wins the
+('percentiles', 'build-lease') item.
+"""
+
+import json
+import logging
+import math
+import os
+import threading
+import time
+import zlib
+from bisect import bisect_left, bisect_right
+from decimal import Decimal
+
+from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+
+import config.dynamodb as db
+from models.test_result import TestResult, TEST_TYPES
+from services.timeseries import metric_value
+from utils import metrics
+from utils.token_bucket import TokenBucket
+from utils.ulid import ms_to_iso
+
+logger = logging.getLogger(__name__)
+
+PERCENTILE_METRIC = 'percentiles'
+PERCENTILE_DAY_METRIC = 'percentiles-day'
+METRICS = ('download', 'upload', 'latency')
+# Metrics where a smaller value is the better result
+LOWER_IS_BETTER = frozenset({'latency'})
+
+PERCENTILE_POINTS = int(os.getenv('PERCENTILE_POINTS', 1001))
+PERCENTILE_REFRESH_SECONDS = float(os.getenv('PERCENTILE_REFRESH_SECONDS', 3600))
+PERCENTILE_WINDOW_DAYS = int(os.getenv('PERCENTILE_WINDOW_DAYS', 90))
+# Results read per test type per slice (the newest are kept)
+PERCENTILE_MAX_ITEMS = int(os.getenv('PERCENTILE_MAX_ITEMS', 1000000))
+# Seconds of paced reading per slice of a day; a build stops between slices,
+# and slices grow or shrink to take about this long
+PERCENTILE_SLICE_SECONDS = float(os.getenv('PERCENTILE_SLICE_SECONDS', 5))
+# Time left in a Lambda invocation when the handler stops reading and stores
+PERCENTILE_HANDLER_MARGIN_SECONDS = float(os.getenv('PERCENTILE_HANDLER_MARGIN_SECONDS', 10))
+# Fewer results than this give no rank for the metric
+PERCENTILE_MIN_RESULTS = int(os.getenv('PERCENTILE_MIN_RESULTS', 30))
+PERCENTILE_BUILD_IN_PROCESS = os.getenv('PERCENTILE_BUILD_IN_PROCESS', 'false').lower() == 'true'
+# Read capacity units per second a rebuild may use
+PERCENTILE_MAX_READS = float(os.getenv('PERCENTILE_MAX_READS', 2))
+BUILD_LEASE_SECONDS = 15 * 60
+# Wait before retrying a failed load
+RETRY_SECONDS = 60
+DAY_MS = 86400000
+# The type index is eventually consistent: results newer than this wait for the next build
+SETTLE_MS = 60000
+
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+LOG_GAMMA = math.log(GAMMA)
+
+PROJECTION = ('testId, #ts, networkData.speedTest', {'#ts': 'timestamp'})
+
+class LogHistogram:
+    """Counts per logarithmic bucket of positive values (mergeable)"""
+
+    def __init__(self):
+        self.counts = {}
+        self.total = 0
+
+    def add(self, value):
+        index = math.ceil(math.log(value) / LOG_GAMMA)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.total += 1
+
+    def merge(self, other):
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.total += other.total
+        return self
+
+    def quantiles(self, points):
+        """``points`` values at ranks 0, 1/(points-1), ..., 1 (empty if no values)"""
+        if not self.total:
+            return []
+        buckets = sorted(self.counts.items())
+        out = []
+        position, seen = 0, buckets[0][1]
+        for k in range(points):
+            rank = k * (self.total - 1) / (points - 1)
+            while seen <= rank:
+                position += 1
+                seen += buckets[position][1]
+            # Middle of the bucket (gamma^(i-1), gamma^i] in relative terms
+            out.append(2 * GAMMA ** buckets[position][0] / (GAMMA + 1))
+        return out
+
+class _TypeAccumulator:
+    """A histogram per metric, for TestResult.fold_time_range"""
+
+    def __init__(self):
+        self.histograms = {metric: LogHistogram() for metric in METRICS}
+
+    def add(self, item):
+        for metric, histogram in self.histograms.items():
+            value = metric_value(item, metric)
+            if value is not None and value > 0:
+                histogram.add(value)
+
+    def merge(self, other):
+        for metric, histogram in self.histograms.items():
+            histogram.merge(other.histograms[metric])
+        return self
+
+    def encode(self):
+        """Compressed bucket counts, for a day item"""
+        counts = {metric: sorted(histogram.counts.items()) for metric, histogram in self.histograms.items()}
+        return zlib.compress(json.dumps(counts, separators=(',', ':')).encode())
+
+    @classmethod
+    def decode(cls, data):
+        accumulator = cls()
+        for metric, buckets in json.loads(zlib.decompress(bytes(data))).items():
+            histogram = accumulator.histograms.get(metric)
+            if histogram is None:
+                continue
+            for index, count in buckets:
+                histogram.counts[index] = histogram.counts.get(index, 0) + count
+                histogram.total += count
+        return accumulator
+
+class Cdf:
+    """Evenly spaced quantiles of one metric"""
+
+    def __init__(self, quantiles, count):
+        self.quantiles = quantiles
+        self.count = count
+
+    def rank(self, value):
+        """Percent of results below ``value`` (ties count half)"""
+        q = self.quantiles
+        lo, hi = bisect_left(q, value), bisect_right(q, value)
+        if hi == 0:
+            return 0.0
+        if lo == len(q):
+            return 100.0
+        if lo < hi:
+            position = (lo + hi - 1) / 2
+        else:
+            position = lo - 1 + (value - q[lo - 1]) / (q[lo] - q[lo - 1])
+        return 100.0 * position / (len(q) - 1)
+
+# -- build ------------------------------------------------------------------------
+
+def _key(name):
+    return {'metricId': PERCENTILE_METRIC, 'date': name}
+
+def _table():
+    return db.get_table(db.TABLES['ANALYTICS'])
+
+def _day_key(test_type, day):
+    return {'metricId': f'{PERCENTILE_DAY_METRIC}#{test_type}', 'date': day}
+
+def _window_days(window_days, now_ms):
+    """Start (epoch ms) of each day in the window, today first"""
+    today = now_ms - now_ms % DAY_MS
+    return [today - offset * DAY_MS for offset in range(max(1, window_days))]
+
+class _Slices:
+    """Reads a day in slices sized to take about PERCENTILE_SLICE_SECONDS each"""
+
+    def __init__(self, max_reads, deadline=None):
+        self.readers = TokenBucket(max_reads)
+        self.deadline = deadline
+        self.length = 3600000
+        self.last = 0.0
+
+    def out_of_time(self):
+        """True if another slice like the last one would end after the deadline"""
+        return self.deadline is not None and time.monotonic() + self.last >= self.deadline
+
+    def fold(self, test_type, start_ms, end_ms, accumulator):
+        """Add results with start_ms <= timestamp <= end_ms to ``accumulator``"""
+        started = time.monotonic()
+        accumulators, truncated = TestResult.fold_time_range(
+            ms_to_iso(start_ms), ms_to_iso(end_ms), _TypeAccumulator, test_types=(test_type,),
+            projection=PROJECTION, max_items=PERCENTILE_MAX_ITEMS, read_bucket=self.readers, newest_first=True
+        )
+        for folded in accumulators:
+            accumulator.merge(folded)
+        if truncated:
+            logger.warning('Percentiles for %s use the newest %d results from %s to %s', test_type,
+                           PERCENTILE_MAX_ITEMS, ms_to_iso(start_ms), ms_to_iso(end_ms))
+        # Reads are paced, so time taken tracks the capacity a slice needs
+        self.last = time.monotonic() - started
+        if self.last < PERCENTILE_SLICE_SECONDS / 2:
+            self.length = min(DAY_MS, self.length * 2)
+        elif self.last > PERCENTILE_SLICE_SECONDS:
+            self.length = max(60000, self.length // 2)
+
+def _stored_days(test_type, first_day):
+    """{day: item} of the stored day histograms from ``first_day`` on"""
+    table = _table()
+    query_kwargs = {
+        'KeyConditionExpression': (Key('metricId').eq(_day_key(test_type, first_day)['metricId'])
+                                   & Key('date').gte(first_day))
+    }
+    days = {}
+    while True:
+        response = table.query(**query_kwargs)
+        days.update((item['date'], item) for item in response.get('Items', []))
+        if 'LastEvaluatedKey' not in response:
+            return days
+        query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+def build_cdfs(window_days=PERCENTILE_WINDOW_DAYS, points=PERCENTILE_POINTS, max_reads=PERCENTILE_MAX_READS,
+               deadline=None):
+    """(cdfs, complete): bring the window's day histograms up to date and merge them
+
+    ``cdfs`` is {testType: {metric: (quantiles, count)}}. Each (testType, day)
+    item covers [through, upto) in epoch ms. An ongoing day is extended
+    upward from ``upto``, and the rest is read downward from ``through``, a
+    slice at a time. Days whose whole range is covered are complete and not
+    read again. With a ``deadline`` (time.monotonic()),
+    reading stops between slices before it would pass; the partial day is
+    saved for the next build and ``complete`` is False.
+    """
+    now_ms = int(time.time() * 1000)
+    window = _window_days(window_days, now_ms)
+    first_day = ms_to_iso(window[-1])[:10]
+    stored = {test_type: _stored_days(test_type, first_day) for test_type in TEST_TYPES}
+    slices = _Slices(max_reads, deadline)
+    table = _table()
+
+    caught_up = True
+    for day_ms in window:
+        day = ms_to_iso(day_ms)[:10]
+        day_end = day_ms + DAY_MS
+        top = min(day_end, now_ms - SETTLE_MS)
+        for test_type in TEST_TYPES:
+            item = stored[test_type].get(day)
+            if item and item.get('complete'):
+                continue
+            if slices.out_of_time():
+                caught_up = False
+                continue
+            if item:
+                accumulator = _TypeAccumulator.decode(item['histograms'])
+                through, upto = int(item['through']), int(item['upto'])
+            else:
+                accumulator = _TypeAccumulator()
+                through = upto = max(day_ms, top)
+            covered = (through, upto) if item else None
+            while upto < top and not slices.out_of_time():
+                end = min(top, upto + slices.length)
+                slices.fold(test_type, upto, end - 1, accumulator)
+                upto = end
+            while through > day_ms and not slices.out_of_time():
+                start = max(day_ms, through - slices.length)
+                slices.fold(test_type, start, through - 1, accumulator)
+                through = start
+            caught_up = caught_up and through <= day_ms and upto >= top
+            if covered == (through, upto):
+                continue
+            item = {
+                **_day_key(test_type, day),
+                'histograms': accumulator.encode(),
+                'through': through,
+                'upto': upto,
+                'complete': through <= day_ms and upto >= day_end,
+                # Kept while the day can still be in the window
+                'expiresAt': (day_end + window_days * DAY_MS) // 1000
+            }
+            table.put_item(Item=item)
+            stored[test_type][day] = item
+
+    cdfs = {}
+    for test_type, days in stored.items():
+        merged = _TypeAccumulator()
+        for item in days.values():
+            merged.merge(_TypeAccumulator.decode(item['histograms']))
+        cdfs[test_type] = {
+            metric: (histogram.quantiles(points), histogram.total)
+            for metric, histogram in merged.histograms.items()
+        }
+    return cdfs, caught_up
+
+def store_cdfs(cdfs, window_days=PERCENTILE_WINDOW_DAYS):
+    built_at = ms_to_iso(int(time.time() * 1000))
+    table = _table()
+    for test_type, by_metric in cdfs.items():
+        table.put_item(Item={
+            **_key(test_type),
+            'builtAt': built_at,
+            'windowDays': window_days,
+            'counts': {metric: count for metric, (_, count) in by_metric.items()},
+            'quantiles': {
+                metric: [Decimal(str(round(value, 3))) for value in quantiles]
+                for metric, (quantiles, _) in by_metric.items()
+            }
+        })
+    return built_at
+
+def rebuild(max_reads=PERCENTILE_MAX_READS, deadline=None):
+    """Build and store every CDF; returns {builtAt, counts, complete}
+
+    With a ``deadline``, days not read by then are left for the next rebuild
+    (``complete`` is False) and the CDFs cover the days read so far.
+    """
+    started = time.perf_counter()
+    cdfs, complete = build_cdfs(max_reads=max_reads, deadline=deadline)
+    built_at = store_cdfs(cdfs)
+    counts = {test_type: {metric: count for metric, (_, count) in by_metric.items()}
+              for test_type, by_metric in cdfs.items()}
+    metrics.increment('percentiles.builds')
+    logger.info('Rebuilt percentile CDFs in %.1f s', time.perf_counter() - started,
+                extra={'builtAt': built_at, 'counts': counts, 'complete': complete})
+    return {'builtAt': built_at, 'counts': counts, 'complete': complete}
+
+def claim_build_lease():
+    """True if this process may rebuild now (one builder at a time)"""
+    now = int(time.time())
+    try:
+        _table().put_item(
+            Item={**_key('build-lease'), 'expiresAt': now + min(BUILD_LEASE_SECONDS, int(PERCENTILE_REFRESH_SECONDS))},
+            ConditionExpression='attribute_not_exists(metricId) OR expiresAt < :now',
+            ExpressionAttributeValues={':now': now}
+        )
+        return True
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        return False
+
+def handler(event, context):
+    """Scheduled Lambda handler: rebuild the CDFs within the invocation's time"""
+    remaining = context.get_remaining_time_in_millis() / 1000 if context is not None else None
+    deadline = None if remaining is None else time.monotonic() + remaining - PERCENTILE_HANDLER_MARGIN_SECONDS
+    return rebuild(deadline=deadline)
+
+# -- lookups ----------------------------------------------------------------------
+
+class PercentileTable:
+    """In-memory CDFs with background refresh"""
+
+    def __init__(self):
+        self.cdfs = {}
+        self.built_at = None
+        self.next_refresh = 0.0
+        self.lock = threading.Lock()
+        self.refreshing = False
+
+    def load(self):
+        """Read the stored CDFs; returns the oldest builtAt (None if any are missing)"""
+        table = _table()
+        cdfs, oldest = {}, None
+        for test_type in TEST_TYPES:
+            item = table.get_item(Key=_key(test_type)).get('Item')
+            if not item:
+                oldest = ''
+                continue
+            counts = item.get('counts') or {}
+            for metric, quantiles in (item.get('quantiles') or {}).items():
+                if quantiles:
+                    cdfs[(test_type, metric)] = Cdf([float(value) for value in quantiles], int(counts.get(metric, 0)))
+            oldest = item['builtAt'] if oldest is None else min(oldest, item['builtAt'])
+        self.cdfs = cdfs
+        self.built_at = oldest or None
+        # Stale or missing ones are due for a rebuild on the next lookup
+        self.next_refresh = time.monotonic() + (0 if self._is_stale(self.built_at) else PERCENTILE_REFRESH_SECONDS)
+        return self.built_at
+
+    def _is_stale(self, built_at):
+        max_age_ms = PERCENTILE_REFRESH_SECONDS * 1000
+        return not built_at or built_at < ms_to_iso(int(time.time() * 1000 - max_age_ms))
+
+    def refresh(self):
+        """Load the stored CDFs, rebuilding them first if they are stale and we hold the lease"""
+        try:
+            built_at = self.load()
+            if not self._is_stale(built_at):
+                return
+            if PERCENTILE_BUILD_IN_PROCESS and claim_build_lease():
+                rebuild()
+                self.load()
+            else:
+                # Being rebuilt elsewhere (another worker or the scheduled handler)
+                self.next_refresh = time.monotonic() + RETRY_SECONDS
+        except Exception as e:
+            logger.warning('Could not refresh percentile CDFs: %s', e)
+            self.next_refresh = time.monotonic() + RETRY_SECONDS
+        finally:
+            self.refreshing = False
+
+    def _refresh_if_due(self):
+        if time.monotonic() < self.next_refresh or self.refreshing:
+            return
+        with self.lock:
+            if self.refreshing:
+                return
+            self.refreshing = True
+        threading.Thread(target=self.refresh, name='percentile-refresh', daemon=True).start()
+
+    def ranks(self, test_type, result):
+        """{metric: percent of ``test_type`` results this one beats}, or None
+
+        Never blocks: until the CDFs are loaded, returns None.
+        """
+        self._refresh_if_due()
+        ranks = {}
+        for metric in METRICS:
+            cdf = self.cdfs.get((test_type, metric))
+            value = metric_value(result, metric)
+            if cdf is None or cdf.count < PERCENTILE_MIN_RESULTS or value is None:
+                continue
+            below = cdf.rank(value)
+            ranks[metric] = round(100.0 - below if metric in LOWER_IS_BETTER else below, 1)
+        return ranks or None
+
+    def stats(self):
+        return {
+            'builtAt': self.built_at,
+            'cdfs': len(self.cdfs),
+            'counts': {f'{test_type}.{metric}': cdf.count for (test_type, metric), cdf in self.cdfs.items()}
+        }
+
+percentile_table = PercentileTable()
+metrics.register('percentiles', percentile_table.stats)
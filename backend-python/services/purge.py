@@ -0,0 +1,570 @@
+"""
+Bulk purge of test results
+
+An admin submits a list of test IDs or a filter (userId, testType,
+startDate/endDate). A background thread resolves the matching keys page by
+page with key-only reads (BatchGetItem for IDs, index queries for filters)
+and deletes each page with BatchWriteItem, 25 keys per call, from a small
+thread pool. Reads and writes are paced to a capacity budget charged with the
+consumed capacity DynamoDB reports. Unprocessed keys are retried with
+backoff.
+
+Jobs are stored in the analytics table as ('purge#<jobId>', 'job'), with
+the submitted IDs in ('purge#<jobId>', 'ids'). Progress and a cursor are
+checkpointed every few seconds. A job that was stopped (worker shutdown,
+error) or whose heartbeat went stale (worker killed) can be resumed from the
+last checkpoint by any worker. Pages after the checkpoint are resolved
+again, and keys deleted since then are simply no longer found.
+
+On Lambda a background thread is frozen once the response is sent, so with
+PURGE_RUNNER=scheduled jobs are only queued by the API. The scheduled
+``handler`` runs queued, interrupted and abandoned jobs (listed in
+('purge', 'active')) in the foreground until the invocation is nearly out of
+time, and leaves them interrupted at a checkpoint for the next run.
+
+Deleted results leave the materialized views through the table's stream,
+like single deletes.
+"""
+
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from boto3.dynamodb.conditions import Attr, Key
+from botocore.exceptions import ClientError
+
+import config.dynamodb as db
+from models.test_result import TestResult, recent_results
+from utils import metrics
+from utils.token_bucket import TokenBucket
+from utils.ulid import new_ulid, ms_to_iso
+
+logger = logging.getLogger(__name__)
+
+PURGE_METRIC = 'purge'
+# The IDs are stored in one item (400KB limit)
+PURGE_MAX_IDS = int(os.getenv('PURGE_MAX_IDS', 5000))
+# Parallel BatchWriteItem calls per job
+PURGE_CONCURRENCY = int(os.getenv('PURGE_CONCURRENCY', 4))
+# Capacity units per second a job may use
+PURGE_MAX_READS = float(os.getenv('PURGE_MAX_READS', 50))
+PURGE_MAX_WRITES = float(os.getenv('PURGE_MAX_WRITES', 50))
+# Keys resolved (and deleted) between cursor updates
+PURGE_PAGE_SIZE = int(os.getenv('PURGE_PAGE_SIZE', 500))
+PURGE_CHECKPOINT_SECONDS = float(os.getenv('PURGE_CHECKPOINT_SECONDS', 5))
+# A running job not checkpointed for this long may be resumed elsewhere
+PURGE_STALE_SECONDS = float(os.getenv('PURGE_STALE_SECONDS', 60))
+PURGE_JOB_TTL_SECONDS = int(os.getenv('PURGE_JOB_TTL_SECONDS', 7 * 24 * 3600))
+# 'thread' runs jobs in the worker that receives them; 'scheduled' only queues
+# them for handler() (Lambda)
+PURGE_RUNNER = os.getenv('PURGE_RUNNER', 'thread').lower()
+# Time left in an invocation when handler() stops its job at a checkpoint
+PURGE_HANDLER_MARGIN_SECONDS = float(os.getenv('PURGE_HANDLER_MARGIN_SECONDS', 5))
+
+BATCH_WRITE_SIZE = 25
+BATCH_GET_SIZE = 100
+MAX_BATCH_ATTEMPTS = 10
+
+# Table keys, plus userId to drop the user's cached history
+KEY_PROJECTION = 'testId, #ts, userId'
+KEY_NAMES = {'#ts': 'timestamp'}
+
+class PurgeJobStateError(Exception):
+    """The job is not in a state that allows the operation"""
+
+class _LeaseLost(Exception):
+    """Another runner took over the job, or it was cancelled"""
+
+def _now_ms():
+    return int(time.time() * 1000)
+
+def _job_key(job_id, part='job'):
+    return {'metricId': f'{PURGE_METRIC}#{job_id}', 'date': part}
+
+def _table():
+    return db.get_table(db.TABLES['ANALYTICS'])
+
+# IDs of jobs that haven't finished, for handler() to find without a scan
+ACTIVE_KEY = {'metricId': PURGE_METRIC, 'date': 'active'}
+
+def _set_active(job_id, active):
+    try:
+        _table().update_item(
+            Key=ACTIVE_KEY,
+            UpdateExpression='ADD jobIds :id' if active else 'DELETE jobIds :id',
+            ExpressionAttributeValues={':id': {job_id}}
+        )
+    except Exception as e:
+        logger.warning('Could not update active purge jobs: %s', e)
+
+def _consumed(response):
+    consumed = response.get('ConsumedCapacity') or []
+    if isinstance(consumed, dict):
+        consumed = [consumed]
+    return sum(float(entry.get('CapacityUnits', 0)) for entry in consumed)
+
+def _backoff(attempt):
+    return min(5.0, 0.05 * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+def key_sources(spec):
+    """Where a job's keys come from: the submitted IDs or index partitions"""
+    if 'ids' in spec:
+        return [('ids', None, None)]
+    criteria = spec['filter']
+    if criteria.get('userId'):
+        return [('UserIdIndex', 'userId', criteria['userId'])]
+    if criteria.get('testType'):
+        return TestResult.type_partitions((criteria['testType'],))
+    return TestResult.type_partitions()
+
+def job_view(item):
+    """API representation of a stored job"""
+    view = {
+        'jobId': item['jobId'],
+        'status': item['status'],
+        'dryRun': bool(item.get('dryRun')),
+        'progress': {name: int(value) for name, value in (item.get('progress') or {}).items()},
+        'createdAt': item.get('createdAt'),
+        'updatedAt': item.get('updatedAt'),
+        'finishedAt': item.get('finishedAt'),
+        'error': item.get('error')
+    }
+    if 'filter' in item:
+        view['filter'] = item['filter']
+    else:
+        view['idCount'] = int(item.get('idCount', 0))
+    return view
+
+class PurgeJob:
+    """One run of a purge job in this process"""
+
+    def __init__(self, item, ids=None):
+        self.job_id = item['jobId']
+        self.dry_run = bool(item.get('dryRun'))
+        self.spec = {'filter': item['filter']} if 'filter' in item else {'ids': ids or []}
+        self.sources = key_sources(self.spec)
+        cursor = item.get('cursor') or {}
+        self.cursor = {'partition': int(cursor.get('partition', 0)), 'position': cursor.get('position')}
+        self.progress = {'resolved': 0, 'deleted': 0, 'notFound': 0, 'retries': 0}
+        self.progress.update({name: int(value) for name, value in (item.get('progress') or {}).items()})
+        self.runner = new_ulid()
+        self.readers = TokenBucket(PURGE_MAX_READS)
+        self.writers = TokenBucket(PURGE_MAX_WRITES)
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.results_table = db.get_table(db.TABLES['TEST_RESULTS'])
+        self.table_name = db.TABLES['TEST_RESULTS']
+        self._thread = None
+        self._checkpointed = 0.0
+
+    # -- storage calls -------------------------------------------------------
+
+    def _call(self, fn, *args, **kwargs):
+        """Retry while storage is unavailable, unless the job is stopping"""
+        while True:
+            try:
+                return fn(*args, **kwargs)
+            except db.StorageUnavailableError as e:
+                if self.stopping.is_set():
+                    raise
+                time.sleep(max(1.0, e.retry_after))
+
+    def _count(self, name, amount=1):
+        with self.lock:
+            self.progress[name] += amount
+
+    # -- key resolution --------------------------------------------------------
+
+    def _get_batch(self, ids):
+        """Keys of the ULID ids that exist, via BatchGetItem"""
+        request = {self.table_name: {
+            'Keys': [{'testId': test_id, 'timestamp': TestResult.timestamp_for_id(test_id)} for test_id in ids],
+            'ProjectionExpression': KEY_PROJECTION,
+            'ExpressionAttributeNames': KEY_NAMES
+        }}
+        found = []
+        for attempt in range(MAX_BATCH_ATTEMPTS):
+            # Half a unit per eventually consistent read of an item up to 4KB
+            estimate = len(request[self.table_name]['Keys']) / 2
+            self.readers.acquire(estimate)
+            response = self._call(db.call_guarded, db.dynamodb_resource.batch_get_item,
+                                  RequestItems=request, ReturnConsumedCapacity='TOTAL')
+            self.readers.acquire(max(0.0, _consumed(response) - estimate))
+            found.extend(response.get('Responses', {}).get(self.table_name, []))
+            request = response.get('UnprocessedKeys') or {}
+            if not request:
+                return found
+            self._count('retries')
+            time.sleep(_backoff(attempt))
+        raise RuntimeError('BatchGetItem left keys unprocessed after retries')
+
+    def _query_id(self, test_id):
+        """Keys stored under a legacy (UUID) test ID"""
+        self.readers.acquire()
+        response = self._call(self.results_table.query,
+                              KeyConditionExpression=Key('testId').eq(test_id),
+                              ProjectionExpression=KEY_PROJECTION,
+                              ExpressionAttributeNames=KEY_NAMES)
+        return response.get('Items', [])
+
+    def _resolve_ids(self, offset):
+        """(keys, next offset or None, IDs not found) for a page of the submitted IDs"""
+        offset = int(offset or 0)
+        page = self.spec['ids'][offset:offset + PURGE_PAGE_SIZE]
+        ulids = [test_id for test_id in page if TestResult.timestamp_for_id(test_id)]
+        keys = []
+        for start in range(0, len(ulids), BATCH_GET_SIZE):
+            keys.extend(self._get_batch(ulids[start:start + BATCH_GET_SIZE]))
+        for test_id in page:
+            if not TestResult.timestamp_for_id(test_id):
+                keys.extend(self._query_id(test_id))
+        next_offset = offset + len(page)
+        return (keys, next_offset if next_offset < len(self.spec['ids']) else None,
+                len(page) - len({key['testId'] for key in keys}))
+
+    def _resolve_index(self, source, start_key):
+        """(keys, LastEvaluatedKey or None, 0) for a page of an index partition"""
+        index_name, key_name, key_value = source
+        criteria = self.spec['filter']
+        condition = Key(key_name).eq(key_value)
+        if criteria.get('startDate') and criteria.get('endDate'):
+            condition &= Key('timestamp').between(criteria['startDate'], criteria['endDate'])
+        elif criteria.get('startDate'):
+            condition &= Key('timestamp').gte(criteria['startDate'])
+        elif criteria.get('endDate'):
+            condition &= Key('timestamp').lte(criteria['endDate'])
+        query_kwargs = {
+            'IndexName': index_name,
+            'KeyConditionExpression': condition,
+            'ProjectionExpression': KEY_PROJECTION,
+            'ExpressionAttributeNames': KEY_NAMES,
+            'Limit': PURGE_PAGE_SIZE,
+            'ReturnConsumedCapacity': 'TOTAL'
+        }
+        if key_name == 'userId' and criteria.get('testType'):
+            query_kwargs['FilterExpression'] = Attr('testType').eq(criteria['testType'])
+        if start_key:
+            query_kwargs['ExclusiveStartKey'] = start_key
+        self.readers.acquire()
+        response = self._call(self.results_table.query, **query_kwargs)
+        self.readers.acquire(max(0.0, _consumed(response) - 1))
+        return response.get('Items', []), response.get('LastEvaluatedKey'), 0
+
+    # -- deletes -------------------------------------------------------------
+
+    def _delete_batch(self, keys):
+        """Delete up to 25 keys; False if the job stopped first"""
+        if self.stopping.is_set():
+            return False
+        requests = [{'DeleteRequest': {'Key': {'testId': key['testId'], 'timestamp': key['timestamp']}}}
+                    for key in keys]
+        remaining = {self.table_name: requests}
+        for attempt in range(MAX_BATCH_ATTEMPTS):
+            pending = len(remaining[self.table_name])
+            self.writers.acquire(pending)
+            response = self._call(db.call_guarded, db.dynamodb_resource.batch_write_item,
+                                  RequestItems=remaining, ReturnConsumedCapacity='TOTAL')
+            # Large items cost more than one write unit per delete
+            self.writers.acquire(max(0.0, _consumed(response) - pending))
+            remaining = response.get('UnprocessedItems') or {}
+            self._count('deleted', pending - len(remaining.get(self.table_name, [])))
+            if not remaining:
+                break
+            self._count('retries')
+            time.sleep(_backoff(attempt))
+        else:
+            raise RuntimeError('BatchWriteItem left deletes unprocessed after retries')
+        for key in keys:
+            recent_results.invalidate(key.get('userId'), key['testId'])
+        metrics.increment('purge.deleted', len(keys))
+        return True
+
+    def _delete(self, pool, keys):
+        """Delete a page of keys in parallel batches; False if the job stopped first"""
+        if self.dry_run or not keys:
+            return True
+        batches = [keys[start:start + BATCH_WRITE_SIZE] for start in range(0, len(keys), BATCH_WRITE_SIZE)]
+        return all(list(pool.map(self._delete_batch, batches)))
+
+    # -- job state -------------------------------------------------------------
+
+    def _update(self, expression, values, names=None, running=True):
+        """Conditional update of the job item; raises _LeaseLost if it is no longer ours"""
+        condition, names, values = 'runner = :runner', dict(names or {}), {':runner': self.runner, **values}
+        if running:
+            condition += ' AND #status = :running'
+            names['#status'], values[':running'] = 'status', 'running'
+        try:
+            _table().update_item(
+                Key=_job_key(self.job_id),
+                UpdateExpression=expression,
+                ConditionExpression=condition,
+                ExpressionAttributeNames=names,
+                ExpressionAttributeValues=values
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            raise _LeaseLost()
+
+    def _checkpoint(self, force=False):
+        if not force and time.monotonic() - self._checkpointed < PURGE_CHECKPOINT_SECONDS:
+            return
+        with self.lock:
+            progress = dict(self.progress)
+        self._update('SET progress = :progress, #cursor = :cursor, updatedAt = :now',
+                     {':progress': progress, ':cursor': dict(self.cursor), ':now': ms_to_iso(_now_ms())},
+                     {'#cursor': 'cursor'})
+        self._checkpointed = time.monotonic()
+
+    def _finish(self, status, error=None):
+        with self.lock:
+            progress = dict(self.progress)
+        now = _now_ms()
+        self._update('SET #status = :status, progress = :progress, #cursor = :cursor, updatedAt = :now, '
+                     'finishedAt = :now, #error = :error, expiresAt = :expires',
+                     {':status': status, ':progress': progress, ':cursor': dict(self.cursor),
+                      ':now': ms_to_iso(now), ':error': error,
+                      ':expires': now // 1000 + PURGE_JOB_TTL_SECONDS},
+                     {'#cursor': 'cursor', '#error': 'error'})
+        logger.info('Purge job %s %s', self.job_id, status, extra={'jobId': self.job_id, **progress})
+        if status != 'interrupted':
+            _set_active(self.job_id, False)
+
+    # -- run -----------------------------------------------------------------
+
+    def _run(self):
+        try:
+            with ThreadPoolExecutor(max_workers=PURGE_CONCURRENCY, thread_name_prefix='purge') as pool:
+                for index, source in enumerate(self.sources):
+                    if index < self.cursor['partition']:
+                        continue
+                    position = self.cursor['position'] if index == self.cursor['partition'] else None
+                    while not self.stopping.is_set():
+                        if source[0] == 'ids':
+                            keys, position, not_found = self._resolve_ids(position)
+                        else:
+                            keys, position, not_found = self._resolve_index(source, position)
+                        if not self._delete(pool, keys):
+                            break  # stopped mid-page; the cursor still points at it
+                        self._count('resolved', len(keys))
+                        self._count('notFound', not_found)
+                        if position is None:
+                            break
+                        self.cursor = {'partition': index, 'position': position}
+                        self._checkpoint()
+                    if self.stopping.is_set():
+                        break
+                    self.cursor = {'partition': index + 1, 'position': None}
+                    self._checkpoint()
+            self._finish('interrupted' if self.stopping.is_set() else 'completed')
+        except _LeaseLost:
+            logger.info('Purge job %s was cancelled or taken over', self.job_id)
+            try:
+                # Still ours if it was cancelled: keep the count of what was deleted
+                with self.lock:
+                    progress = dict(self.progress)
+                self._update('SET progress = :progress', {':progress': progress}, running=False)
+            except _LeaseLost:
+                pass
+        except Exception as e:
+            logger.error('Purge job %s failed: %s', self.job_id, e, exc_info=e)
+            try:
+                self._finish('interrupted' if self.stopping.is_set() else 'failed', str(e))
+            except Exception as finish_error:
+                logger.warning('Could not record purge job state: %s', finish_error)
+        finally:
+            with _jobs_lock:
+                _jobs.pop(self.job_id, None)
+
+    def start(self):
+        with _jobs_lock:
+            _jobs[self.job_id] = self
+        self._checkpointed = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name=f'purge-{self.job_id}', daemon=True)
+        self._thread.start()
+
+    def run_until(self, deadline):
+        """Run in this thread, stopping at a checkpoint by ``deadline`` (monotonic)"""
+        with _jobs_lock:
+            _jobs[self.job_id] = self
+        self._checkpointed = time.monotonic()
+        timer = threading.Timer(max(0.0, deadline - time.monotonic()), self.stopping.set)
+        timer.start()
+        try:
+            self._run()
+        finally:
+            timer.cancel()
+
+    def stop(self, timeout):
+        self.stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+# Jobs running in this process
+_jobs = {}
+_jobs_lock = threading.Lock()
+metrics.register('purgeJobs', lambda: {'running': len(_jobs)})
+
+def create_job(spec, dry_run=False):
+    """Store a new job and start it in this process (or queue it); returns its view
+
+    ``spec`` is {'ids': [...]} or {'filter': {...}} with canonical timestamps.
+    """
+    now = ms_to_iso(_now_ms())
+    job_id = new_ulid()
+    item = {
+        **_job_key(job_id),
+        'jobId': job_id,
+        'status': 'queued' if PURGE_RUNNER == 'scheduled' else 'running',
+        'dryRun': dry_run,
+        'progress': {},
+        'cursor': {'partition': 0, 'position': None},
+        'createdAt': now,
+        'updatedAt': now
+    }
+    if 'ids' in spec:
+        spec = {'ids': list(dict.fromkeys(spec['ids']))}
+        item['idCount'] = len(spec['ids'])
+        _table().put_item(Item={**_job_key(job_id, 'ids'), 'ids': spec['ids']})
+    else:
+        item['filter'] = spec['filter']
+    job = PurgeJob(item, spec.get('ids'))
+    item['runner'] = job.runner
+    _table().put_item(Item=item)
+    _set_active(job_id, True)
+    if item['status'] == 'running':
+        job.start()
+    metrics.increment('purge.jobs')
+    return job_view(item)
+
+def get_job(job_id):
+    item = _table().get_item(Key=_job_key(job_id), ConsistentRead=True).get('Item')
+    return job_view(item) if item else None
+
+def _take_over(job_id, status, resumable):
+    """Set a job with one of the ``resumable`` statuses (or running but stale) to ``status``
+
+    Returns the PurgeJob that now owns it, or None if there is no such job;
+    raises PurgeJobStateError if it is in another state.
+    """
+    table = _table()
+    item = table.get_item(Key=_job_key(job_id), ConsistentRead=True).get('Item')
+    if item is None:
+        return None
+    ids = None
+    if 'filter' not in item:
+        ids = (table.get_item(Key=_job_key(job_id, 'ids'), ConsistentRead=True).get('Item') or {}).get('ids', [])
+    job = PurgeJob(item, ids)
+    now = _now_ms()
+    statuses = {f':resumable{index}': value for index, value in enumerate(resumable)}
+    try:
+        table.update_item(
+            Key=_job_key(job_id),
+            UpdateExpression='SET #status = :status, runner = :runner, updatedAt = :now REMOVE finishedAt, '
+                             'expiresAt, #error',
+            ConditionExpression=f"#status IN ({', '.join(statuses)}) "
+                                'OR (#status = :running AND updatedAt < :stale)',
+            ExpressionAttributeNames={'#status': 'status', '#error': 'error'},
+            ExpressionAttributeValues={
+                ':status': status, ':running': 'running', **statuses,
+                ':runner': job.runner, ':now': ms_to_iso(now),
+                ':stale': ms_to_iso(now - int(PURGE_STALE_SECONDS * 1000))
+            }
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        raise PurgeJobStateError(f"Job {job_id} is {item['status']} and cannot be resumed")
+    return job
+
+def resume_job(job_id):
+    """Continue a stopped or abandoned job from its checkpoint in this process (or queue it)
+
+    Returns None if there is no such job; raises PurgeJobStateError if it is
+    finished or still running elsewhere.
+    """
+    if PURGE_RUNNER == 'scheduled':
+        if _take_over(job_id, 'queued', ('interrupted', 'failed')) is None:
+            return None
+        _set_active(job_id, True)
+    else:
+        job = _take_over(job_id, 'running', ('interrupted', 'failed', 'queued'))
+        if job is None:
+            return None
+        _set_active(job_id, True)
+        job.start()
+    metrics.increment('purge.resumed')
+    return get_job(job_id)
+
+def handler(event, context):
+    """Scheduled Lambda handler: run queued, interrupted and abandoned jobs
+
+    Jobs run one after another in this invocation and are stopped at a
+    checkpoint PURGE_HANDLER_MARGIN_SECONDS before it times out, so the next
+    run carries on from there.
+    """
+    remaining = context.get_remaining_time_in_millis() / 1000 if context is not None else 60.0
+    deadline = time.monotonic() + remaining - PURGE_HANDLER_MARGIN_SECONDS
+    active = _table().get_item(Key=ACTIVE_KEY, ConsistentRead=True).get('Item') or {}
+    ran = []
+    for job_id in sorted(active.get('jobIds') or ()):
+        if time.monotonic() >= deadline:
+            break
+        try:
+            job = _take_over(job_id, 'running', ('queued', 'interrupted'))
+        except PurgeJobStateError:
+            view = get_job(job_id)
+            if view is not None and view['status'] in ('completed', 'failed', 'cancelled'):
+                _set_active(job_id, False)
+            continue  # running elsewhere, or finished
+        if job is None:
+            _set_active(job_id, False)
+            continue
+        job.run_until(deadline)
+        ran.append(job_id)
+    return {'ran': ran}
+
+def cancel_job(job_id):
+    """Stop a job wherever it runs (its runner stops at its next checkpoint)
+
+    Returns None if there is no such job; raises PurgeJobStateError if it
+    already finished.
+    """
+    try:
+        _table().update_item(
+            Key=_job_key(job_id),
+            UpdateExpression='SET #status = :cancelled, updatedAt = :now, finishedAt = :now, expiresAt = :expires',
+            ConditionExpression='attribute_exists(metricId) AND #status IN (:queued, :running, :interrupted, :failed)',
+            ExpressionAttributeNames={'#status': 'status'},
+            ExpressionAttributeValues={
+                ':cancelled': 'cancelled', ':queued': 'queued', ':running': 'running',
+                ':interrupted': 'interrupted', ':failed': 'failed', ':now': ms_to_iso(_now_ms()),
+                ':expires': int(time.time()) + PURGE_JOB_TTL_SECONDS
+            }
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        view = get_job(job_id)
+        if view is None:
+            return None
+        raise PurgeJobStateError(f"Job {job_id} is already {view['status']}")
+    _set_active(job_id, False)
+    local = _jobs.get(job_id)
+    if local is not None:
+        local.stopping.set()
+    return get_job(job_id)
+
+def shutdown(timeout=10.0):
+    """Stop this process's jobs at a checkpoint, leaving them resumable"""
+    with _jobs_lock:
+        running = list(_jobs.values())
+    deadline = time.monotonic() + timeout
+    for job in running:
+        job.stopping.set()
+    for job in running:
+        job.stop(max(0.0, deadline - time.monotonic()))
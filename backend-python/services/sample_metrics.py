@@ -0,0 +1,137 @@
+"""
+Test metrics from raw samples
+
+Clients may post raw sample arrays with a test result (ping RTTs in ms, with
+null for lost probes, and download/upload throughput samples in Mbps). The
+metrics are computed here with whole-array NumPy operations instead of
+trusting client-side summaries. Raw samples are stored as packed little-endian
+float32 (4 bytes per sample, NaN for lost probes).
+"""
+
+from decimal import Decimal
+
+import numpy as np
+
+SAMPLE_DTYPE = np.dtype('<f4')
+PING_PERCENTILES = (50, 90, 95, 99)
+TRIM_FRACTION = 0.1   # dropped from each end for the stable throughput
+
+GRADES = np.array(list('ABCDF'))
+# Grade boundaries A..D; lower is better for these...
+LATENCY_GRADES = np.array([20, 50, 100, 200])
+JITTER_GRADES = np.array([5, 15, 30, 50])
+LOSS_GRADES = np.array([0.1, 1, 2.5, 5])
+# ...and higher is better (Mbps) for these
+DOWNLOAD_GRADES = np.array([100, 50, 25, 10])
+UPLOAD_GRADES = np.array([50, 20, 10, 3])
+
+def _grade(value, bounds, higher_is_better=False):
+    if higher_is_better:
+        return int(np.searchsorted(-bounds, -value, side='left'))
+    return int(np.searchsorted(bounds, value, side='left'))
+
+def ping_metrics(rtts):
+    lost = np.isnan(rtts)
+    valid = rtts[~lost]
+    result = {
+        'count': int(rtts.size),
+        'lost': int(lost.sum()),
+        'packetLoss': float(lost.mean() * 100) if rtts.size else 0.0
+    }
+    if valid.size:
+        percentiles = np.percentile(valid, PING_PERCENTILES)
+        result.update({
+            'min': float(valid.min()),
+            'mean': float(valid.mean()),
+            'max': float(valid.max()),
+            **{f'p{p}': float(v) for p, v in zip(PING_PERCENTILES, percentiles)},
+            # Mean absolute difference between consecutive RTTs
+            'jitter': float(np.abs(np.diff(valid)).mean()) if valid.size > 1 else 0.0
+        })
+    return result
+
+def throughput_metrics(samples):
+    ordered = np.sort(samples[~np.isnan(samples)])
+    if not ordered.size:
+        return {'count': 0}
+    trim = int(ordered.size * TRIM_FRACTION)
+    stable = ordered[trim:ordered.size - trim] if ordered.size > 2 * trim else ordered
+    return {
+        'count': int(ordered.size),
+        'stable': float(stable.mean()),
+        'mean': float(ordered.mean()),
+        'p90': float(np.percentile(ordered, 90)),
+        'peak': float(ordered[-1])
+    }
+
+def compute_sample_metrics(samples):
+    """Metrics and quality grades for {'ping': array, 'download': array, 'upload': array}"""
+    result = {}
+    grades = {}
+    if 'ping' in samples:
+        ping = result['ping'] = ping_metrics(samples['ping'])
+        if 'p50' in ping:
+            grades['latency'] = _grade(ping['p50'], LATENCY_GRADES)
+            grades['jitter'] = _grade(ping['jitter'], JITTER_GRADES)
+        if ping['count']:
+            grades['packetLoss'] = _grade(ping['packetLoss'], LOSS_GRADES)
+    for name, bounds in (('download', DOWNLOAD_GRADES), ('upload', UPLOAD_GRADES)):
+        if name in samples:
+            result[name] = throughput_metrics(samples[name])
+            if result[name]['count']:
+                grades[name] = _grade(result[name]['stable'], bounds, higher_is_better=True)
+    if grades:
+        grades['overall'] = max(grades.values())
+        result['grades'] = {name: str(GRADES[grade]) for name, grade in grades.items()}
+    return result
+
+def speed_test_fields(sample_metrics):
+    """networkData.speedTest values derived from the sample metrics"""
+    fields = {}
+    ping = sample_metrics.get('ping', {})
+    if 'p50' in ping:
+        fields['latency'] = ping['p50']
+        fields['jitter'] = ping['jitter']
+    if ping.get('count'):
+        fields['packetLoss'] = ping['packetLoss']
+    for name in ('download', 'upload'):
+        if 'stable' in sample_metrics.get(name, {}):
+            fields[name] = sample_metrics[name]['stable']
+    return fields
+
+def to_dynamodb(value, places=3):
+    """Floats -> Decimal (DynamoDB rejects float), recursively"""
+    if isinstance(value, dict):
+        return {k: to_dynamodb(v, places) for k, v in value.items()}
+    if isinstance(value, float):
+        return Decimal(str(round(value, places)))
+    return value
+
+def pack_samples(samples):
+    """{'ping': array, ...} -> {'ping': float32 bytes, ...}"""
+    return {name: np.asarray(values, dtype=SAMPLE_DTYPE).tobytes() for name, values in samples.items()}
+
+def unpack_samples(raw):
+    """Inverse of pack_samples; NaN (lost probe) becomes None"""
+    unpacked = {}
+    for name, blob in raw.items():
+        values = np.frombuffer(bytes(getattr(blob, 'value', blob)), dtype=SAMPLE_DTYPE).astype(np.float64)
+        rounded = np.round(values, 3)
+        unpacked[name] = [None if v != v else v for v in rounded.tolist()]
+    return unpacked
+
+def apply_samples(data):
+    """Replace client-computed speedTest values with ones derived from data['samples']"""
+    samples = data.pop('samples', None)
+    if not samples:
+        return data
+    sample_metrics = compute_sample_metrics(samples)
+    network_data = dict(data.get('networkData') or {})
+    speed_test = dict(network_data.get('speedTest') or {})
+    speed_test.update(to_dynamodb(speed_test_fields(sample_metrics)))
+    speed_test['source'] = 'samples'
+    network_data['speedTest'] = speed_test
+    data['networkData'] = network_data
+    data['sampleMetrics'] = to_dynamodb(sample_metrics)
+    data['rawSamples'] = pack_samples(samples)
+    return data
@@ -0,0 +1,249 @@
+"""
+Downsampled time series for /api/analytics/timeseries
+
+A window is cut into buckets of the requested granularity (5m, 1h, 1d, 1w;
+weeks start on Monday, all in UTC). Each bucket keeps count/sum/min/max, and
+the series is reduced to at most ``points`` points, either by merging
+adjacent buckets ('buckets': count, mean, min, max per point) or by
+Largest-Triangle-Three-Buckets over the bucket means ('lttb': the points
+that best keep the line's shape). The payload size depends on ``points``,
+not on the window length.
+
+Daily and weekly series come from the materialized daily views when they
+exist (count and mean only; min/max need the raw results). Otherwise raw
+results are streamed from the type index partitions into the buckets, for
+windows of up to ``TIMESERIES_RAW_MAX_DAYS`` and within a read capacity
+budget per request.
+"""
+
+import math
+import os
+from datetime import datetime, timezone
+
+from models.test_result import TestResult, TEST_TYPES
+from services.materializer import read_daily, read_summary
+from utils.ulid import iso_to_ms, ms_to_iso
+
+GRANULARITIES = {
+    '5m': 5 * 60 * 1000,
+    '1h': 60 * 60 * 1000,
+    '1d': 24 * 60 * 60 * 1000,
+    '1w': 7 * 24 * 60 * 60 * 1000
+}
+METRICS = ('download', 'upload', 'latency', 'tests')
+DOWNSAMPLE_METHODS = ('buckets', 'lttb')
+
+# 1970-01-05, the first Monday after the epoch
+WEEK_ORIGIN_MS = 4 * GRANULARITIES['1d']
+
+TIMESERIES_MAX_POINTS = int(os.getenv('TIMESERIES_MAX_POINTS', 1000))
+# Finest grid a request may ask for (window / granularity)
+TIMESERIES_MAX_BUCKETS = int(os.getenv('TIMESERIES_MAX_BUCKETS', 20000))
+# Raw results read per request before the series is marked truncated
+TIMESERIES_MAX_ITEMS = int(os.getenv('TIMESERIES_MAX_ITEMS', 200000))
+# Read capacity units one request may spend on raw results
+TIMESERIES_MAX_READ_UNITS = float(os.getenv('TIMESERIES_MAX_READ_UNITS', 100))
+# Longest window read from raw results; longer ones need the daily views
+TIMESERIES_RAW_MAX_DAYS = float(os.getenv('TIMESERIES_RAW_MAX_DAYS', 7))
+
+# Daily view attributes (count, sum) per metric
+ROLLUP_FIELDS = {
+    'download': ('downloadCount', 'downloadSum'),
+    'upload': ('uploadCount', 'uploadSum'),
+    'latency': ('latencyCount', 'latencySum'),
+    'tests': ('tests', 'tests')
+}
+
+RAW_PROJECTION = ('testId, #ts, epochMs, networkData.speedTest', {'#ts': 'timestamp'})
+
+class RawWindowError(ValueError):
+    """A window too long to read from raw results"""
+
+def check_raw_window(start_ms, end_ms):
+    """Raise RawWindowError if the window is over TIMESERIES_RAW_MAX_DAYS"""
+    if end_ms - start_ms > TIMESERIES_RAW_MAX_DAYS * GRANULARITIES['1d']:
+        raise RawWindowError(f'Windows over {TIMESERIES_RAW_MAX_DAYS:g} days are only served from the '
+                             'daily views (1d/1w granularity across all test types)')
+
+def needs_raw(step, test_type):
+    """Whether a series can only come from raw results"""
+    return step < GRANULARITIES['1d'] or bool(test_type)
+
+def metric_value(item, metric):
+    """A raw result's value for ``metric`` (None if absent, as analytics skip it)"""
+    if metric == 'tests':
+        return 1.0
+    value = ((item.get('networkData') or {}).get('speedTest') or {}).get(metric)
+    if not value:
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def bucket_origin(ms, step):
+    """Start of the bucket containing ``ms`` (weeks start on Monday)"""
+    offset = WEEK_ORIGIN_MS if step == GRANULARITIES['1w'] else 0
+    return (ms - offset) // step * step + offset
+
+class SeriesAccumulator:
+    """count/sum/min/max per bucket index on a fixed grid"""
+
+    def __init__(self, metric, origin, step):
+        self.metric = metric
+        self.origin = origin
+        self.step = step
+        self.buckets = {}
+
+    def add_value(self, ms, value, count=1, lo=None, hi=None):
+        index = (ms - self.origin) // self.step
+        bucket = self.buckets.get(index)
+        if bucket is None:
+            self.buckets[index] = [count, value, lo, hi]
+            return
+        bucket[0] += count
+        bucket[1] += value
+        if lo is not None:
+            bucket[2] = lo if bucket[2] is None else min(bucket[2], lo)
+            bucket[3] = hi if bucket[3] is None else max(bucket[3], hi)
+
+    def add(self, item):
+        value = metric_value(item, self.metric)
+        if value is None:
+            return
+        ms = item.get('epochMs')
+        try:
+            ms = int(ms) if ms is not None else iso_to_ms(item.get('timestamp', ''))
+        except ValueError:
+            return
+        self.add_value(ms, value, 1, value, value)
+
+    def merge(self, other):
+        for index, (count, total, lo, hi) in other.buckets.items():
+            self.add_value(other.origin + index * other.step, total, count, lo, hi)
+        return self
+
+def lttb(points, threshold):
+    """Largest-Triangle-Three-Buckets: ``threshold`` of the (x, y) points"""
+    if threshold >= len(points) or threshold < 3:
+        return list(points)
+
+    sampled = [points[0]]
+    every = (len(points) - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        # Average of the next bucket is the third triangle vertex
+        avg_start = int((i + 1) * every) + 1
+        avg_end = min(int((i + 2) * every) + 1, len(points))
+        span = points[avg_start:avg_end]
+        avg_x = sum(x for x, _ in span) / len(span)
+        avg_y = sum(y for _, y in span) / len(span)
+
+        ax, ay = points[a]
+        best, best_area = int(i * every) + 1, -1.0
+        for j in range(int(i * every) + 1, int((i + 1) * every) + 1):
+            x, y = points[j]
+            area = abs((ax - avg_x) * (y - ay) - (ax - x) * (avg_y - ay))
+            if area > best_area:
+                best, best_area = j, area
+        sampled.append(points[best])
+        a = best
+    sampled.append(points[-1])
+    return sampled
+
+def parse_window(start, end, step, points):
+    """(grid origin, start ms, end ms, bucket count) for ISO ``start``/``end``
+
+    Without ``end`` the window ends now; without ``start`` it spans
+    ``points`` buckets. Raises ValueError for bad or oversized windows.
+    """
+    end_ms = iso_to_ms(end) if end else int(datetime.now(timezone.utc).timestamp() * 1000)
+    start_ms = iso_to_ms(start) if start else end_ms - (points - 1) * step
+    if start_ms >= end_ms:
+        raise ValueError('from must be before to')
+    origin = bucket_origin(start_ms, step)
+    buckets = (end_ms - origin) // step + 1
+    if buckets > TIMESERIES_MAX_BUCKETS:
+        raise ValueError(f'Window spans {buckets} buckets at this granularity (max {TIMESERIES_MAX_BUCKETS})')
+    return origin, start_ms, end_ms, buckets
+
+def _from_rollups(metric, origin, step, start_ms, end_ms):
+    """Accumulator from the daily views, or None if they can't answer"""
+    if read_summary() is None:
+        return None  # materializer not running
+    count_field, sum_field = ROLLUP_FIELDS[metric]
+    accumulator = SeriesAccumulator(metric, origin, step)
+    for item in read_daily(ms_to_iso(start_ms)[:10], ms_to_iso(end_ms)[:10]):
+        count = item.get(count_field)
+        if count is None:
+            if item.get(sum_field):
+                return None  # views from before this count was kept
+            continue
+        if count:
+            accumulator.add_value(iso_to_ms(item['date']), float(item.get(sum_field, 0)), int(count))
+    return accumulator
+
+def _from_raw(metric, origin, step, start_ms, end_ms, test_types):
+    accumulators, truncated = TestResult.fold_time_range(
+        ms_to_iso(start_ms), ms_to_iso(end_ms),
+        lambda: SeriesAccumulator(metric, origin, step),
+        test_types=test_types, projection=RAW_PROJECTION, max_items=TIMESERIES_MAX_ITEMS,
+        max_read_units=TIMESERIES_MAX_READ_UNITS
+    )
+    merged = SeriesAccumulator(metric, origin, step)
+    for accumulator in accumulators:
+        merged.merge(accumulator)
+    return merged, truncated
+
+def _bucket_points(accumulator, buckets, factor, metric):
+    merged = SeriesAccumulator(metric, accumulator.origin, accumulator.step * factor)
+    merged.merge(accumulator)
+    out = []
+    for index in range(math.ceil(buckets / factor)):
+        count, total, lo, hi = merged.buckets.get(index, (0, 0, None, None))
+        point = {'t': merged.origin + index * merged.step, 'count': count}
+        if metric != 'tests':
+            point['mean'] = round(total / count, 2) if count else None
+            point['min'] = lo
+            point['max'] = hi
+        out.append(point)
+    return out
+
+def _lttb_points(accumulator, points, metric):
+    series = [
+        (accumulator.origin + index * accumulator.step, count if metric == 'tests' else total / count)
+        for index, (count, total, _, _) in sorted(accumulator.buckets.items())
+    ]
+    return [{'t': t, 'value': round(value, 2)} for t, value in lttb(series, points)]
+
+def compute_timeseries(metric, granularity, start=None, end=None, points=200, downsample='buckets',
+                       test_type=None):
+    """Downsampled series for /api/analytics/timeseries"""
+    step = GRANULARITIES[granularity]
+    origin, start_ms, end_ms, buckets = parse_window(start, end, step, points)
+
+    accumulator, truncated, source = None, False, 'raw'
+    if not needs_raw(step, test_type):
+        # Daily views hold whole UTC days, so widen the window to day edges
+        accumulator = _from_rollups(metric, origin, step, origin, end_ms)
+        source = 'rollup'
+    if accumulator is None:
+        check_raw_window(start_ms, end_ms)
+        accumulator, truncated = _from_raw(metric, origin, step, start_ms, end_ms,
+                                           (test_type,) if test_type else TEST_TYPES)
+        source = 'raw'
+
+    factor = max(1, math.ceil(buckets / points))
+    series = (_lttb_points(accumulator, points, metric) if downsample == 'lttb'
+              else _bucket_points(accumulator, buckets, factor, metric))
+    return {
+        'metric': metric,
+        'granularity': granularity,
+        'bucketMs': step if downsample == 'lttb' else step * factor,
+        'downsample': downsample,
+        'from': ms_to_iso(start_ms),
+        'to': ms_to_iso(end_ms),
+        'source': source,
+        'truncated': truncated,
+        'points': series
+    }
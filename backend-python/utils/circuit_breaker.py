@@ -0,0 +1,104 @@
+"""
+Circuit breaker
+
+Counts consecutive failures that indicate an overloaded dependency; once the
+threshold is reached the breaker opens and calls fail fast until
+``reset_timeout`` has passed. Then a single trial call is let through
+(half-open): success closes the breaker, failure re-opens it.
+"""
+
+import threading
+import time
+
+from utils import metrics
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the dependency while the breaker is open"""
+
+class CircuitBreaker:
+    """Thread-safe consecutive-failure circuit breaker"""
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=10.0, is_failure=None):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.is_failure = is_failure or (lambda error: True)
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def _before_call(self):
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return
+        metrics.increment(f'{self.name}.breaker.rejected')
+        raise CircuitOpenError(f'{self.name} circuit is open')
+
+    def _on_success(self):
+        with self._lock:
+            self.failures = 0
+            self._trial_in_flight = False
+            if self.state != CLOSED:
+                self.state = CLOSED
+                metrics.increment(f'{self.name}.breaker.closed')
+
+    def _on_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    metrics.increment(f'{self.name}.breaker.opened')
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+    def call(self, fn, *args, **kwargs):
+        self._before_call()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            if self.is_failure(e):
+                self._on_failure()
+            else:
+                self._on_success()
+            raise
+        self._on_success()
+        return result
+
+    async def call_async(self, fn, *args, **kwargs):
+        """call() for coroutine functions (the async DynamoDB client)"""
+        self._before_call()
+        try:
+            result = await fn(*args, **kwargs)
+        except Exception as e:
+            if self.is_failure(e):
+                self._on_failure()
+            else:
+                self._on_success()
+            raise
+        self._on_success()
+        return result
+
+    def retry_after(self):
+        """Seconds until the breaker will allow a trial call"""
+        if self.state != OPEN:
+            return 0
+        return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def stats(self):
+        return {
+            'state': self.state,
+            'consecutiveFailures': self.failures,
+            'retryAfter': round(self.retry_after(), 1)
+        }
@@ -0,0 +1,28 @@
+"""
+Gzip for large JSON responses
+
+Only used by routes whose payloads are big enough to be worth it; small
+responses are sent as-is.
+"""
+
+import gzip
+import os
+
+from flask import jsonify, request
+
+COMPRESS_MIN_BYTES = int(os.getenv('COMPRESS_MIN_BYTES', 1024))
+COMPRESS_LEVEL = int(os.getenv('COMPRESS_LEVEL', 5))
+
+def gzip_bytes(data):
+    return gzip.compress(data, compresslevel=COMPRESS_LEVEL, mtime=0)
+
+def compressed_jsonify(payload, status=200):
+    """jsonify(), gzipped when the client accepts it and the body is large"""
+    response = jsonify(payload)
+    response.status_code = status
+    response.vary.add('Accept-Encoding')
+    if 'gzip' not in request.accept_encodings or len(response.data) < COMPRESS_MIN_BYTES:
+        return response
+    response.set_data(gzip_bytes(response.get_data()))
+    response.headers['Content-Encoding'] = 'gzip'
+    return response
@@ -0,0 +1,134 @@
+"""
+IP prefix database as a memory-mapped binary radix trie
+
+``build()`` compiles (network, asn, isp, region) prefixes into one file;
+``IPTrie`` maps it read-only and walks it without parsing anything, so
+opening is near-instant, the pages are shared by every worker on the host, and
+a lookup is at most 32 (IPv4) or 128 (IPv6) array reads.
+
+File layout (little-endian uint32 unless noted):
+    magic 'IPTRIE01' | node count | record count | record bytes | reserved
+    nodes    3 per node: left child, right child, record + 1 (0 = none)
+             node 0 is the IPv4 root, node 1 the IPv6 root
+    offsets  record count + 1 offsets into the record bytes
+    records  UTF-8 'asn<TAB>isp<TAB>region' strings
+"""
+
+import ipaddress
+import mmap
+import os
+import socket
+import struct
+import sys
+from array import array
+from functools import lru_cache
+
+MAGIC = b'IPTRIE01'
+V4_MAPPED_PREFIX = b'\x00' * 10 + b'\xff\xff'
+HEADER = struct.Struct('<8s4I')
+
+def _uint32_array(values):
+    data = array('I', values)
+    if sys.byteorder == 'big':
+        data.byteswap()
+    return data
+
+def build(prefixes, path):
+    """Compile an iterable of (network, asn, isp, region) into a trie file"""
+    left, right, value = [0, 0], [0, 0], [0, 0]
+    records = {}
+
+    for network, asn, isp, region in prefixes:
+        network = ipaddress.ip_network(network, strict=False)
+        record = records.setdefault((str(asn or ''), isp or '', region or ''), len(records))
+        node = 0 if network.version == 4 else 1
+        address = int(network.network_address)
+        width = network.max_prefixlen
+        for i in range(network.prefixlen):
+            children = right if (address >> (width - 1 - i)) & 1 else left
+            if not children[node]:
+                children[node] = len(left)
+                left.append(0)
+                right.append(0)
+                value.append(0)
+            node = children[node]
+        value[node] = record + 1
+
+    nodes = array('I', bytes(4 * 3 * len(left)))
+    nodes[0::3] = array('I', left)
+    nodes[1::3] = array('I', right)
+    nodes[2::3] = array('I', value)
+    if sys.byteorder == 'big':
+        nodes.byteswap()
+
+    encoded = [f'{asn}\t{isp}\t{region}'.encode() for asn, isp, region in sorted(records, key=records.get)]
+    offsets = [0]
+    for data in encoded:
+        offsets.append(offsets[-1] + len(data))
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(left), len(encoded), offsets[-1], 0))
+        f.write(nodes.tobytes())
+        f.write(_uint32_array(offsets).tobytes())
+        f.write(b''.join(encoded))
+    os.replace(tmp_path, path)
+    return len(left), len(encoded)
+
+class IPTrie:
+    """Read-only view of a compiled trie file"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, node_count, record_count, record_bytes, _ = HEADER.unpack_from(self._mmap)
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not an IP trie file')
+        if sys.byteorder == 'big':
+            raise ValueError('IP trie files are little-endian')
+        view = memoryview(self._mmap)
+        start = HEADER.size
+        self.nodes = view[start:start + 12 * node_count].cast('I')
+        start += 12 * node_count
+        self.offsets = view[start:start + 4 * (record_count + 1)].cast('I')
+        start += 4 * (record_count + 1)
+        self.records = view[start:start + record_bytes]
+        self.node_count = node_count
+        self.record_count = record_count
+        self.record = lru_cache(maxsize=4096)(self._record)
+
+    def _record(self, index):
+        asn, isp, region = bytes(self.records[self.offsets[index]:self.offsets[index + 1]]).decode().split('\t')
+        record = {}
+        if asn:
+            record['asn'] = int(asn) if asn.isdigit() else asn
+        if isp:
+            record['isp'] = isp
+        if region:
+            record['region'] = region
+        return record
+
+    def lookup(self, ip):
+        """Longest-prefix match; returns {'asn', 'isp', 'region'} or None"""
+        # inet_pton is ~10x faster than ipaddress.ip_address
+        try:
+            packed = socket.inet_pton(socket.AF_INET, ip)
+        except (OSError, TypeError):
+            try:
+                packed = socket.inet_pton(socket.AF_INET6, ip)
+            except (OSError, TypeError):
+                return None
+            if packed[:12] == V4_MAPPED_PREFIX:
+                packed = packed[12:]
+        node, width = (0, 32) if len(packed) == 4 else (1, 128)
+        bits = int.from_bytes(packed, 'big')
+        nodes = self.nodes
+        best = nodes[3 * node + 2]
+        for shift in range(width - 1, -1, -1):
+            node = nodes[3 * node + ((bits >> shift) & 1)]
+            if not node:
+                break
+            if nodes[3 * node + 2]:
+                best = nodes[3 * node + 2]
+        # Copy so callers can't mutate the cached record
+        return dict(self.record(best - 1)) if best else None
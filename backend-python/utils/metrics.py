@@ -0,0 +1,31 @@
+"""
+In-process metrics registry
+
+Counters are per process; collectors are callables (e.g. ``cache.stats``)
+sampled when the metrics endpoint is read.
+"""
+
+import threading
+from collections import defaultdict
+
+_counters = defaultdict(int)
+_collectors = {}
+_lock = threading.Lock()
+
+def increment(name, amount=1):
+    """Increment a named counter"""
+    with _lock:
+        _counters[name] += amount
+
+def register(name, collector):
+    """Register a callable returning a dict of values to report under ``name``"""
+    _collectors[name] = collector
+
+def snapshot():
+    """Current counters and collector values"""
+    with _lock:
+        counters = dict(_counters)
+    return {
+        'counters': counters,
+        **{name: collector() for name, collector in _collectors.items()}
+    }
@@ -0,0 +1,168 @@
+"""
+Payload validation helpers
+
+- ``BoundedDict``: a marshmallow Dict field that rejects payloads nested too
+  deeply or containing too many elements.
+- ``SampleArrays``: named arrays of non-negative numbers (null allowed),
+  deserialized straight to float64 NumPy arrays.
+- ``FastLoader``: a loader compiled once from a schema that validates the
+  common case (flat fields of known types) with plain type checks. Anything
+  it cannot accept is handed to ``schema.load`` so error messages always come
+  from marshmallow itself.
+"""
+
+import numpy as np
+from marshmallow import ValidationError, fields, validate
+from marshmallow.utils import missing
+
+MAX_DEPTH = 12
+MAX_NODES = 20000
+
+def measure(value, max_depth=MAX_DEPTH, max_nodes=MAX_NODES):
+    """Walk a JSON-like value; return 'too_deep', 'too_large' or None.
+
+    Stops as soon as a limit is crossed, so hostile payloads cost at most
+    ``max_nodes`` steps.
+    """
+    level = [value]
+    depth = 1
+    nodes = 0
+    while level:
+        if depth > max_depth:
+            return 'too_deep'
+        next_level = []
+        for current in level:
+            children = current.values() if type(current) is dict else current
+            nodes += len(children)
+            if nodes > max_nodes:
+                return 'too_large'
+            next_level.extend([child for child in children if type(child) is dict or type(child) is list])
+        level = next_level
+        depth += 1
+    return None
+
+class BoundedDict(fields.Dict):
+    """Dict field with depth and element-count limits"""
+
+    default_error_messages = {
+        'too_deep': 'Nested too deeply (max depth {max_depth}).',
+        'too_large': 'Too many elements (max {max_nodes}).'
+    }
+
+    def __init__(self, *args, max_depth=MAX_DEPTH, max_nodes=MAX_NODES, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_depth = max_depth
+        self.max_nodes = max_nodes
+
+    def _deserialize(self, value, attr, data, **kwargs):
+        if isinstance(value, dict):
+            problem = measure(value, self.max_depth, self.max_nodes)
+            if problem:
+                raise self.make_error(problem, max_depth=self.max_depth, max_nodes=self.max_nodes)
+        return super()._deserialize(value, attr, data, **kwargs)
+
+class SampleArrays(fields.Field):
+    """Dict of named sample arrays, loaded as float64 arrays (null -> NaN)"""
+
+    default_error_messages = {
+        'invalid': 'Must be an object of sample arrays.',
+        'unknown_name': 'Unknown sample array {name!r} (allowed: {names}).',
+        'too_long': 'Sample array {name!r} has more than {max_length} values.',
+        'invalid_value': 'Sample array {name!r} must contain non-negative numbers or null.'
+    }
+
+    def __init__(self, names, *args, max_length=5000, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.names = tuple(names)
+        self.max_length = max_length
+
+    def _deserialize(self, value, attr, data, **kwargs):
+        if not isinstance(value, dict):
+            raise self.make_error('invalid')
+        arrays = {}
+        for name, samples in value.items():
+            if name not in self.names:
+                raise self.make_error('unknown_name', name=name, names=', '.join(self.names))
+            if not isinstance(samples, list):
+                raise self.make_error('invalid_value', name=name)
+            if len(samples) > self.max_length:
+                raise self.make_error('too_long', name=name, max_length=self.max_length)
+            # type() rather than isinstance() so booleans are rejected
+            if not all(type(v) is float or type(v) is int or v is None for v in samples):
+                raise self.make_error('invalid_value', name=name)
+            array = np.array(samples, dtype=np.float64)
+            if np.any(array < 0) or np.any(np.isinf(array)):
+                raise self.make_error('invalid_value', name=name)
+            arrays[name] = array
+        return arrays
+
+class FastLoader:
+    """Schema loader with a plain-Python fast path for well-formed payloads"""
+
+    def __init__(self, schema):
+        self.schema = schema
+        self.plan = []
+        # Schema-level hooks (pre_load, validates_schema, ...) need marshmallow
+        self.supported = not any(schema._hooks.values())
+        for name, field in schema.load_fields.items():
+            if field.data_key not in (None, name) or field.load_default is not missing:
+                self.supported = False
+            if isinstance(field, BoundedDict):
+                kind = ('bounded', field.max_depth, field.max_nodes)
+            elif type(field) is fields.Dict:
+                kind = ('dict',)
+            elif type(field) is fields.String:
+                kind = ('str',)
+            elif isinstance(field, SampleArrays):
+                kind = ('field', field)
+            else:
+                self.supported = False
+                kind = None
+            choices = None
+            for validator in field.validators:
+                if isinstance(validator, validate.OneOf):
+                    choices = frozenset(validator.choices)
+                else:
+                    self.supported = False
+            self.plan.append((name, kind, field.required, field.allow_none, choices))
+        self.names = frozenset(name for name, *_ in self.plan)
+
+    def load(self, data):
+        """Validate ``data``; raises marshmallow.ValidationError on failure"""
+        result = self._fast_load(data) if self.supported else None
+        if result is None:
+            return self.schema.load(data)
+        return result
+
+    def _fast_load(self, data):
+        """Return the loaded dict, or None to defer to marshmallow"""
+        if type(data) is not dict or not self.names.issuperset(data):
+            return None
+        result = {}
+        for name, kind, required, allow_none, choices in self.plan:
+            if name not in data:
+                if required:
+                    return None
+                continue
+            value = data[name]
+            if value is None:
+                if not allow_none:
+                    return None
+                result[name] = None
+                continue
+            if kind[0] == 'str':
+                if type(value) is not str or (choices is not None and value not in choices):
+                    return None
+            elif kind[0] == 'field':
+                try:
+                    value = kind[1].deserialize(value, name, data)
+                except ValidationError:
+                    return None
+            else:
+                if type(value) is not dict:
+                    return None
+                if kind[0] == 'bounded' and measure(value, kind[1], kind[2]):
+                    return None
+                value = dict(value)
+            result[name] = value
+        return result
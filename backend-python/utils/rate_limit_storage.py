@@ -0,0 +1,223 @@
+"""
+Shared-memory rate limit storage
+
+A `limits` storage backend (scheme ``shm://``) that keeps sliding-window
+counters in an mmap'd table so every worker process on the host enforces the
+same budget. Importing this module registers the scheme with Flask-Limiter.
+
+Layout: a fixed header followed by ``buckets`` rows. Each row holds one group
+of ``ways`` cells per worker, and a worker only ever writes its own cells, so
+increments need no locks. Readers sum the cells of all workers in the row.
+
+Each cell stores the key fingerprint, the window number, the count for that
+window and the count for the previous one. The estimate returned to the
+limiter is the sliding-window-counter approximation::
+
+    previous * (1 - elapsed_fraction) + current
+
+which lets the stock ``fixed-window`` strategy behave as a sliding window.
+"""
+
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import time
+from urllib.parse import urlparse, parse_qs
+
+from limits.storage import Storage
+
+MAGIC = b'IPGRL001'
+HEADER = struct.Struct('<8sIII4x')        # magic, buckets, workers, ways
+PID_SLOT = struct.Struct('<Q')
+CELL = struct.Struct('<QqIIi4x')          # fingerprint, window, current, previous, window length
+
+DEFAULT_BUCKETS = 8192
+DEFAULT_WORKERS = 16
+DEFAULT_WAYS = 2
+
+def default_path():
+    """Prefer /dev/shm (RAM-backed) and fall back to the temp dir (e.g. Lambda /tmp)"""
+    base = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(base, 'ipgrok-ratelimit')
+
+def _fingerprint(key):
+    return struct.unpack('<Q', hashlib.blake2b(key.encode(), digest_size=8).digest())[0] or 1
+
+def _pid_alive(pid):
+    if pid <= 0:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+class SharedMemoryStorage(Storage):
+    """Cross-process sliding-window counters backed by an mmap'd file
+
+    URI format: ``shm://[/path/to/file][?buckets=8192&workers=16&ways=2]``
+    """
+
+    STORAGE_SCHEME = ['shm']
+
+    def __init__(self, uri=None, wrap_exceptions=False, **options):
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        parsed = urlparse(uri or 'shm://')
+        query = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+        self.path = (parsed.netloc + parsed.path) or default_path()
+        self.buckets = int(query.get('buckets', options.get('buckets', DEFAULT_BUCKETS)))
+        self.workers = int(query.get('workers', options.get('workers', DEFAULT_WORKERS)))
+        self.ways = int(query.get('ways', options.get('ways', DEFAULT_WAYS)))
+
+        self._cells_offset = HEADER.size + PID_SLOT.size * self.workers
+        self._row_size = CELL.size * self.ways * self.workers
+        self._size = self._cells_offset + self._row_size * self.buckets
+        self._pid = None
+        self._map = None
+        self._worker = 0
+
+    @property
+    def base_exceptions(self):
+        return (OSError, ValueError, struct.error)
+
+    # -- process attachment -------------------------------------------------
+
+    def _attach(self):
+        """Map the table and claim a worker slot (once per process, fork-safe)"""
+        pid = os.getpid()
+        if self._pid == pid:
+            return self._map
+
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                if os.fstat(fd).st_size != self._size:
+                    os.ftruncate(fd, 0)
+                    os.ftruncate(fd, self._size)
+                table = mmap.mmap(fd, self._size)
+                magic, buckets, workers, ways = HEADER.unpack_from(table, 0)
+                if (magic, buckets, workers, ways) != (MAGIC, self.buckets, self.workers, self.ways):
+                    table[:] = bytes(self._size)
+                    HEADER.pack_into(table, 0, MAGIC, self.buckets, self.workers, self.ways)
+                self._worker = self._claim_worker(table, pid)
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+
+        self._map = table
+        self._pid = pid
+        return table
+
+    def _claim_worker(self, table, pid):
+        slots = [PID_SLOT.unpack_from(table, HEADER.size + i * PID_SLOT.size)[0] for i in range(self.workers)]
+        if pid in slots:
+            return slots.index(pid)
+        for index, owner in enumerate(slots):
+            if not _pid_alive(owner):
+                PID_SLOT.pack_into(table, HEADER.size + index * PID_SLOT.size, pid)
+                return index
+        # More processes than slots: share one. Counts stay approximately right.
+        return pid % self.workers
+
+    # -- cell access ----------------------------------------------------------
+
+    def _row(self, fingerprint):
+        return self._cells_offset + (fingerprint % self.buckets) * self._row_size
+
+    def _own_cell(self, table, row, fingerprint, window):
+        """Find this worker's cell for the key, evicting the stalest way if needed"""
+        base = row + self._worker * self.ways * CELL.size
+        victim, victim_window = base, None
+        for way in range(self.ways):
+            offset = base + way * CELL.size
+            cell = CELL.unpack_from(table, offset)
+            if cell[0] == fingerprint:
+                return offset, cell
+            if victim_window is None or cell[1] < victim_window:
+                victim, victim_window = offset, cell[1]
+        return victim, (fingerprint, window, 0, 0, 0)
+
+    def _totals(self, table, fingerprint, now):
+        """Sum current/previous counts across all workers for the key"""
+        row = self._row(fingerprint)
+        current = previous = 0
+        window_length = 0
+        for cell_fp, window, cur, prev, length in CELL.iter_unpack(table[row:row + self._row_size]):
+            if cell_fp != fingerprint or not length:
+                continue
+            window_length = length
+            now_window = int(now // length)
+            if window == now_window:
+                current += cur
+                previous += prev
+            elif window == now_window - 1:
+                previous += cur
+        return current, previous, window_length
+
+    @staticmethod
+    def _estimate(current, previous, window_length, now):
+        if not window_length:
+            return 0
+        elapsed = (now % window_length) / window_length
+        return int(previous * (1 - elapsed) + current)
+
+    # -- Storage API ----------------------------------------------------------
+
+    def incr(self, key, expiry, elastic_expiry=False, amount=1):
+        table = self._attach()
+        now = time.time()
+        length = max(1, int(expiry))
+        window = int(now // length)
+        fingerprint = _fingerprint(key)
+
+        offset, (cell_fp, cell_window, current, previous, _) = self._own_cell(
+            table, self._row(fingerprint), fingerprint, window
+        )
+        if cell_fp != fingerprint or cell_window < window - 1:
+            current, previous = 0, 0
+        elif cell_window == window - 1:
+            current, previous = 0, current
+        CELL.pack_into(table, offset, fingerprint, window, current + amount, previous, length)
+
+        return self._estimate(*self._totals(table, fingerprint, now), now)
+
+    def get(self, key):
+        table = self._attach()
+        now = time.time()
+        return self._estimate(*self._totals(table, _fingerprint(key), now), now)
+
+    def get_expiry(self, key):
+        table = self._attach()
+        now = time.time()
+        _, _, window_length = self._totals(table, _fingerprint(key), now)
+        if not window_length:
+            return now
+        return (int(now // window_length) + 1) * window_length
+
+    def clear(self, key):
+        table = self._attach()
+        fingerprint = _fingerprint(key)
+        row = self._row(fingerprint)
+        for index in range(self.ways * self.workers):
+            offset = row + index * CELL.size
+            if CELL.unpack_from(table, offset)[0] == fingerprint:
+                CELL.pack_into(table, offset, 0, 0, 0, 0, 0)
+
+    def check(self):
+        try:
+            self._attach()
+            return True
+        except OSError:
+            return False
+
+    def reset(self):
+        table = self._attach()
+        table[self._cells_offset:] = bytes(self._size - self._cells_offset)
+        return None
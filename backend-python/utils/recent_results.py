@@ -0,0 +1,191 @@
+"""
+Per-user cache of the newest test results
+
+Each user gets a small newest-first buffer holding up to ``per_user`` results.
+Buffers are filled from a UserIdIndex query, kept current by write-through on
+save, and dropped when one of the user's results is deleted. Users are evicted
+least-recently-used first once the buffers' total size (measured as
+serialized JSON) passes ``max_bytes``.
+
+A fill that raced with a write for the same user is discarded, so a query
+that started before a save can't hide it.
+
+Writes made by other workers are seen through ``versions``, per-user
+counters shared by every process on the host (``SharedCounters``). Each
+save or delete increments the user's counter, and an entry is only served
+while the counter still has the value it was filled (or written through)
+at. Entries also expire after ``ttl`` seconds.
+"""
+
+import json
+import threading
+import time
+from collections import OrderedDict
+
+def _order(item):
+    return (item.get('timestamp') or '', item.get('testId') or '')
+
+def _size(item):
+    return len(json.dumps(item, default=str, separators=(',', ':')))
+
+class _Entry:
+    __slots__ = ('items', 'sizes', 'bytes', 'complete', 'expires_at', 'version')
+
+    def __init__(self, complete, expires_at, version):
+        self.items = []
+        self.sizes = {}
+        self.bytes = 0
+        self.complete = complete        # the user has no results beyond these
+        self.expires_at = expires_at
+        self.version = version          # the user's shared write version it reflects
+
+class RecentResultsCache:
+    """Bounded, LRU-evicted newest-N results per user"""
+
+    # How many users' last-write sequence numbers to remember
+    WRITE_LOG_SIZE = 8192
+
+    def __init__(self, per_user=50, max_bytes=32 * 1024 * 1024, ttl=60.0, versions=None):
+        self.per_user = per_user
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.versions = versions
+        self._users = OrderedDict()
+        self._owners = {}               # testId -> userId for cached results
+        self._bytes = 0
+        self._seq = 0
+        self._writes = OrderedDict()    # userId -> seq of the last write
+        self._write_floor = 0           # highest seq dropped from _writes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, user_id, limit):
+        """The user's newest ``limit`` results, or None if not cached"""
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is not None and (entry.expires_at <= time.time() or entry.version != self._version(user_id)):
+                self._drop(user_id)
+                entry = None
+            if entry is None or (limit > len(entry.items) and not entry.complete):
+                self.misses += 1
+                return None
+            self._users.move_to_end(user_id)
+            self.hits += 1
+            return entry.items[:limit]
+
+    def begin(self, user_id):
+        """Ticket to pass to fill(); taken before the query starts"""
+        with self._lock:
+            return self._seq, self._version(user_id)
+
+    def fill(self, user_id, items, complete, ticket):
+        """Cache a newest-first query result unless the user wrote since ``ticket``"""
+        seq, version = ticket
+        if not self.per_user:
+            return False
+        with self._lock:
+            if max(self._writes.get(user_id, 0), self._write_floor) > seq or self._version(user_id) != version:
+                return False
+            self._drop(user_id)
+            entry = _Entry(complete and len(items) <= self.per_user, time.time() + self.ttl, version)
+            self._users[user_id] = entry
+            for item in items[:self.per_user]:
+                self._insert(user_id, entry, item)
+            self._evict()
+            return True
+
+    def add(self, item):
+        """Write-through for a saved result"""
+        user_id = item.get('userId')
+        with self._lock:
+            before, after = self._written(user_id)
+            entry = self._users.get(user_id)
+            if entry is None:
+                return
+            if self.versions is not None and (entry.version != before or after != before + 1
+                                              or self.versions.shared_cell):
+                # Another process wrote too; this entry can't be patched to match
+                self._drop(user_id)
+                return
+            entry.version = after
+            self._insert(user_id, entry, item)
+            if len(entry.items) > self.per_user:
+                self._remove(entry, entry.items[-1])
+                entry.complete = False
+            self._evict()
+
+    def invalidate(self, user_id=None, test_id=None):
+        """Forget a user's results (found from a cached testId if no user is given)"""
+        with self._lock:
+            user_id = user_id if user_id is not None else self._owners.get(test_id)
+            if user_id is None:
+                return
+            self._written(user_id)
+            self._drop(user_id)
+
+    def _written(self, user_id):
+        """Record a write; returns the user's shared version (before, after)"""
+        self._seq += 1
+        self._writes[user_id] = self._seq
+        self._writes.move_to_end(user_id)
+        while len(self._writes) > self.WRITE_LOG_SIZE:
+            _, seq = self._writes.popitem(last=False)
+            self._write_floor = max(self._write_floor, seq)
+        if self.versions is None:
+            return None, None
+        return self.versions.increment(str(user_id))
+
+    def _version(self, user_id):
+        return None if self.versions is None else self.versions.value(str(user_id))
+
+    def _insert(self, user_id, entry, item):
+        test_id = item.get('testId')
+        if test_id in entry.sizes:
+            self._remove(entry, next(i for i in entry.items if i.get('testId') == test_id))
+        size = _size(item)
+        entry.items.append(item)
+        entry.items.sort(key=_order, reverse=True)
+        entry.sizes[test_id] = size
+        entry.bytes += size
+        self._bytes += size
+        self._owners[test_id] = user_id
+
+    def _remove(self, entry, item):
+        test_id = item.get('testId')
+        entry.items.remove(item)
+        size = entry.sizes.pop(test_id)
+        entry.bytes -= size
+        self._bytes -= size
+        self._owners.pop(test_id, None)
+
+    def _drop(self, user_id):
+        entry = self._users.pop(user_id, None)
+        if entry is not None:
+            self._bytes -= entry.bytes
+            for test_id in entry.sizes:
+                self._owners.pop(test_id, None)
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and self._users:
+            self._drop(next(iter(self._users)))
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            for user_id in list(self._users):
+                self._drop(user_id)
+
+    def stats(self):
+        """Counters for the metrics endpoint"""
+        lookups = self.hits + self.misses
+        return {
+            'users': len(self._users),
+            'bytes': self._bytes,
+            'maxBytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hitRate': round(self.hits / lookups, 4) if lookups else 0
+        }
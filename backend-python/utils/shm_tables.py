@@ -0,0 +1,213 @@
+"""
+Shared-memory tables for state every worker on the host must see
+
+Like the rate limit storage, each table is an mmap'd file (in /dev/shm by
+default) with a fixed header, created or reset under ``flock`` by whichever
+process attaches first.
+
+``SharedRecordTable`` keeps small JSON records with an expiry in
+set-associative slots. Writers never lock: each record carries a checksum
+of its key and payload, and a reader that catches a slot mid-write sees a
+mismatch and treats the record as missing. Colliding keys overwrite the
+stalest way of their set, so a record can be lost early under pressure,
+never returned for the wrong key.
+
+``SharedCounters`` keeps monotonic per-key counters, e.g. a user's write
+version. As in the rate limit table, a key hashes to a row with one cell per
+worker, each worker only increments its own cell, and a counter's value is
+the sum of its row. Keys that share a row share a counter, which only makes
+it change more often.
+"""
+
+import fcntl
+import hashlib
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+import zlib
+
+from utils.cache import LRUCache
+from utils.rate_limit_storage import _pid_alive
+
+RECORDS_MAGIC = b'IPGRT001'
+RECORDS_HEADER = struct.Struct('<8sIII4x')    # magic, sets, ways, slot bytes
+SLOT = struct.Struct('<16sdII')               # key digest, expires at, payload length, crc32
+
+COUNTERS_MAGIC = b'IPGRC001'
+COUNTERS_HEADER = struct.Struct('<8sII')      # magic, rows, workers
+PID_SLOT = struct.Struct('<Q')
+COUNTER = struct.Struct('<Q')
+
+def shm_path(name, temp_fallback=False):
+    """``name`` in /dev/shm; without it, in the temp dir or None"""
+    if os.path.isdir('/dev/shm'):
+        return os.path.join('/dev/shm', name)
+    return os.path.join(tempfile.gettempdir(), name) if temp_fallback else None
+
+def _map_file(path, size, header, fields, attach=None):
+    """mmap ``path`` at ``size`` bytes, zeroing it unless its header matches ``fields``
+
+    ``attach(table)`` runs while the file is still locked.
+    """
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(fd).st_size != size:
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, size)
+            table = mmap.mmap(fd, size)
+            if header.unpack_from(table, 0) != fields:
+                table[:] = bytes(size)
+                header.pack_into(table, 0, *fields)
+            if attach is not None:
+                attach(table)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
+    return table
+
+class SharedRecordTable:
+    """Expiring JSON records shared by all processes that map ``path``"""
+
+    def __init__(self, path, sets=1024, ways=4, slot_bytes=512):
+        self.path = path
+        self.sets = sets
+        self.ways = ways
+        self.slot_bytes = slot_bytes
+        self._size = RECORDS_HEADER.size + sets * ways * slot_bytes
+        self._map = None
+
+    def _table(self):
+        # MAP_SHARED mappings stay shared across fork, so one attach is enough
+        if self._map is None:
+            self._map = _map_file(self.path, self._size, RECORDS_HEADER,
+                                  (RECORDS_MAGIC, self.sets, self.ways, self.slot_bytes))
+        return self._map
+
+    def _slots(self, digest):
+        first = int.from_bytes(digest[:8], 'little') % self.sets * self.ways
+        return [RECORDS_HEADER.size + (first + way) * self.slot_bytes for way in range(self.ways)]
+
+    def set(self, key, value, ttl):
+        """Store ``value`` (JSON-serializable) under ``key`` for ``ttl`` seconds"""
+        payload = json.dumps(value, separators=(',', ':')).encode()
+        if SLOT.size + len(payload) > self.slot_bytes:
+            raise ValueError(f'Record is {len(payload)} bytes (max {self.slot_bytes - SLOT.size})')
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        table = self._table()
+        now = time.time()
+        victim, victim_expires = None, None
+        for offset in self._slots(digest):
+            slot_digest, expires_at, _, _ = SLOT.unpack_from(table, offset)
+            if slot_digest == digest or expires_at <= now:
+                victim = offset
+                break
+            if victim is None or expires_at < victim_expires:
+                victim, victim_expires = offset, expires_at
+        record = SLOT.pack(digest, now + ttl, len(payload), zlib.crc32(digest + payload)) + payload
+        table[victim:victim + len(record)] = record
+
+    def get(self, key):
+        """The stored value, or None if missing, expired or caught mid-write"""
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        table = self._table()
+        for offset in self._slots(digest):
+            slot_digest, expires_at, length, crc = SLOT.unpack_from(table, offset)
+            if slot_digest != digest:
+                continue
+            if expires_at <= time.time() or SLOT.size + length > self.slot_bytes:
+                return None
+            payload = table[offset + SLOT.size:offset + SLOT.size + length]
+            if zlib.crc32(digest + payload) != crc:
+                return None
+            return json.loads(payload)
+        return None
+
+class LocalRecordTable:
+    """SharedRecordTable's interface over a per-process LRU (no /dev/shm)"""
+
+    def __init__(self, max_size=4096):
+        self._cache = LRUCache(max_size=max_size)
+
+    def set(self, key, value, ttl):
+        self._cache.set(key, value, ttl=ttl)
+
+    def get(self, key):
+        return self._cache.get(key)
+
+class SharedCounters:
+    """Monotonic per-key counters shared by all processes that map ``path``"""
+
+    def __init__(self, path, rows=16384, workers=16):
+        self.path = path
+        self.rows = rows
+        self.workers = workers
+        self._cells_offset = COUNTERS_HEADER.size + PID_SLOT.size * workers
+        self._row = struct.Struct(f'<{workers}Q')
+        self._size = self._cells_offset + rows * self._row.size
+        self._map = None
+        self._pid = None
+        self._worker = 0
+        self._lock = threading.Lock()
+        os.register_at_fork(after_in_child=self._reset_lock)
+        # True when more processes than cells: increments may then race
+        self.shared_cell = False
+
+    def _reset_lock(self):
+        self._lock = threading.Lock()
+
+    def _attach(self):
+        """Map the table and claim a worker cell (once per process, fork-safe)"""
+        pid = os.getpid()
+        if self._pid != pid:
+            with self._lock:
+                if self._pid != pid:
+                    self._map = _map_file(self.path, self._size, COUNTERS_HEADER,
+                                          (COUNTERS_MAGIC, self.rows, self.workers), self._claim_worker)
+                    self._pid = pid
+        return self._map
+
+    def _claim_worker(self, table):
+        pid = os.getpid()
+        offsets = [COUNTERS_HEADER.size + i * PID_SLOT.size for i in range(self.workers)]
+        owners = [PID_SLOT.unpack_from(table, offset)[0] for offset in offsets]
+        self.shared_cell = False
+        if pid in owners:
+            self._worker = owners.index(pid)
+            return
+        for index, owner in enumerate(owners):
+            if not _pid_alive(owner):
+                # The dead owner's counts stay in the cell, so sums never go back
+                PID_SLOT.pack_into(table, offsets[index], pid)
+                self._worker = index
+                return
+        self._worker = pid % self.workers
+        self.shared_cell = True
+
+    def _row_offset(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=8).digest()
+        return self._cells_offset + int.from_bytes(digest, 'little') % self.rows * self._row.size
+
+    def value(self, key):
+        table = self._attach()
+        return sum(self._row.unpack_from(table, self._row_offset(key)))
+
+    def increment(self, key):
+        """Add one to ``key``'s counter; returns its (before, after) values
+
+        ``after == before + 1`` means no other process changed it meanwhile.
+        """
+        table = self._attach()
+        offset = self._row_offset(key)
+        cell = offset + self._worker * COUNTER.size
+        with self._lock:
+            before = sum(self._row.unpack_from(table, offset))
+            COUNTER.pack_into(table, cell, COUNTER.unpack_from(table, cell)[0] + 1)
+            after = sum(self._row.unpack_from(table, offset))
+        return before, after
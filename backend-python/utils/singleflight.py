@@ -0,0 +1,119 @@
+"""
+Request coalescing (singleflight)
+
+Concurrent callers asking for the same key share one in-flight computation:
+the first caller runs it, the rest wait for its result. Coalescing is per
+process, so it helps threaded workers (gthread, the dev server) where
+identical dashboard requests overlap. ``do_async()`` does the same for
+coroutines on the process's event loop (the ASGI app), without threads.
+"""
+
+import asyncio
+import threading
+
+from utils import metrics
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+class _AsyncCall:
+    def __init__(self):
+        self.done = asyncio.Event()
+        self.finished = False
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+class SingleFlight:
+    """Deduplicate concurrent calls by key"""
+
+    def __init__(self, name, timeout=None):
+        self.name = name
+        self.timeout = timeout
+        self._calls = {}
+        self._async_calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, timeout=None):
+        """Return fn()'s result, sharing it with concurrent callers of the same key.
+
+        Followers wait at most ``timeout`` seconds for the leader; after that
+        they run fn() themselves rather than fail.
+        """
+        timeout = timeout if timeout is not None else self.timeout
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.waiters += 1
+
+        if leader:
+            metrics.increment(f'{self.name}.executed')
+            try:
+                call.result = fn()
+            except Exception as e:
+                call.error = e
+                raise
+            finally:
+                with self._lock:
+                    self._calls.pop(key, None)
+                call.done.set()
+            return call.result
+
+        if not call.done.wait(timeout):
+            metrics.increment(f'{self.name}.timeouts')
+            return fn()
+        metrics.increment(f'{self.name}.coalesced')
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    async def do_async(self, key, fn, timeout=None):
+        """do() for a coroutine function: concurrent awaits of a key share one fn()
+
+        Only callers on the same event loop are coalesced, and none of them
+        holds a thread while waiting.
+        """
+        timeout = timeout if timeout is not None else self.timeout
+        call = self._async_calls.get(key)
+        if call is None:
+            call = self._async_calls[key] = _AsyncCall()
+            metrics.increment(f'{self.name}.executed')
+            try:
+                call.result = await fn()
+                call.finished = True
+            except Exception as e:
+                call.error = e
+                call.finished = True
+                raise
+            finally:
+                # Also when the leader is cancelled; followers then run fn() themselves
+                self._async_calls.pop(key, None)
+                call.done.set()
+            return call.result
+
+        call.waiters += 1
+        try:
+            await asyncio.wait_for(call.done.wait(), timeout)
+        except asyncio.TimeoutError:
+            metrics.increment(f'{self.name}.timeouts')
+            return await fn()
+        if not call.finished:
+            return await fn()
+        metrics.increment(f'{self.name}.coalesced')
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def in_flight(self):
+        """Keys currently being computed and how many callers wait on each"""
+        with self._lock:
+            calls = {repr(key): call.waiters for key, call in self._calls.items()}
+        calls.update((repr(key), call.waiters) for key, call in list(self._async_calls.items()))
+        return calls
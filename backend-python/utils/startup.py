@@ -0,0 +1,114 @@
+"""
+Server startup checks and connection warm-up
+
+Used by gunicorn.conf.py. ``self_check()`` runs once in the master before it
+binds the port: it fails the launch if a table (or the test type index that
+reads are configured for) is missing or credentials are wrong, and times
+sample requests to measure how much of a request is spent waiting on
+DynamoDB, which sizes the worker thread pool. ``warm_connections()``
+runs in every worker before it accepts traffic, so first requests don't pay
+for TCP/TLS setup.
+"""
+
+import logging
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import config.dynamodb as db
+from extensions import limiter
+from models.test_result import SHARDED_TEST_TYPE_READS
+
+logger = logging.getLogger(__name__)
+
+# Requests timed to measure I/O wait (after one untimed warm-up request)
+SAMPLE_PATH = '/api/test-results/recent?limit=20'
+SAMPLE_REQUESTS = 10
+
+# Key that is never written; a GetItem for it costs half a read unit
+WARMUP_KEY = {'metricId': '__warmup__', 'date': '-'}
+
+def check_tables():
+    """Raise RuntimeError unless every table exists and is usable"""
+    if db.dynamodb is None:
+        db.init_dynamodb()
+    for table_name in db.TABLES.values():
+        try:
+            table = db.dynamodb.describe_table(TableName=table_name)['Table']
+        except db.dynamodb.exceptions.ResourceNotFoundException:
+            raise RuntimeError(f'Table {table_name} does not exist (run python setup.py)')
+        if table['TableStatus'] not in ('ACTIVE', 'UPDATING'):
+            raise RuntimeError(f'Table {table_name} is {table["TableStatus"]}')
+        if table_name == db.TABLES['TEST_RESULTS']:
+            check_type_index(table)
+
+def check_type_index(table):
+    """Raise RuntimeError unless the test type index that reads use exists"""
+    indexes = {index['IndexName'] for index in table.get('GlobalSecondaryIndexes', [])}
+    if SHARDED_TEST_TYPE_READS == 'true' and db.TEST_TYPE_SHARD_INDEX not in indexes:
+        raise RuntimeError(f'{db.TEST_TYPE_SHARD_INDEX} does not exist; run '
+                           'scripts/migrate_test_type_shards.py --create-index --backfill first, '
+                           'or set SHARDED_TEST_TYPE_READS=auto')
+    if SHARDED_TEST_TYPE_READS == 'false' and db.TEST_TYPE_INDEX not in indexes:
+        raise RuntimeError(f'{db.TEST_TYPE_INDEX} does not exist; set SHARDED_TEST_TYPE_READS=auto '
+                           f'to read {db.TEST_TYPE_SHARD_INDEX}')
+    if not indexes & {db.TEST_TYPE_INDEX, db.TEST_TYPE_SHARD_INDEX}:
+        raise RuntimeError(f'Neither {db.TEST_TYPE_INDEX} nor {db.TEST_TYPE_SHARD_INDEX} exists '
+                           '(run scripts/migrate_test_type_shards.py --create-index --backfill)')
+
+def measure_io_wait(app, path=SAMPLE_PATH, samples=SAMPLE_REQUESTS):
+    """Ratio of time waiting (wall - CPU) to CPU time over sample requests"""
+    client = app.test_client()
+    # Don't count these against a client or claim a rate limit slot in the master
+    enabled, limiter.enabled = limiter.enabled, False
+    try:
+        waited = busy = 0.0
+        for sample in range(samples + 1):
+            started, started_cpu = time.perf_counter(), time.thread_time()
+            response = client.get(path, headers={'X-Request-ID': f'self-check-{sample}'})
+            wall, cpu = time.perf_counter() - started, time.thread_time() - started_cpu
+            if response.status_code != 200:
+                raise RuntimeError(f'GET {path} returned {response.status_code}: {response.get_data(as_text=True)}')
+            if sample:  # the first request also pays for connection setup
+                waited += max(0.0, wall - cpu)
+                busy += cpu
+    finally:
+        limiter.enabled = enabled
+    return waited / max(busy, 1e-6)
+
+def threads_for(io_wait_ratio, max_threads):
+    """Threads that keep one core busy: 1 + wait/compute"""
+    return max(2, min(max_threads, math.ceil(1 + io_wait_ratio)))
+
+def self_check(app):
+    """Verify storage and return the measured I/O wait ratio"""
+    started = time.perf_counter()
+    check_tables()
+    ratio = measure_io_wait(app)
+    logger.info('Self-check passed in %.0f ms (I/O wait ratio %.1f)',
+                (time.perf_counter() - started) * 1000, ratio, extra={'ioWaitRatio': round(ratio, 2)})
+    return ratio
+
+def warm_connections(count):
+    """Open ``count`` pooled connections to DynamoDB with concurrent reads"""
+    if db.dynamodb_resource is None:
+        db.init_dynamodb()
+    client = db.dynamodb_resource.meta.client
+    table_name = db.TABLES['ANALYTICS']
+    # Start the reads together so each one needs its own connection
+    barrier = threading.Barrier(count)
+
+    def read(_):
+        try:
+            barrier.wait(timeout=5)
+        except threading.BrokenBarrierError:
+            pass
+        client.get_item(TableName=table_name, Key=WARMUP_KEY)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=count, thread_name_prefix='warmup') as pool:
+        list(pool.map(read, range(count)))
+    # Attach to the shared rate limit table now rather than on the first request
+    limiter.storage.check()
+    logger.info('Warmed %d DynamoDB connections in %.0f ms', count, (time.perf_counter() - started) * 1000)
@@ -0,0 +1,161 @@
+"""
+Structured, non-blocking logging
+
+Records are put on a bounded in-memory queue by the request thread and
+formatted as one JSON object per line by a background QueueListener, so a
+slow stdout (or CloudWatch pipe) never blocks a request. Messages use
+%-style arguments and are only formatted on the listener thread, and only
+if the record is kept (so pass values, not objects that change afterwards).
+
+Every record carries the current request's correlation ID (see
+``correlation_id``). Records at sampled levels (LOG_SAMPLE_DEBUG,
+LOG_SAMPLE_INFO) are kept or dropped per request, hashed on the
+correlation ID, so a kept request has all of its records. Records logged
+outside a request are never sampled, and WARNING and above are always kept.
+"""
+
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import re
+import sys
+import time
+import zlib
+
+from utils import metrics
+from utils.ulid import new_ulid
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'info').upper()
+LOG_ASYNC = os.getenv('LOG_ASYNC', 'true').lower() == 'true'
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000))
+SAMPLE_RATES = {
+    logging.DEBUG: float(os.getenv('LOG_SAMPLE_DEBUG', 1.0)),
+    logging.INFO: float(os.getenv('LOG_SAMPLE_INFO', 1.0))
+}
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+_VALID_REQUEST_ID = re.compile(r'^[A-Za-z0-9._:-]{1,128}$')
+
+correlation_id = contextvars.ContextVar('correlation_id', default=None)
+
+# Attributes every LogRecord has; anything else was passed via ``extra``
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+_handler = None
+_listener = None
+
+def request_id_from(header_value):
+    """The client's request ID if it is well formed, otherwise a new one"""
+    if header_value and _VALID_REQUEST_ID.match(header_value):
+        return header_value
+    return new_ulid()
+
+class ContextFilter(logging.Filter):
+    """Stamp the correlation ID and apply per-request sampling
+
+    Runs on the calling thread, where the request's context is visible.
+    """
+
+    def filter(self, record):
+        request_id = correlation_id.get()
+        record.correlationId = request_id
+        rate = SAMPLE_RATES.get(record.levelno, 1.0)
+        if rate >= 1.0 or request_id is None:
+            return True
+        if zlib.crc32(request_id.encode()) < rate * 0x100000000:
+            record.sampleRate = rate
+            return True
+        metrics.increment('logging.sampledOut')
+        return False
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record; ``extra`` fields are included as keys"""
+
+    def format(self, record):
+        entry = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f'.{int(record.msecs):03d}Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage()
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and value is not None:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops (and counts) records when the queue is full
+
+    Unlike the stock handler, the message is not formatted here; the
+    listener formats it. Only the traceback is rendered up front, since it
+    refers to frames that are about to change.
+    """
+
+    def prepare(self, record):
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.increment('logging.dropped')
+
+def _start_listener(stream):
+    global _listener
+    output = logging.StreamHandler(stream)
+    output.setFormatter(JsonFormatter())
+    _handler.queue = queue.Queue(LOG_QUEUE_SIZE)
+    _listener = logging.handlers.QueueListener(_handler.queue, output)
+    _listener.start()
+
+def _restart_after_fork():
+    # The listener thread does not survive fork, and its queue's lock may
+    # have been held by another thread at the time; start over with new ones
+    if _listener is not None:
+        _start_listener(_listener.handlers[0].stream)
+
+def configure_logging(stream=None):
+    """Route the root logger through the JSON pipeline (idempotent)"""
+    global _handler
+    if _handler is not None:
+        return _handler
+    stream = stream or sys.stdout
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+
+    if LOG_ASYNC:
+        _handler = NonBlockingQueueHandler(None)
+        _start_listener(stream)
+        os.register_at_fork(after_in_child=_restart_after_fork)
+        atexit.register(shutdown_logging)
+    else:
+        _handler = logging.StreamHandler(stream)
+        _handler.setFormatter(JsonFormatter())
+
+    _handler.addFilter(ContextFilter())
+    root.addHandler(_handler)
+    root.setLevel(LOG_LEVEL)
+    # Not in the JSON output, so skip collecting them for every record
+    logging.logThreads = False
+    logging.logMultiprocessing = False
+    metrics.register('logging', lambda: {'queued': _handler.queue.qsize() if LOG_ASYNC else 0})
+    return _handler
+
+def shutdown_logging():
+    """Write out everything queued and stop the background writer"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
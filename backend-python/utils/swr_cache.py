@@ -0,0 +1,138 @@
+"""
+Stale-while-revalidate cache
+
+Fresh entries are served directly. Once an entry passes ``fresh_ttl`` it is
+still served (flagged stale) while one background refresh runs. If a
+refresh or a synchronous compute fails with a retryable error, the last good
+value is served (flagged stale) for up to ``max_stale`` seconds.
+
+``get_async()`` takes a coroutine function instead and refreshes in a task
+on the running event loop rather than a thread.
+"""
+
+import asyncio
+import threading
+import logging
+import time
+
+from utils import metrics
+from utils.cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+class StaleWhileRevalidateCache:
+    """Cache of computed values keyed by normalized request parameters"""
+
+    def __init__(self, name, fresh_ttl=15.0, max_stale=3600.0, max_size=256, serve_stale_on=(Exception,)):
+        self.name = name
+        self.fresh_ttl = fresh_ttl
+        self.max_stale = max_stale
+        self.serve_stale_on = serve_stale_on
+        self._entries = LRUCache(max_size=max_size)
+        self._refreshing = set()
+        self._tasks = set()
+        self._lock = threading.Lock()
+
+    def get(self, key, compute):
+        """Return (value, stale)"""
+        entry = self._entries.get(key)
+        now = time.time()
+        if entry is not None:
+            value, computed_at = entry
+            age = now - computed_at
+            if age < self.fresh_ttl:
+                return value, False
+            if age < self.max_stale:
+                self._refresh_in_background(key, compute)
+                metrics.increment(f'{self.name}.servedStale')
+                return value, True
+
+        try:
+            value = compute()
+        except self.serve_stale_on:
+            if entry is not None and now - entry[1] < self.max_stale:
+                metrics.increment(f'{self.name}.servedStale')
+                return entry[0], True
+            raise
+        self._entries.set(key, (value, time.time()))
+        return value, False
+
+    async def get_async(self, key, compute):
+        """get() for a coroutine function; returns (value, stale)"""
+        entry = self._entries.get(key)
+        now = time.time()
+        if entry is not None:
+            value, computed_at = entry
+            age = now - computed_at
+            if age < self.fresh_ttl:
+                return value, False
+            if age < self.max_stale:
+                self._refresh_in_task(key, compute)
+                metrics.increment(f'{self.name}.servedStale')
+                return value, True
+
+        try:
+            value = await compute()
+        except self.serve_stale_on:
+            if entry is not None and now - entry[1] < self.max_stale:
+                metrics.increment(f'{self.name}.servedStale')
+                return entry[0], True
+            raise
+        self._entries.set(key, (value, time.time()))
+        return value, False
+
+    def _claim_refresh(self, key):
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+            return True
+
+    def _refreshed(self, key, value=None, error=None):
+        if error is None:
+            self._entries.set(key, (value, time.time()))
+            metrics.increment(f'{self.name}.refreshed')
+        else:
+            metrics.increment(f'{self.name}.refreshFailed')
+            logger.warning('Background refresh failed for %r: %s', key, error)
+        with self._lock:
+            self._refreshing.discard(key)
+
+    def _refresh_in_background(self, key, compute):
+        if not self._claim_refresh(key):
+            return
+
+        def refresh():
+            try:
+                value = compute()
+            except Exception as e:
+                self._refreshed(key, error=e)
+            else:
+                self._refreshed(key, value)
+
+        threading.Thread(target=refresh, name=f'{self.name}-refresh', daemon=True).start()
+
+    def _refresh_in_task(self, key, compute):
+        if not self._claim_refresh(key):
+            return
+
+        async def refresh():
+            try:
+                value = await compute()
+            except Exception as e:
+                self._refreshed(key, error=e)
+            except BaseException:
+                # Cancelled (e.g. at shutdown): let a later request refresh
+                with self._lock:
+                    self._refreshing.discard(key)
+                raise
+            else:
+                self._refreshed(key, value)
+
+        # The loop keeps only weak references to tasks
+        task = asyncio.get_running_loop().create_task(refresh())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def stats(self):
+        return {**self._entries.stats(), 'refreshing': len(self._refreshing)}
@@ -0,0 +1,37 @@
+"""
+Time dimensions of a result's timestamp
+
+Computed once when a result is saved and stored on the item, so analytics
+and filters read them instead of parsing the timestamp on every request.
+Values use the timestamp's own clock (UTC for every stored timestamp).
+"""
+
+from datetime import datetime
+
+from utils.ulid import iso_to_ms
+
+TIME_DIMENSIONS = ('epochMs', 'dateKey', 'hourOfDay', 'timeSlot', 'dayOfWeek')
+
+TIME_SLOTS = ('Night (0-6)', 'Morning (6-12)', 'Afternoon (12-18)', 'Evening (18-24)')
+DAYS_OF_WEEK = ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday')
+
+def time_slot(hour):
+    """Comparison time-of-day bucket for an hour (0-23)"""
+    return TIME_SLOTS[hour // 6]
+
+def time_dimensions(timestamp):
+    """{epochMs, dateKey, hourOfDay, timeSlot, dayOfWeek} for an ISO timestamp
+
+    Raises ValueError for an unparseable timestamp.
+    """
+    dt = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+    return {
+        'epochMs': iso_to_ms(timestamp),
+        'dateKey': timestamp.split('T')[0],
+        'hourOfDay': dt.hour,
+        'timeSlot': time_slot(dt.hour),
+        'dayOfWeek': DAYS_OF_WEEK[dt.weekday()]
+    }
+
+def has_time_dimensions(item):
+    return all(item.get(name) is not None for name in TIME_DIMENSIONS)
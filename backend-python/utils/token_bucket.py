@@ -0,0 +1,31 @@
+"""
+Token bucket for pacing batch jobs (e.g. DynamoDB writes per second)
+"""
+
+import threading
+import time
+
+class TokenBucket:
+    """Thread-safe token bucket; ``acquire()`` blocks until a token is available"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """Take ``tokens``; more than ``burst`` (e.g. consumed capacity reported
+        after the fact) waits for a full bucket and leaves a debt for later callers"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                needed = min(tokens, self.burst)
+                if self.tokens >= needed:
+                    self.tokens -= tokens
+                    return
+                delay = (needed - self.tokens) / self.rate
+            time.sleep(delay)
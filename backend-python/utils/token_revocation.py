@@ -0,0 +1,156 @@
+"""
+Revoked token list
+
+Tokens are identified by a hash and kept until their own expiry. With a file
+path configured, revocations are appended to a shared log so every worker on
+the host sees them; each check only stats the file and reads new lines.
+
+Once most of the log's lines have expired, the worker that notices rewrites
+it with only the live entries and renames it into place. Appends and the
+rewrite are serialized through a ``<path>.lock`` file, and readers that see
+a new inode start over from the beginning of the new file.
+"""
+
+import fcntl
+import os
+import threading
+import time
+
+# Lines in the log before expired ones are worth compacting away
+COMPACT_MIN_LINES = 1000
+
+class RevocationList:
+    """Set of revoked token hashes, optionally shared through an append-only file"""
+
+    def __init__(self, path=None, compact_min_lines=COMPACT_MIN_LINES):
+        self.path = path
+        self.compact_min_lines = compact_min_lines
+        self._revoked = {}          # token hash -> expiry (epoch seconds)
+        self._inode = None
+        self._offset = 0
+        self._lines = 0             # lines read from the current file
+        self._lock = threading.Lock()
+
+    def revoke(self, token_hash, expires_at):
+        self.prune()
+        with self._lock:
+            self._revoked[token_hash] = expires_at
+        if self.path:
+            # O_APPEND writes of a single short line are atomic across processes;
+            # the shared lock only keeps them off a file that is being replaced
+            with self._file_lock(fcntl.LOCK_SH):
+                fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+                try:
+                    os.write(fd, f'{token_hash} {int(expires_at)}\n'.encode())
+                finally:
+                    os.close(fd)
+
+    def is_revoked(self, token_hash):
+        if self.path:
+            self._sync()
+        expires_at = self._revoked.get(token_hash)
+        if expires_at is None:
+            return False
+        if expires_at <= time.time():
+            with self._lock:
+                self._revoked.pop(token_hash, None)
+            return False
+        return True
+
+    def _sync(self):
+        """Read entries appended by other workers since the last check"""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return
+        if stat.st_ino == self._inode and stat.st_size == self._offset:
+            return
+        with self._lock:
+            try:
+                f = open(self.path, 'rb')
+            except OSError:
+                return
+            with f:
+                inode, size = os.fstat(f.fileno()).st_ino, os.fstat(f.fileno()).st_size
+                if inode != self._inode or size < self._offset:
+                    # Compacted by another worker (or truncated/rotated)
+                    self._inode, self._offset, self._lines = inode, 0, 0
+                f.seek(self._offset)
+                chunk = f.read(size - self._offset)
+            # Only consume complete lines; a partial write is picked up next time
+            end = chunk.rfind(b'\n') + 1
+            self._offset += end
+            now = time.time()
+            for line in chunk[:end].splitlines():
+                self._lines += 1
+                try:
+                    token_hash, expires_at = line.decode().split()
+                    if int(expires_at) > now:
+                        self._revoked[token_hash] = int(expires_at)
+                except ValueError:
+                    continue
+            live = sum(1 for exp in self._revoked.values() if exp > now)
+        if self._lines >= self.compact_min_lines and self._lines > 2 * live:
+            self.compact()
+
+    def compact(self):
+        """Rewrite the shared file with only its unexpired entries"""
+        with self._file_lock(fcntl.LOCK_EX):
+            now = time.time()
+            live = {}
+            try:
+                with open(self.path, 'rb') as f:
+                    lines = f.read().splitlines()
+            except OSError:
+                return
+            for line in lines:
+                try:
+                    token_hash, expires_at = line.decode().split()
+                    if int(expires_at) > now:
+                        live[token_hash] = max(int(expires_at), live.get(token_hash, 0))
+                except ValueError:
+                    continue
+            data = ''.join(f'{h} {exp}\n' for h, exp in live.items()).encode()
+            tmp_path = f'{self.path}.{os.getpid()}.tmp'
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            try:
+                os.write(fd, data)
+            finally:
+                os.close(fd)
+            os.replace(tmp_path, self.path)
+            with self._lock:
+                self._revoked.update(live)
+                self._inode = os.stat(self.path).st_ino
+                self._offset, self._lines = len(data), len(live)
+
+    def _file_lock(self, mode):
+        return _FileLock(f'{self.path}.lock', mode)
+
+    def prune(self):
+        """Drop expired entries from memory"""
+        now = time.time()
+        with self._lock:
+            for token_hash in [h for h, exp in self._revoked.items() if exp <= now]:
+                del self._revoked[token_hash]
+
+    def __len__(self):
+        return len(self._revoked)
+
+class _FileLock:
+    """flock() on a lock file for the duration of a ``with`` block"""
+
+    def __init__(self, path, mode):
+        self.path = path
+        self.mode = mode
+        self.fd = None
+
+    def __enter__(self):
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self.fd, self.mode)
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+        finally:
+            os.close(self.fd)
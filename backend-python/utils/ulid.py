@@ -0,0 +1,70 @@
+"""
+ULID helpers
+
+26-character, lexicographically time-sortable IDs: 48 bits of Unix time in
+milliseconds followed by 80 random bits, Crockford base32 encoded.
+"""
+
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+_DECODE = {char: index for index, char in enumerate(ALPHABET)}
+_VALID = frozenset(ALPHABET)
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+_lock = threading.Lock()
+_last_ms = -1
+_last_random = 0
+
+def _encode(value, length):
+    chars = []
+    for _ in range(length):
+        value, index = divmod(value, 32)
+        chars.append(ALPHABET[index])
+    return ''.join(reversed(chars))
+
+def new_ulid(ms=None):
+    """Generate a ULID; IDs made in the same millisecond stay in order"""
+    global _last_ms, _last_random
+    if ms is None:
+        ms = int(time.time() * 1000)
+    with _lock:
+        if ms == _last_ms:
+            _last_random = (_last_random + 1) & ((1 << 80) - 1)
+        else:
+            _last_ms = ms
+            _last_random = int.from_bytes(os.urandom(10), 'big')
+        randomness = _last_random
+    return _encode(ms, 10) + _encode(randomness, 16)
+
+def is_ulid(value):
+    """True for a well-formed ULID (legacy UUIDs are 36 chars with hyphens)"""
+    return isinstance(value, str) and len(value) == 26 and value[0] <= '7' and _VALID.issuperset(value)
+
+def ulid_ms(value):
+    """Milliseconds since the epoch embedded in a ULID"""
+    ms = 0
+    for char in value[:10]:
+        ms = ms * 32 + _DECODE[char]
+    return ms
+
+def ulid_bounds(start_ms, end_ms):
+    """Smallest and largest ULIDs for a time range (inclusive), for BETWEEN filters"""
+    return _encode(start_ms, 10) + '0' * 16, _encode(end_ms, 10) + 'Z' * 16
+
+def ms_to_iso(ms):
+    """Canonical millisecond-precision ISO timestamp, as stored in `timestamp`"""
+    dt = EPOCH + timedelta(milliseconds=ms)
+    return dt.strftime('%Y-%m-%dT%H:%M:%S.') + f'{ms % 1000:03d}Z'
+
+def iso_to_ms(value):
+    """Parse an ISO timestamp ('...Z' or with offset) to epoch milliseconds"""
+    dt = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    delta = dt - EPOCH
+    return delta.days * 86400000 + delta.seconds * 1000 + delta.microseconds // 1000
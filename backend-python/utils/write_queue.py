@@ -0,0 +1,102 @@
+"""
+Local write-behind queue
+
+Holds writes that could not reach storage (throttling, breaker open) and
+replays them from a background thread once storage accepts them again.
+The queue is in-process and bounded; call ``drain()`` on shutdown to flush.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+class QueueFullError(Exception):
+    """The local write queue is at capacity"""
+
+class WriteQueue:
+    """Bounded FIFO of pending writes with a background replay thread"""
+
+    def __init__(self, name, writer, retryable, max_size=10000, retry_delay=1.0, max_delay=30.0):
+        self.name = name
+        self.writer = writer
+        self.retryable = retryable
+        self.max_size = max_size
+        self.retry_delay = retry_delay
+        self.max_delay = max_delay
+        self._items = deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._pid = None
+
+    def enqueue(self, item):
+        with self._cond:
+            if len(self._items) >= self.max_size:
+                metrics.increment(f'{self.name}.rejected')
+                raise QueueFullError(f'{self.name} queue is full')
+            self._items.append(item)
+            metrics.increment(f'{self.name}.queued')
+            self._ensure_worker()
+            self._cond.notify()
+
+    def _ensure_worker(self):
+        # Threads do not survive fork, so track the owning process
+        if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name=f'{self.name}-writer', daemon=True)
+            self._thread.start()
+
+    def _write_one(self):
+        """Try the oldest item; return True if progress was made"""
+        with self._cond:
+            if not self._items:
+                return True
+            item = self._items[0]
+        try:
+            self.writer(item)
+        except Exception as e:
+            if self.retryable(e):
+                return False
+            metrics.increment(f'{self.name}.dropped')
+            logger.warning('Dropping queued %s write after error: %s', self.name, e)
+        else:
+            metrics.increment(f'{self.name}.written')
+        with self._cond:
+            if self._items and self._items[0] is item:
+                self._items.popleft()
+        return True
+
+    def _run(self):
+        delay = self.retry_delay
+        while True:
+            with self._cond:
+                while not self._items:
+                    self._cond.wait()
+            if self._write_one():
+                delay = self.retry_delay
+            else:
+                time.sleep(delay)
+                delay = min(self.max_delay, delay * 2)
+
+    def drain(self, timeout=10.0):
+        """Flush pending writes synchronously; return how many are left
+
+        May race the background thread on the head item; puts are keyed, so a
+        duplicate replay overwrites the same item.
+        """
+        deadline = time.monotonic() + timeout
+        while self._items and time.monotonic() < deadline:
+            if not self._write_one():
+                time.sleep(min(self.retry_delay, max(0.0, deadline - time.monotonic())))
+        return len(self._items)
+
+    def __len__(self):
+        return len(self._items)
+
+    def stats(self):
+        return {'depth': len(self._items), 'maxSize': self.max_size}